@@ -0,0 +1,477 @@
+"""Нагрузочный тест воронки без сети
+
+Приложение собирается через setup_application (то есть build_application и все
+обработчики), но вместо Bot API подключается фейковый транспорт в памяти.
+Тысячи синтетических пользователей одновременно проходят воронку
+/start -> проверка подписки -> обязательное условие -> соцсеть -> фото -> повышение шанса,
+параллельно идут сообщения и вступления в группе.
+
+Запуск:
+    python bench.py --users 2000                     # прогон, результат в bench_results/
+    python bench.py --users 2000 --compare bench_results/XXXX.json   # сравнить с прошлым прогоном
+"""
+import argparse
+import asyncio
+import gc
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any
+
+from telegram.request import BaseRequest, RequestData
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+BOT_ID = 100000
+BENCH_TOKEN = f"{BOT_ID}:BENCH"
+GROUP_ID = -1001000000001
+CHANNEL_ID = -1001000000002
+GROUP_USERNAME = "torgovlya_kfu"
+CHANNEL_USERNAME = "kfu_torgovlya"
+FIRST_USER_ID = 1_000_000
+
+BOT_USER = {"id": BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+GROUP_CHAT = {"id": GROUP_ID, "type": "supergroup", "title": "Bench", "username": GROUP_USERNAME}
+PHOTO_SIZES = [{"file_id": "bench-photo", "file_unique_id": "bench-photo-u", "width": 720, "height": 1280}]
+ADMIN_RIGHTS = {
+    "can_be_edited": False,
+    "is_anonymous": False,
+    "can_manage_chat": True,
+    "can_delete_messages": True,
+    "can_manage_video_chats": False,
+    "can_restrict_members": True,
+    "can_promote_members": False,
+    "can_change_info": False,
+    "can_invite_users": True,
+    "can_post_stories": False,
+    "can_edit_stories": False,
+    "can_delete_stories": False,
+}
+
+
+def is_subscribed(user_id: int, ratio: float) -> bool:
+    """Детерминированно решает, подписан ли синтетический пользователь"""
+    return (user_id * 2654435761) % 1000 < ratio * 1000
+
+
+class FakeBotApi(BaseRequest):
+    """Транспорт Bot API в памяти: отвечает правдоподобными объектами с заданной задержкой"""
+
+    def __init__(self, latency: float = 0.0, subscribed_ratio: float = 0.8, poster_path: str | None = None) -> None:
+        self.latency = latency
+        self.subscribed_ratio = subscribed_ratio
+        self.poster_path = poster_path
+        self._story: Any = None
+        self.calls: dict[str, int] = defaultdict(int)
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData | None = None,
+        read_timeout: Any = None,
+        write_timeout: Any = None,
+        connect_timeout: Any = None,
+        pool_timeout: Any = None,
+    ) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        if "/file/bot" in url:
+            endpoint = "downloadFile"
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if endpoint == "downloadFile":
+            return 200, self._image(url.rsplit("/", 1)[-1])
+        params = request_data.parameters if request_data else {}
+        result = self._respond(endpoint, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _message(self, params: dict[str, Any], **fields: Any) -> dict[str, Any]:
+        chat_id = params.get("chat_id", 0)
+        chat = GROUP_CHAT if chat_id == GROUP_ID else {"id": chat_id, "type": "private", "first_name": "User"}
+        return {
+            "message_id": params.get("message_id") or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": chat,
+            "from": BOT_USER,
+            **fields,
+        }
+
+    def _image(self, name: str) -> bytes:
+        """Уникальный скриншот для каждого файла: афиша на экране сторис и шум вместо интерфейса
+
+        Без афиши - картинка-шум (проверка скриншотов её отклонит).
+        """
+        if Image is None:
+            return b""
+        buffer = io.BytesIO()
+        noise = random.Random(name).randbytes
+        if self.poster_path is None or not os.path.exists(self.poster_path):
+            Image.frombytes("L", (64, 64), noise(64 * 64)).save(buffer, "PNG")
+            return buffer.getvalue()
+        if self._story is None:
+            self._story = Image.new("RGB", (360, 640))
+            with Image.open(self.poster_path) as poster:
+                poster = poster.convert("RGB")
+                poster = poster.resize((360, round(360 * poster.height / poster.width)))
+                self._story.paste(poster, (0, (640 - poster.height) // 2))
+        story = self._story.copy()
+        story.paste(Image.frombytes("L", (360, 48), noise(360 * 48)), (0, 0))
+        story.save(buffer, "JPEG", quality=85)
+        return buffer.getvalue()
+
+    def _chat_member(self, params: dict[str, Any]) -> dict[str, Any]:
+        user_id = int(params["user_id"])
+        user = {"id": user_id, "is_bot": user_id == BOT_ID, "first_name": "User"}
+        if user_id == BOT_ID:
+            return {"status": "administrator", "user": user, **ADMIN_RIGHTS}
+        if is_subscribed(user_id, self.subscribed_ratio):
+            return {"status": "member", "user": user}
+        return {"status": "left", "user": user}
+
+    def _respond(self, endpoint: str, params: dict[str, Any]) -> Any:
+        if endpoint == "getMe":
+            return {**BOT_USER, "can_join_groups": True, "can_read_all_group_messages": True,
+                    "supports_inline_queries": False}
+        if endpoint == "getChat":
+            is_channel = str(params.get("chat_id")).lstrip("@") == CHANNEL_USERNAME
+            return {
+                "id": CHANNEL_ID if is_channel else GROUP_ID,
+                "type": "channel" if is_channel else "supergroup",
+                "title": "Bench",
+                "username": CHANNEL_USERNAME if is_channel else GROUP_USERNAME,
+                "accent_color_id": 0,
+                "max_reaction_count": 11,
+            }
+        if endpoint == "getChatMember":
+            return self._chat_member(params)
+        if endpoint == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": f"{file_id}-u", "file_path": f"photos/{file_id}.png"}
+        if endpoint in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        if endpoint in ("sendPhoto", "editMessageMedia", "editMessageCaption"):
+            return self._message(params, photo=PHOTO_SIZES, caption=params.get("caption", ""))
+        # answerCallbackQuery, deleteMessage(s), banChatMember, unbanChatMember и прочее
+        return True
+
+
+class UpdateFactory:
+    """Собирает JSON обновлений так, как их присылает Telegram"""
+
+    def __init__(self) -> None:
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id: int) -> dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, chat: dict[str, Any], **fields: Any) -> dict[str, Any]:
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": chat,
+                "from": self.user(user_id),
+                **fields,
+            },
+        }
+
+    def command(self, user_id: int, command: str) -> dict[str, Any]:
+        chat = {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+        entities = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return self._message(user_id, chat, text=command, entities=entities)
+
+    def photo(self, user_id: int) -> dict[str, Any]:
+        # Каждый скриншот - отдельный файл, иначе все они окажутся повторами
+        chat = {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+        file_id = f"shot-{next(self._message_ids)}"
+        sizes = [
+            {"file_id": f"{file_id}-s", "file_unique_id": f"{file_id}-su", "width": 320, "height": 640},
+            {"file_id": file_id, "file_unique_id": f"{file_id}-u", "width": 720, "height": 1280},
+        ]
+        return self._message(user_id, chat, photo=sizes)
+
+    def callback(self, user_id: int, data: str, on_photo: bool = False) -> dict[str, Any]:
+        chat = {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": chat, "from": BOT_USER}
+        if on_photo:
+            message["photo"] = PHOTO_SIZES
+            message["caption"] = "poster"
+        else:
+            message["text"] = "menu"
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self.user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": message,
+            },
+        }
+
+    def group_text(self, user_id: int, text: str) -> dict[str, Any]:
+        return self._message(user_id, GROUP_CHAT, text=text)
+
+    def join(self, user_ids: list[int]) -> dict[str, Any]:
+        return self._message(user_ids[0], GROUP_CHAT, new_chat_members=[self.user(uid) for uid in user_ids])
+
+
+def funnel_steps(bot_module: Any, factory: UpdateFactory, user_id: int) -> list[tuple[str, dict[str, Any]]]:
+    """Шаги воронки одного пользователя: (название шага, обновление)"""
+    return [
+        ("start", factory.command(user_id, "/start")),
+        ("next_to_subscription", factory.callback(user_id, bot_module.NEXT_TO_SUBSCRIPTION)),
+        ("next_to_required", factory.callback(user_id, bot_module.NEXT_TO_REQUIRED)),
+        ("required_story", factory.callback(user_id, bot_module.REQUIRED_STORY, on_photo=True)),
+        ("social_required", factory.callback(user_id, bot_module.SOCIAL_TELEGRAM, on_photo=True)),
+        ("photo_required", factory.photo(user_id)),
+        ("boost_chance", factory.callback(user_id, bot_module.BOOST_CHANCE)),
+        ("social_boost", factory.callback(user_id, bot_module.SOCIAL_WHATSAPP)),
+        ("photo_boost", factory.photo(user_id)),
+        ("my_tickets", factory.callback(user_id, bot_module.MY_TICKETS)),
+    ]
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса (Linux), иначе пиковый"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Recorder:
+    """Время обработки обновлений по шагам
+
+    Одновременно обрабатывается не больше concurrency обновлений, как в Application
+    с concurrent_updates(True) (256), иначе в задержку попадает очередь из всех пользователей.
+    """
+
+    def __init__(self, concurrency: int) -> None:
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def feed(self, application: Any, step: str, data: dict[str, Any]) -> None:
+        from telegram import Update
+
+        update = Update.de_json(data, application.bot)
+        async with self._slots:
+            started = time.perf_counter()
+            await application.process_update(update)
+            self.samples[step].append(time.perf_counter() - started)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        steps = {}
+        for step, values in sorted(self.samples.items()):
+            ordered = sorted(values)
+            steps[step] = {
+                "count": len(ordered),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+                "max_ms": round(ordered[-1] * 1000, 3),
+            }
+        return steps
+
+    def all_sorted(self) -> list[float]:
+        return sorted(value for values in self.samples.values() for value in values)
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict[str, Any]:
+    import bot
+    from ratelimit import PriorityRateLimiter
+    from webhook import running_application
+
+    api = FakeBotApi(
+        latency=args.api_latency / 1000,
+        subscribed_ratio=args.subscribed_ratio,
+        poster_path=bot._primary.poster,
+    )
+    # По умолчанию лимиты Bot API выключены: измеряем собственную стоимость обработки
+    rate_limiter = None if args.rate_limit else PriorityRateLimiter(
+        bot._api_metrics, overall_rate=0, chat_limits=False
+    )
+    application = bot.setup_application(BENCH_TOKEN, request=api, rate_limiter=rate_limiter)
+    factory = UpdateFactory()
+    recorder = Recorder(args.concurrency)
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+
+    async def verified(user_id: int) -> None:
+        # Скриншот проверяется в фоне: следующий шаг пользователь делает после ответа
+        while application.user_data[user_id].get("screenshot_pending_at"):
+            await asyncio.sleep(0.01)
+
+    async def user_session(user_id: int) -> None:
+        for step, data in funnel_steps(bot, factory, user_id):
+            await recorder.feed(application, step, data)
+            if step.startswith("photo_"):
+                await verified(user_id)
+
+    async def group_session(user_id: int) -> None:
+        for i in range(args.group_messages):
+            await recorder.feed(application, "group_message", factory.group_text(user_id, f"сообщение {i}"))
+
+    async def join_session(batch: list[int]) -> None:
+        await recorder.feed(application, "join_burst", factory.join(batch))
+
+    async with running_application(application):
+        gc.collect()
+        if args.trace_memory:
+            tracemalloc.start()
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(join_session(user_ids[i:i + args.join_burst]) for i in range(0, len(user_ids), args.join_burst)),
+            *(user_session(user_id) for user_id in user_ids),
+            *(group_session(user_id) for user_id in user_ids),
+        )
+        elapsed = time.perf_counter() - started
+        gc.collect()
+        rss_after = rss_bytes()
+        traced = None
+        if args.trace_memory:
+            traced, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        handler_errors = bot._handler_metrics.errors.total()
+
+    latencies = recorder.all_sorted()
+    total_updates = len(latencies)
+    result = {
+        "config": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "group_messages": args.group_messages,
+            "join_burst": args.join_burst,
+            "api_latency_ms": args.api_latency,
+            "subscribed_ratio": args.subscribed_ratio,
+            "rate_limit": args.rate_limit,
+            "storage": args.storage,
+            "verify_workers": args.verify_workers,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "updates": total_updates,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(total_updates / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "rss_per_user_bytes": max(0, rss_after - rss_before) // max(1, args.users),
+        "handler_errors": int(handler_errors),
+        "api_calls": dict(sorted(api.calls.items())),
+        "verification": bot._verifier.stats(),
+        "steps": recorder.summary(),
+    }
+    if traced is not None:
+        result["traced_per_user_bytes"] = traced // max(1, args.users)
+    return result
+
+
+def print_report(result: dict[str, Any], baseline: dict[str, Any] | None) -> None:
+    def delta(key: str) -> str:
+        if not baseline or not baseline.get(key):
+            return ""
+        change = (result[key] - baseline[key]) / baseline[key] * 100
+        return f"  ({change:+.1f}% к {baseline[key]})"
+
+    print(f"Обновлений: {result['updates']} за {result['seconds']} с")
+    print(f"Обновлений/с: {result['updates_per_sec']}{delta('updates_per_sec')}")
+    print(f"p50: {result['p50_ms']} мс{delta('p50_ms')}")
+    print(f"p99: {result['p99_ms']} мс{delta('p99_ms')}")
+    print(f"Память на пользователя (RSS): {result['rss_per_user_bytes']} байт{delta('rss_per_user_bytes')}")
+    if "traced_per_user_bytes" in result:
+        print(f"Память на пользователя (tracemalloc): {result['traced_per_user_bytes']} байт")
+    print(f"Ошибок в обработчиках: {result['handler_errors']}")
+    print(f"Проверка скриншотов: {result['verification']}")
+    print(f"Вызовов Bot API: {sum(result['api_calls'].values())} {result['api_calls']}")
+    print(f"{'шаг':<22}{'кол-во':>8}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for step, stats in result["steps"].items():
+        print(f"{step:<22}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Точка входа командной строки"""
+    parser = argparse.ArgumentParser(description="Нагрузочный тест воронки бота без сети")
+    parser.add_argument("--users", type=int, default=1000, help="число синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=256, help="обновлений в обработке одновременно")
+    parser.add_argument("--group-messages", type=int, default=2, help="сообщений в группе на пользователя")
+    parser.add_argument("--join-burst", type=int, default=20, help="участников в одном событии вступления")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка фейкового Bot API, мс")
+    parser.add_argument("--subscribed-ratio", type=float, default=0.8, help="доля подписанных пользователей")
+    parser.add_argument("--rate-limit", action="store_true", help="оставить лимиты Bot API как в бою")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory", help="хранилище участников")
+    parser.add_argument("--verify-workers", type=int, default=2, help="процессов проверки скриншотов (0 - без проверки)")
+    parser.add_argument("--trace-memory", action="store_true", help="дополнительно считать память через tracemalloc")
+    parser.add_argument("--out-dir", default="bench_results", help="папка для результатов")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--log-level", default="WARNING", help="уровень логов бота")
+    args = parser.parse_args(argv)
+
+    # Все файлы бота - во временной папке, сервер метрик не нужен
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.environ.update({
+        "LOG_LEVEL": args.log_level,
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "STORAGE_BACKEND": args.storage,
+        "DB_PATH": os.path.join(workdir, "bench.db"),
+        "MEMBERSHIP_INDEX_PATH": os.path.join(workdir, "membership.json"),
+        "CLEANUP_QUEUE_PATH": os.path.join(workdir, "cleanup_queue.json"),
+        "MEDIA_CACHE_PATH": os.path.join(workdir, "media_cache.json"),
+        "TICKET_LEDGER_PATH": os.path.join(workdir, "tickets.jsonl"),
+        "METRICS_PORT": "0",
+        "VERIFY_WORKERS": str(args.verify_workers),
+    })
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    result = asyncio.run(run_benchmark(args))
+    print_report(result, baseline)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    path = os.path.join(args.out_dir, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Результат: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
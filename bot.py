@@ -1,51 +1,77 @@
+import argparse
 import asyncio
+import json
 import logging
 import os
 import time
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from typing import Iterator
 
 from dotenv import load_dotenv
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, Message, Update
 from telegram.constants import ChatMemberStatus
-from telegram.error import Conflict
+from telegram.error import BadRequest, Conflict, TelegramError
+from telegram.request import BaseRequest
 from telegram.ext import (
-    AIORateLimiter,
     Application,
+    BaseRateLimiter,
+    CallbackContext,
     CallbackQueryHandler,
+    ChatMemberHandler,
     CommandHandler,
     ContextTypes,
     MessageHandler,
     filters,
 )
 
-# Настройка логирования (на сервере логи могут идти в stdout)
-log_level = os.getenv("LOG_LEVEL", "INFO").upper()
-logging.basicConfig(
-    format="%(asctime)s %(levelname)s %(name)s %(message)s",
-    level=getattr(logging, log_level, logging.INFO),
-    handlers=[
-        logging.StreamHandler()  # Для серверных платформ логи идут в stdout
-    ]
+from cache import TTLCache
+from export import FORMATS as EXPORT_FORMATS, export_filename, export_to_file
+from giveaways import Giveaway, GiveawayRuntime, load_giveaways
+from ledger import REASON_ADMIN, REASON_BOOST_SOCIAL, REASON_REQUIRED_STORY, TicketEvent, create_ledger
+from logs import setup_logging
+from media_cache import MediaCache
+from membership import MembershipIndex
+from metrics import (
+    ApiMetrics,
+    HandlerMetrics,
+    MetricsRegistry,
+    Readiness,
+    create_metrics_server,
+)
+from moderation import GroupModeration
+from persistence import SqliteUserDataPersistence, create_persistence
+from ratelimit import PriorityRateLimiter
+from reverify import Reverification, ReverificationRun
+from router import CallbackRouter
+from scheduler import DeletionScheduler
+from screenshots import ScreenshotIndex
+from storage import UserRecord, create_store, database_path
+from sharding import jump_hash, run_sharded
+from stats import FLAG_PREFIX, GiveawayStats, ParticipantSummary, SharedStats
+from verification import ScreenshotVerifier, VerificationJob, VerificationResult
+from webhook import WebhookConfig, run_webhook
+
+# Логирование через очередь и фоновый поток (logs.py): запись в stdout и файл не блокирует event loop
+_logs = setup_logging(
+    os.getenv("LOG_LEVEL", "INFO"),
+    path=os.getenv("LOG_FILE", "bot.log") or None,  # LOG_FILE= - только stdout
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backups=int(os.getenv("LOG_BACKUPS", "5")),
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    # Одинаковых сообщений (например, ошибка проверки подписки в одном чате) - не больше
+    # LOG_SAMPLE_BURST за LOG_SAMPLE_WINDOW секунд, остальные только считаются
+    sample_window=float(os.getenv("LOG_SAMPLE_WINDOW", "10")),
+    sample_burst=int(os.getenv("LOG_SAMPLE_BURST", "5")),
 )
-# Добавляем файловый лог только если файл доступен для записи
-try:
-    file_handler = logging.FileHandler("bot.log", encoding="utf-8")
-    file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
-    logging.getLogger().addHandler(file_handler)
-except (PermissionError, OSError):
-    pass  # На некоторых серверах файловые логи недоступны, используем только stdout
 
 logger = logging.getLogger(__name__)
 
-TARGET_CHAT = "@torgovlya_kfu"
-CHAT_URL = "https://t.me/torgovlya_kfu"
-TARGET_CHANNEL = "@kfu_torgovlya"
-CHANNEL_URL = "https://t.me/kfu_torgovlya"
-# Ссылка на пост с розыгрышем (будет обновлена позже)
-GIVEAWAY_POST_URL = "https://t.me/torgovlya_kfu/1"  # TODO: заменить на реальную ссылку
-# Дата итогов розыгрыша
-GIVEAWAY_END_DATE = "14.12.2025"  # Воскресенье
-# Путь к изображению для сторис (афиша розыгрыша)
-STORY_IMAGE_PATH = "story_image.png"  # Изображение для сторис
+# Розыгрыши (чат и канал, афиша, сроки) из файла; без файла - один розыгрыш main (giveaways.py)
+GIVEAWAYS_PATH = os.getenv("GIVEAWAYS_PATH", "giveaways.json")
+_giveaways = load_giveaways(GIVEAWAYS_PATH)
+# Главный розыгрыш: /start без параметра, модерация группы и вступления
+_primary = _giveaways.primary
 
 # Callback data константы
 CHECK_SUBSCRIPTION = "check_subscription"
@@ -60,291 +86,883 @@ NEXT_PAGE = "next_page"  # Кнопка "Далее" для перехода к
 NEXT_TO_SUBSCRIPTION = "next_to_subscription"  # Переход к окну проверки подписки
 NEXT_TO_REQUIRED = "next_to_required"  # Переход к окну обязательного условия
 NEXT_TO_BOOST = "next_to_boost"  # Переход к окну увеличения шансов
-
-# Кэш для проверки подписки: {user_id: (is_member: bool, timestamp: float)}
-_subscription_cache: dict[int, tuple[bool, float]] = {}
+BACK_TO_MAIN_MENU = "back_to_main_menu"  # Возврат в главное меню (профиль)
+
+# Соцсети: (название, callback, эмодзи)
+SOCIALS = [
+    ("Telegram", SOCIAL_TELEGRAM, "📱"),
+    ("WhatsApp", SOCIAL_WHATSAPP, "💬"),
+    ("Instagram", SOCIAL_INSTAGRAM, "📸"),
+]
+SOCIAL_EMOJIS = {name: emoji for name, _, emoji in SOCIALS}
+
+# Администраторы розыгрыша (user_id через запятую): команда /export
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+# Одновременных проверок при перепроверке участников (/reverify), на RetryAfter снижается сама
+REVERIFY_CONCURRENCY = int(os.getenv("REVERIFY_CONCURRENCY", "16"))
+
+# Метрики в формате Prometheus (/metrics), /livez и /readyz на локальном порту
+# (METRICS_PORT=0 - не запускать сервер метрик)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+_metrics = MetricsRegistry()
+_handler_metrics = HandlerMetrics(_metrics)
+_api_metrics = ApiMetrics(_metrics)
+# Общий лимит запросов к Bot API в секунду; выдаётся по приоритету полос (ratelimit.py)
+API_RATE_LIMIT = float(os.getenv("API_RATE_LIMIT", "30"))
+_rate_limiter = PriorityRateLimiter(_api_metrics, overall_rate=API_RATE_LIMIT, overall_burst=API_RATE_LIMIT)
+_readiness = Readiness()  # Результаты стартовых проверок check_bot_permissions
+
+# Таблица обработчиков кнопок: callback_data -> обработчик
+_callbacks = CallbackRouter(observer=_handler_metrics.observe_route)
+
+# Кэш для проверки подписки: {(чаты розыгрыша, user_id): is_member}
 CACHE_TTL = 300  # 5 минут кэш
+CACHE_MAX_ENTRIES = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "100000"))  # Лимит записей (память)
+_subscription_cache = TTLCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+
+# Статусы, при которых пользователь считается подписанным
+MEMBER_STATUSES = (
+    ChatMemberStatus.MEMBER,
+    ChatMemberStatus.ADMINISTRATOR,
+    ChatMemberStatus.RESTRICTED,
+)
 
-# Хранилище билетов пользователей: {user_id: количество_билетов}
-_user_tickets: dict[int, int] = {}
+# Модерация группы: одно предупреждение неподписанному пользователю за окно,
+# в пределах окна его сообщения удаляются без повторной проверки подписки
+MODERATION_WINDOW = 60  # секунд
+_moderation = GroupModeration(window=MODERATION_WINDOW, max_entries=CACHE_MAX_ENTRIES)
 
-# Хранилище обязательных условий: {user_id: выполнено_ли_обязательное_условие}
-_required_condition_done: dict[int, bool] = {}
+# Очередь отложенного удаления предупреждений/приветствий (переживает перезапуск)
+_cleanup = DeletionScheduler(os.getenv("CLEANUP_QUEUE_PATH", "cleanup_queue.json"))
 
-# Хранилище выбранной соцсети для обязательного условия: {user_id: название_соцсети}
-_required_social: dict[int, str] = {}
+# Сколько новых участников проверяем одновременно при массовом вступлении
+JOIN_CONCURRENCY = int(os.getenv("JOIN_CONCURRENCY", "10"))
+_join_slots = asyncio.Semaphore(JOIN_CONCURRENCY)
 
-# Хранилище использованных соцсетей для дополнительных билетов: {user_id: set[название_соцсети]}
-_used_boost_socials: dict[int, set[str]] = {}
+# Индекс участников чата и канала по событиям chat_member (сохраняется на диск)
+# Статус старше MEMBERSHIP_MAX_AGE секунд перепроверяется через API
+_membership = MembershipIndex(
+    _giveaways.targets(),
+    path=os.getenv("MEMBERSHIP_INDEX_PATH", "membership.json"),
+    max_age=float(os.getenv("MEMBERSHIP_MAX_AGE", str(6 * 3600))),
+)
 
-# Кэш изображения для сторис (загружается один раз при первом использовании)
-_story_image_bytes: bytes | None = None
+# Выполняющиеся проверки подписки: {(user_id, chat_id): задача с результатом}
+_inflight_checks: dict[tuple[int, str], asyncio.Task] = {}
 
 
-def get_user_tickets(user_id: int) -> int:
-    """Возвращает количество билетов пользователя"""
-    return _user_tickets.get(user_id, 0)
+
+def _create_runtime(giveaway: Giveaway) -> GiveawayRuntime:
+    store = create_store(giveaway.store_namespace)
+    return GiveawayRuntime(
+        giveaway=giveaway,
+        store=store,
+        ledger=create_ledger(giveaway.store_namespace, before_snapshot=store.flush),
+        stats=GiveawayStats(flag_prefix=giveaway.state_key(FLAG_PREFIX)),
+        reverification=Reverification(
+            database_path(), store, concurrency=REVERIFY_CONCURRENCY, name=giveaway.store_namespace
+        ),
+    )
+
+
+# Для каждого розыгрыша:
+# - хранилище участников: билеты, обязательное условие, выбранные соцсети
+#   (SQLite по умолчанию, STORAGE_BACKEND=memory - только в памяти);
+# - журнал билетов: каждое начисление и списание с причиной (TICKET_LEDGER_PATH);
+# - воронка и распределение билетов (обновляются при каждом изменении участника);
+# - перепроверка подписки участников перед розыгрышем (прогресс в той же базе)
+_runtimes = {giveaway.key: _create_runtime(giveaway) for giveaway in _giveaways}
+
+
+def _runtime(giveaway: Giveaway) -> GiveawayRuntime:
+    return _runtimes[giveaway.key]
+
+
+# Многопроцессный режим (sharding.py): (номер воркера, всего воркеров), иначе None.
+# Пользователи поделены между воркерами: каждый считает статистику своих пользователей
+# и публикует её в общую базу, /stats складывает счётчики всех воркеров
+_shard: tuple[int, int] | None = None
+_shared_stats: SharedStats | None = None
+_published_stats: dict[str, str] = {}  # Последние опубликованные счётчики воркера по розыгрышам
+STATS_PUBLISH_INTERVAL = 5  # Секунды между публикациями счётчиков воркера
+
+
+# Кэш file_id изображения для сторис (загружается в Telegram один раз)
+_media_cache = MediaCache(os.getenv("MEDIA_CACHE_PATH", "media_cache.json"))
+
+# Присланные скриншоты: повтор файла или похожая картинка не дают билет
+# (SCREENSHOT_DUPLICATES=flag - только отмечать в базе и логе)
+SCREENSHOT_MAX_DISTANCE = int(os.getenv("SCREENSHOT_MAX_DISTANCE", "6"))  # Бит из 64 в dHash
+REJECT_DUPLICATE_SCREENSHOTS = os.getenv("SCREENSHOT_DUPLICATES", "reject").lower() != "flag"
+_screenshots = ScreenshotIndex(database_path(), max_distance=SCREENSHOT_MAX_DISTANCE)
+
+# Проверка скриншотов (размер, пропорции, афиша) в пуле процессов с ограниченной очередью
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+VERIFY_QUEUE_SIZE = int(os.getenv("VERIFY_QUEUE_SIZE", "500"))
+SCREENSHOT_PENDING_TIMEOUT = 300  # Секунд, после которых незавершённая проверка не блокирует новую
+_verification_seconds = _metrics.histogram(
+    "bot_screenshot_verification_seconds", "Время от постановки скриншота в очередь до результата", (),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+_verifier = ScreenshotVerifier(
+    _primary.poster,
+    workers=VERIFY_WORKERS,
+    queue_size=VERIFY_QUEUE_SIZE,
+    observer=_verification_seconds.observe,
+)
+
+# Состояние кэшей и очередей снимается в момент запроса /metrics
+_metrics.gauge_callback(
+    "bot_subscription_cache_entries", "Записей в кэше подписок", (),
+    lambda: {(): len(_subscription_cache)},
+)
+_metrics.counter_callback(
+    "bot_subscription_cache_events_total", "События кэша подписок", ("event",),
+    lambda: {
+        (event,): _subscription_cache.stats()[event]
+        for event in ("hits", "misses", "evictions", "expirations")
+    },
+)
+_metrics.gauge_callback(
+    "bot_subscription_checks_inflight", "Выполняющиеся проверки подписки через API", (),
+    lambda: {(): len(_inflight_checks)},
+)
+_metrics.gauge_callback(
+    "bot_moderation_offenders", "Неподписанные пользователи в негативном кэше", (),
+    lambda: {(): _moderation.stats()["offenders"]},
+)
+_metrics.counter_callback(
+    "bot_moderation_warnings_total", "Предупреждения в группе", ("result",),
+    lambda: {
+        ("sent",): _moderation.warnings_sent,
+        ("suppressed",): _moderation.warnings_suppressed,
+    },
+)
+_metrics.gauge_callback(
+    "bot_cleanup_pending", "Сообщения в очереди отложенного удаления", (),
+    lambda: {(): len(_cleanup)},
+)
+_metrics.gauge_callback(
+    "bot_screenshot_queue_depth", "Скриншоты в очереди проверки", (),
+    lambda: {(): _verifier.queue_depth},
+)
+_metrics.gauge_callback(
+    "bot_screenshot_in_progress", "Скриншоты, которые сейчас проверяются", (),
+    lambda: {(): _verifier.in_progress},
+)
+_metrics.counter_callback(
+    "bot_screenshot_results_total", "Результаты проверки скриншотов", ("result",),
+    lambda: {
+        **{(outcome,): count for outcome, count in _verifier.results.items()},
+        ("queue_full",): _verifier.rejected_full,
+    },
+)
+_metrics.counter_callback(
+    "bot_screenshot_pool_restarts_total", "Перезапуски пула проверки после аварийного завершения процесса", (),
+    lambda: {(): _verifier.pool_restarts},
+)
+_metrics.gauge_callback(
+    "bot_api_lane_queue_depth", "Запросы к Bot API, ждущие лимита, по полосам", ("lane",),
+    lambda: {(lane,): depth for lane, depth in _rate_limiter.queue_depths().items()},
+)
+_metrics.gauge_callback(
+    "bot_funnel_users", "Пользователи, дошедшие до шага воронки", ("giveaway", "step"),
+    lambda: {
+        (key, step): count
+        for key, runtime in _runtimes.items()
+        for step, count, _ in runtime.stats.funnel()
+    },
+)
+_metrics.gauge_callback(
+    "bot_tickets", "Выдано билетов", ("giveaway",),
+    lambda: {(key,): runtime.stats.total_tickets for key, runtime in _runtimes.items()},
+)
+_metrics.counter_callback(
+    "bot_ticket_ledger_events_total", "События журнала билетов", ("giveaway",),
+    lambda: {(key,): runtime.ledger.seq for key, runtime in _runtimes.items()},
+)
+_metrics.gauge_callback(
+    "bot_log_queue_depth", "Записи лога, ждущие вывода в фоновом потоке", (),
+    lambda: {(): _logs.stats()["queued"]},
+)
+_metrics.counter_callback(
+    "bot_log_records_total", "Записи лога, не попавшие в вывод", ("result",),
+    lambda: {("dropped",): _logs.handler.dropped, ("sampled",): _logs.sampler.sampled},
+)
+_metrics.counter_callback(
+    "bot_cleanup_messages_total", "Обработанные отложенные удаления", ("result",),
+    lambda: {("deleted",): _cleanup.deleted, ("failed",): _cleanup.failed},
+)
 
 
-def add_ticket(user_id: int, count: int = 1) -> int:
-    """Добавляет билет(ы) пользователю и возвращает новое количество"""
-    current = _user_tickets.get(user_id, 0)
-    _user_tickets[user_id] = current + count
-    return _user_tickets[user_id]
+@contextmanager
+def _edit_participant(giveaway: Giveaway, user_id: int) -> Iterator[UserRecord]:
+    """Изменение участника розыгрыша с обновлением статистики"""
+    runtime = _runtime(giveaway)
+    before = ParticipantSummary.of(runtime.store.get(user_id))
+    with runtime.store.edit(user_id) as record:
+        yield record
+    runtime.stats.update(before, record)
 
 
-def has_required_condition(user_id: int) -> bool:
+def get_user_tickets(giveaway: Giveaway, user_id: int) -> int:
+    """Возвращает количество билетов пользователя"""
+    record = _runtime(giveaway).store.get(user_id)
+    return record.tickets if record else 0
+
+
+def add_ticket(
+    giveaway: Giveaway,
+    user_id: int,
+    count: int,
+    reason: str,
+    social: str | None = None,
+    admin_id: int | None = None,
+    note: str | None = None,
+) -> int:
+    """Добавляет (count < 0 - списывает, не ниже нуля) билеты и записывает изменение в журнал
+    Возвращает новое количество"""
+    with _edit_participant(giveaway, user_id) as record:
+        count = max(count, -record.tickets)
+        record.tickets += count
+    if count:
+        _runtime(giveaway).ledger.record(user_id, count, record.tickets, reason, social, admin_id, note)
+    return record.tickets
+
+
+def has_required_condition(giveaway: Giveaway, user_id: int) -> bool:
     """Проверяет, выполнено ли обязательное условие"""
-    return _required_condition_done.get(user_id, False)
+    record = _runtime(giveaway).store.get(user_id)
+    return record.required_done if record else False
 
 
-def set_required_condition(user_id: int, done: bool = True) -> None:
+def set_required_condition(giveaway: Giveaway, user_id: int, done: bool = True) -> None:
     """Устанавливает статус обязательного условия"""
-    _required_condition_done[user_id] = done
+    with _edit_participant(giveaway, user_id) as record:
+        record.required_done = done
 
 
-def get_required_social(user_id: int) -> str | None:
+def get_required_social(giveaway: Giveaway, user_id: int) -> str | None:
     """Возвращает выбранную соцсеть для обязательного условия"""
-    return _required_social.get(user_id)
+    record = _runtime(giveaway).store.get(user_id)
+    return record.required_social if record else None
 
 
-def set_required_social(user_id: int, social: str) -> None:
+def set_required_social(giveaway: Giveaway, user_id: int, social: str) -> None:
     """Устанавливает выбранную соцсеть для обязательного условия"""
-    _required_social[user_id] = social
+    with _edit_participant(giveaway, user_id) as record:
+        record.required_social = social
 
 
-def get_used_boost_socials(user_id: int) -> set[str]:
+def get_used_boost_socials(giveaway: Giveaway, user_id: int) -> set[str]:
     """Возвращает множество использованных соцсетей для дополнительных билетов"""
-    return _used_boost_socials.get(user_id, set())
+    record = _runtime(giveaway).store.get(user_id)
+    return record.boost_socials if record else set()
 
 
-def add_used_boost_social(user_id: int, social: str) -> None:
+def add_used_boost_social(giveaway: Giveaway, user_id: int, social: str) -> None:
     """Добавляет соцсеть в список использованных для дополнительных билетов"""
-    if user_id not in _used_boost_socials:
-        _used_boost_socials[user_id] = set()
-    _used_boost_socials[user_id].add(social)
+    with _edit_participant(giveaway, user_id) as record:
+        record.boost_socials.add(social)
 
 
-def get_remaining_socials(user_id: int) -> list[tuple[str, str, str]]:
-    """Возвращает список оставшихся соцсетей (название, callback, эмодзи)
-    Исключает соцсеть для обязательного условия и уже использованные для дополнительных билетов"""
-    required = get_required_social(user_id)
-    used_boost = get_used_boost_socials(user_id)
-    all_socials = [
-        ("Telegram", SOCIAL_TELEGRAM, "📱"),
-        ("WhatsApp", SOCIAL_WHATSAPP, "💬"),
-        ("Instagram", SOCIAL_INSTAGRAM, "📸"),
-    ]
+def _build_remaining_socials(
+    required: str | None, used_boost: frozenset[str]
+) -> tuple[tuple[str, str, str], ...]:
     # Исключаем обязательную соцсеть и уже использованные для дополнительных билетов
-    return [
-        (name, callback, emoji) 
-        for name, callback, emoji in all_socials 
+    return tuple(
+        (name, callback, emoji)
+        for name, callback, emoji in SOCIALS
         if name != required and name not in used_boost
+    )
+
+
+def _all_social_states() -> list[tuple[str | None, frozenset[str]]]:
+    """Все сочетания (обязательная соцсеть, использованные соцсети)"""
+    names = [name for name, _, _ in SOCIALS]
+    used_variants = [
+        frozenset(name for bit, name in enumerate(names) if mask & (1 << bit))
+        for mask in range(1 << len(names))
     ]
+    return [(required, used) for required in (None, *names) for used in used_variants]
+
+
+# Оставшиеся соцсети для каждого состояния пользователя (считаются один раз при запуске)
+_REMAINING_SOCIALS = {
+    state: _build_remaining_socials(*state) for state in _all_social_states()
+}
+
+
+def get_remaining_socials(giveaway: Giveaway, user_id: int) -> tuple[tuple[str, str, str], ...]:
+    """Возвращает оставшиеся соцсети (название, callback, эмодзи)
+    Исключает соцсеть для обязательного условия и уже использованные для дополнительных билетов"""
+    state = (get_required_social(giveaway, user_id), frozenset(get_used_boost_socials(giveaway, user_id)))
+    remaining = _REMAINING_SOCIALS.get(state)
+    if remaining is None:
+        # Неизвестная соцсеть в данных (например, старая запись) - считаем напрямую
+        remaining = _build_remaining_socials(*state)
+    return remaining
+
+
+# Названия оставшихся соцсетей через запятую для каждого варианта
+_REMAINING_NAMES = {
+    remaining: ", ".join(name for name, _, _ in remaining)
+    for remaining in set(_REMAINING_SOCIALS.values())
+}
+
 
+def get_remaining_names(remaining_socials: tuple[tuple[str, str, str], ...]) -> str:
+    """Названия оставшихся соцсетей через запятую"""
+    names = _REMAINING_NAMES.get(remaining_socials)
+    if names is None:
+        names = ", ".join(name for name, _, _ in remaining_socials)
+    return names
 
-def get_welcome_keyboard() -> InlineKeyboardMarkup:
+
+# Клавиатуры не зависят от пользователя напрямую, поэтому каждый вариант создаётся
+# один раз на розыгрыш и переиспользуется (объекты telegram неизменяемы).
+# Все варианты строятся при запуске (prebuild_screens), кэши _build_* служат таблицей готовых объектов.
+# callback_data кнопок содержит ключ розыгрыша (Giveaway.callback).
+
+@lru_cache(maxsize=None)
+def _build_welcome_keyboard(giveaway: Giveaway) -> InlineKeyboardMarkup:
     """Клавиатура для первого окна приветствия (только кнопка Далее)"""
     buttons = [
         [
-            InlineKeyboardButton("➡️ Далее", callback_data=NEXT_TO_SUBSCRIPTION),
+            InlineKeyboardButton("➡️ Далее", callback_data=giveaway.callback(NEXT_TO_SUBSCRIPTION)),
         ],
     ]
     return InlineKeyboardMarkup(buttons)
 
 
-def get_subscription_check_keyboard(is_subscribed: bool) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def _build_subscription_check_keyboard(giveaway: Giveaway, is_subscribed: bool) -> InlineKeyboardMarkup:
     """Клавиатура для окна проверки подписки"""
     buttons = []
     if not is_subscribed:
         buttons.append([
-            InlineKeyboardButton("✅ Проверить подписку", callback_data=CHECK_SUBSCRIPTION),
+            InlineKeyboardButton("✅ Проверить подписку", callback_data=giveaway.callback(CHECK_SUBSCRIPTION)),
         ])
         buttons.append([
-            InlineKeyboardButton("🔗 Вступить в чат", url=CHAT_URL),
+            InlineKeyboardButton("🔗 Вступить в чат", url=giveaway.chat_url),
         ])
         buttons.append([
-            InlineKeyboardButton("📢 Подписаться на канал", url=CHANNEL_URL),
+            InlineKeyboardButton("📢 Подписаться на канал", url=giveaway.channel_url),
         ])
     else:
         buttons.append([
-            InlineKeyboardButton("➡️ Далее", callback_data=NEXT_TO_REQUIRED),
+            InlineKeyboardButton("➡️ Далее", callback_data=giveaway.callback(NEXT_TO_REQUIRED)),
         ])
     buttons.append([
-        InlineKeyboardButton("↩️ Назад", callback_data=BACK_TO_MAIN),
+        InlineKeyboardButton("↩️ Назад", callback_data=giveaway.callback(BACK_TO_MAIN)),
     ])
     return InlineKeyboardMarkup(buttons)
 
 
-def get_required_condition_keyboard(has_required: bool) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def _build_required_condition_keyboard(giveaway: Giveaway, has_required: bool) -> InlineKeyboardMarkup:
     """Клавиатура для окна обязательного условия"""
     buttons = []
     if not has_required:
         buttons.append([
-            InlineKeyboardButton("📸 Выполнить обязательное условие", callback_data=REQUIRED_STORY),
+            InlineKeyboardButton("📸 Выполнить обязательное условие", callback_data=giveaway.callback(REQUIRED_STORY)),
         ])
     else:
         buttons.append([
-            InlineKeyboardButton("➡️ Далее", callback_data=NEXT_TO_BOOST),
+            InlineKeyboardButton("➡️ Далее", callback_data=giveaway.callback(NEXT_TO_BOOST)),
         ])
     buttons.append([
-        InlineKeyboardButton("↩️ Назад", callback_data=NEXT_TO_SUBSCRIPTION),
+        InlineKeyboardButton("↩️ Назад", callback_data=giveaway.callback(NEXT_TO_SUBSCRIPTION)),
     ])
     return InlineKeyboardMarkup(buttons)
 
 
-def get_profile_keyboard() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def _build_profile_keyboard(giveaway: Giveaway) -> InlineKeyboardMarkup:
     """Клавиатура только с кнопкой Профиль"""
     buttons = [
         [
-            InlineKeyboardButton("👤 Профиль", callback_data=MY_TICKETS),
+            InlineKeyboardButton("👤 Профиль", callback_data=giveaway.callback(MY_TICKETS)),
         ],
     ]
     return InlineKeyboardMarkup(buttons)
 
 
-def get_main_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def _build_main_menu_keyboard(giveaway: Giveaway, has_remaining_socials: bool) -> InlineKeyboardMarkup:
     """Главное меню с билетами, ID, именем и кнопкой увеличить шанс"""
-    # Проверяем, есть ли еще доступные соцсети
-    remaining_socials = get_remaining_socials(user_id)
-    
-    if remaining_socials:
+    if has_remaining_socials:
         # Есть доступные соцсети - показываем кнопку "Увеличить шанс"
         buttons = [
             [
-                InlineKeyboardButton("🎁 Увеличить шанс", callback_data=BOOST_CHANCE),
+                InlineKeyboardButton("🎁 Увеличить шанс", callback_data=giveaway.callback(BOOST_CHANCE)),
             ],
         ]
     else:
         # Все соцсети использованы - показываем только кнопку "Профиль"
         buttons = [
             [
-                InlineKeyboardButton("👤 Профиль", callback_data=MY_TICKETS),
+                InlineKeyboardButton("👤 Профиль", callback_data=giveaway.callback(MY_TICKETS)),
             ],
         ]
     return InlineKeyboardMarkup(buttons)
 
 
-def get_boost_keyboard(user_id: int) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=1024)
+def _build_boost_keyboard(
+    giveaway: Giveaway, remaining_socials: tuple[tuple[str, str, str], ...]
+) -> InlineKeyboardMarkup:
     """Клавиатура для окна увеличения шансов - показывает только оставшиеся соцсети"""
     buttons = []
-    
-    # Получаем оставшиеся соцсети (исключая ту, что использована для обязательного условия)
-    remaining_socials = get_remaining_socials(user_id)
-    
-    if remaining_socials:
-        # Показываем кнопки для оставшихся соцсетей
-        for name, callback, emoji in remaining_socials:
-            buttons.append([
-                InlineKeyboardButton(f"{emoji} {name}", callback_data=callback),
-            ])
-    
+    for name, callback, emoji in remaining_socials:
+        buttons.append([
+            InlineKeyboardButton(f"{emoji} {name}", callback_data=giveaway.callback(callback)),
+        ])
     buttons.append([
-        InlineKeyboardButton("↩️ Назад", callback_data="back_to_main_menu"),
+        InlineKeyboardButton("↩️ Назад", callback_data=giveaway.callback(BACK_TO_MAIN_MENU)),
     ])
     return InlineKeyboardMarkup(buttons)
 
 
-def get_main_keyboard(show_check_button: bool = True, user_id: int = None) -> InlineKeyboardMarkup:
-    """Возвращает главную клавиатуру"""
+@lru_cache(maxsize=None)
+def _build_subscribe_keyboard(giveaway: Giveaway) -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой вступления в чат"""
+    buttons = [
+        [
+            InlineKeyboardButton("🔗 Вступить в чат", url=giveaway.chat_url),
+        ],
+        [
+            InlineKeyboardButton("✅ Проверить подписку", callback_data=giveaway.callback(CHECK_SUBSCRIPTION)),
+        ],
+        [
+            InlineKeyboardButton("↩️ Назад", callback_data=giveaway.callback(BACK_TO_MAIN)),
+        ],
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
+@lru_cache(maxsize=None)
+def _build_social_keyboard(giveaway: Giveaway, back_callback: str) -> InlineKeyboardMarkup:
+    """Клавиатура выбора соцсети"""
+    buttons = [
+        [
+            InlineKeyboardButton("📱 Telegram", callback_data=giveaway.callback(SOCIAL_TELEGRAM)),
+        ],
+        [
+            InlineKeyboardButton("💬 WhatsApp", callback_data=giveaway.callback(SOCIAL_WHATSAPP)),
+            InlineKeyboardButton("📸 Instagram", callback_data=giveaway.callback(SOCIAL_INSTAGRAM)),
+        ],
+        [
+            InlineKeyboardButton("↩️ Назад", callback_data=giveaway.callback(back_callback)),
+        ],
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
+@lru_cache(maxsize=None)
+def _build_back_keyboard(giveaway: Giveaway, back_callback: str) -> InlineKeyboardMarkup:
+    """Клавиатура с одной кнопкой Назад"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад", callback_data=giveaway.callback(back_callback))]])
+
+
+def get_welcome_keyboard(giveaway: Giveaway) -> InlineKeyboardMarkup:
+    """Клавиатура для первого окна приветствия (только кнопка Далее)"""
+    return _build_welcome_keyboard(giveaway)
+
+
+def get_subscription_check_keyboard(giveaway: Giveaway, is_subscribed: bool) -> InlineKeyboardMarkup:
+    """Клавиатура для окна проверки подписки"""
+    return _build_subscription_check_keyboard(giveaway, bool(is_subscribed))
+
+
+def get_required_condition_keyboard(giveaway: Giveaway, has_required: bool) -> InlineKeyboardMarkup:
+    """Клавиатура для окна обязательного условия"""
+    return _build_required_condition_keyboard(giveaway, bool(has_required))
+
+
+def get_profile_keyboard(giveaway: Giveaway) -> InlineKeyboardMarkup:
+    """Клавиатура только с кнопкой Профиль"""
+    return _build_profile_keyboard(giveaway)
+
+
+def get_main_menu_keyboard(giveaway: Giveaway, user_id: int) -> InlineKeyboardMarkup:
+    """Главное меню с билетами, ID, именем и кнопкой увеличить шанс"""
+    # Проверяем, есть ли еще доступные соцсети
+    return _build_main_menu_keyboard(giveaway, bool(get_remaining_socials(giveaway, user_id)))
+
+
+def get_boost_keyboard(giveaway: Giveaway, user_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура для окна увеличения шансов - показывает только оставшиеся соцсети"""
+    return _build_boost_keyboard(giveaway, get_remaining_socials(giveaway, user_id))
+
+
+@lru_cache(maxsize=1024)
+def _build_main_keyboard(
+    giveaway: Giveaway, show_check_button: bool, has_required: bool | None, tickets: int
+) -> InlineKeyboardMarkup:
     buttons = []
     if show_check_button:
         buttons.append([
-            InlineKeyboardButton("✅ Проверить подписку", callback_data=CHECK_SUBSCRIPTION),
+            InlineKeyboardButton("✅ Проверить подписку", callback_data=giveaway.callback(CHECK_SUBSCRIPTION)),
         ])
-    
+
     # Проверяем обязательное условие - кнопка "Повысить шанс" только после выполнения обязательного условия
-    if user_id is not None:
-        if not has_required_condition(user_id):
+    if has_required is not None:
+        if not has_required:
             # Обязательное условие не выполнено - показываем только кнопку для его выполнения
             buttons.append([
-                InlineKeyboardButton("📸 Выполнить обязательное условие", callback_data=REQUIRED_STORY),
+                InlineKeyboardButton(
+                    "📸 Выполнить обязательное условие", callback_data=giveaway.callback(REQUIRED_STORY)
+                ),
             ])
         else:
             # Обязательное условие выполнено - можно повышать шанс
             buttons.append([
-                InlineKeyboardButton("🎁 Повысить шанс", callback_data=BOOST_CHANCE),
+                InlineKeyboardButton("🎁 Повысить шанс", callback_data=giveaway.callback(BOOST_CHANCE)),
             ])
             buttons.append([
-                InlineKeyboardButton(f"🎫 Мои билеты: {get_user_tickets(user_id)}", callback_data=MY_TICKETS),
+                InlineKeyboardButton(f"🎫 Мои билеты: {tickets}", callback_data=giveaway.callback(MY_TICKETS)),
             ])
     # Если user_id не передан, не показываем кнопку "Повысить шанс" (безопасность)
-    
+
     return InlineKeyboardMarkup(buttons)
 
 
-def get_subscribe_keyboard() -> InlineKeyboardMarkup:
+def get_main_keyboard(
+    giveaway: Giveaway, show_check_button: bool = True, user_id: int = None
+) -> InlineKeyboardMarkup:
+    """Возвращает главную клавиатуру (варианты кэшируются, в кнопке меняется только число билетов)"""
+    if user_id is None:
+        return _build_main_keyboard(giveaway, show_check_button, None, 0)
+    has_required = has_required_condition(giveaway, user_id)
+    tickets = get_user_tickets(giveaway, user_id) if has_required else 0
+    return _build_main_keyboard(giveaway, show_check_button, has_required, tickets)
+
+
+def get_subscribe_keyboard(giveaway: Giveaway) -> InlineKeyboardMarkup:
     """Клавиатура с кнопкой вступления в чат"""
-    buttons = [
-        [
-            InlineKeyboardButton("🔗 Вступить в чат", url=CHAT_URL),
-        ],
-        [
-            InlineKeyboardButton("✅ Проверить подписку", callback_data=CHECK_SUBSCRIPTION),
-        ],
-        [
-            InlineKeyboardButton("↩️ Назад", callback_data=BACK_TO_MAIN),
-        ],
-    ]
-    return InlineKeyboardMarkup(buttons)
+    return _build_subscribe_keyboard(giveaway)
 
 
-def get_social_keyboard() -> InlineKeyboardMarkup:
+def get_social_keyboard(giveaway: Giveaway) -> InlineKeyboardMarkup:
     """Клавиатура выбора соцсети"""
-    buttons = [
-        [
-            InlineKeyboardButton("📱 Telegram", callback_data=SOCIAL_TELEGRAM),
-        ],
-        [
-            InlineKeyboardButton("💬 WhatsApp", callback_data=SOCIAL_WHATSAPP),
-            InlineKeyboardButton("📸 Instagram", callback_data=SOCIAL_INSTAGRAM),
-        ],
-        [
-            InlineKeyboardButton("↩️ Назад", callback_data=BACK_TO_MAIN),
-        ],
+    return _build_social_keyboard(giveaway, BACK_TO_MAIN)
+
+
+def get_required_social_keyboard(giveaway: Giveaway) -> InlineKeyboardMarkup:
+    """Выбор соцсети для обязательного условия"""
+    return _build_social_keyboard(giveaway, NEXT_TO_REQUIRED)
+
+
+def get_back_to_required_story_keyboard(giveaway: Giveaway) -> InlineKeyboardMarkup:
+    return _build_back_keyboard(giveaway, REQUIRED_STORY)
+
+
+# Тексты экранов: статические строки собраны один раз, динамические поля
+# (имя, ID, билеты, соцсети) подставляются в готовые шаблоны, тексты с настройками
+# розыгрыша (ссылка на чат, дата итогов) собираются один раз на розыгрыш
+SUBSCRIBED_TEXT = (
+    "✅ Отлично! Ты подписан на чат и канал.\n\n"
+    "Нажми «Далее», чтобы перейти к следующему шагу."
+)
+NOT_SUBSCRIBED_TEXT = "❌ Ты ещё не подписан на чат и канал."
+SUBSCRIPTION_NEEDED_TEXT = "Для участия нужно подписаться"
+SUBSCRIBE_FIRST_TEXT = (
+    "⚠️ Сначала нужно вступить в чат!\n\n"
+    "Вернись к шагу проверки подписки."
+)
+REQUIRED_FIRST_TEXT = (
+    "⚠️ Сначала нужно выполнить обязательное условие!\n\n"
+    "📸 Выложи в Stories афишу розыгрыша с ссылкой на пост.\n"
+    "После выполнения обязательного условия ты получишь 1 билет и сможешь повысить шанс дополнительными репостами.\n\n"
+    "💡 Обязательное условие = 1 билет (минимум для участия)\n"
+    "🎁 Дополнительные репосты = +1 билет за каждый"
+)
+STORY_POSTER_TEMPLATE = (
+    "📸 Афиша розыгрыша для Stories\n\n"
+    "Для участия в розыгрыше нужно:\n\n"
+    "1️⃣ Скачай это изображение и выложи в Stories (Telegram/WhatsApp/Instagram)\n"
+    "2️⃣ Добавь ссылку на наш чат: {chat_link}\n\n"
+    "3️⃣ Нажми кнопку «📸 Выполнить обязательное условие» и выбери соцсеть\n"
+    "4️⃣ Отправь скриншот своего Stories сюда\n\n"
+    "✅ После выполнения получишь 1 билет (обязательное условие)\n"
+    "🎁 Затем сможешь повысить шанс дополнительными репостами!"
+)
+CHOOSE_REQUIRED_SOCIAL_TEXT = (
+    "📸 Выбери соцсеть, где выложишь сторис:\n\n"
+    "💡 Выбери одну из соцсетей ниже"
+)
+CARD_SEPARATOR = "━━━━━━━━━━━━━━━━━━━━"
+PROFILE_CARD_TEMPLATE = (
+    f"{CARD_SEPARATOR}\n"
+    "👤 Имя: {name}\n"
+    "🆔 ID: {user_id}\n"
+    "🎫 Билетов: {tickets}\n"
+)
+BOOST_HINT_TEXT = "🎁 Нажми «Увеличить шанс», чтобы получить дополнительные билеты!"
+MORE_TICKETS_TEXT = "✨ Чем больше билетов, тем выше шанс выиграть!"
+BOOST_OPTIONS_TEMPLATE = (
+    "✅ Обязательное условие выполнено в {required_social}\n\n"
+    "📋 Можешь повысить шанс:\n"
+    "• Выложи истории в оставшихся соцсетях: {remaining}\n"
+    "• Каждая история = +1 билет\n\n"
+)
+BOOST_OPTIONS_ANY_TEXT = (
+    "📋 Можешь повысить шанс:\n"
+    "• Отправь скриншот репоста в любой соцсети\n"
+    "• Каждый репост = +1 билет\n\n"
+)
+CHOOSE_BOOST_SOCIAL_TEMPLATE = (
+    "📋 Выбери соцсеть для увеличения шанса:\n\n"
+    "💡 Доступные соцсети: {remaining}\n"
+    "🎫 Каждая история = +1 билет\n\n"
+    f"{MORE_TICKETS_TEXT}"
+)
+ALL_SOCIALS_USED_TEXT = "🎉 Ты использовал все доступные соцсети!"
+GOOD_LUCK_TEXT = "✨ Удачи в розыгрыше!"
+GIVEAWAY_UPCOMING_TEXT = "⏳ Розыгрыш ещё не начался. Загляни позже!"
+GIVEAWAY_FINISHED_TEXT = "🏁 Приём заявок в этом розыгрыше завершён. Спасибо за участие!"
+GIVEAWAY_NOT_FOUND_TEXT = "Этот розыгрыш уже недоступен. Нажми /start"
+SCREENSHOT_NOT_EXPECTED_TEXT = (
+    "📸 Я жду скриншот только после выбора действия.\n\n"
+    "Выбери действие через кнопки меню."
+)
+REQUIRED_DONE_TEMPLATE = (
+    "✅ Отлично! Обязательное условие выполнено!\n\n"
+    "📸 Скриншот Stories из {social} получен.\n\n"
+    "🎫 Ты получил 1 билет (обязательное условие)!\n\n"
+)
+BOOST_DONE_TEMPLATE = (
+    "✅ Отлично! Скриншот из {social} получен!\n\n"
+    "🎫 Ты получил +1 билет!\n\n"
+)
+DUPLICATE_SCREENSHOT_TEXT = (
+    "❌ Этот скриншот уже присылали.\n\n"
+    "📸 Билет начисляется только за новый скриншот - отправь скриншот своей истории или репоста."
+)
+SCREENSHOT_CHECKING_TEXT = "⏳ Скриншот получен, проверяю..."
+SCREENSHOT_PENDING_TEXT = "⏳ Предыдущий скриншот ещё проверяется, подожди немного."
+SCREENSHOT_QUEUE_FULL_TEXT = "⏳ Сейчас много скриншотов на проверке. Отправь скриншот ещё раз через минуту."
+SCREENSHOT_CHECK_FAILED_TEXT = "❌ Не удалось проверить скриншот. Отправь его ещё раз."
+SCREENSHOT_REJECTED_TEXTS = {
+    "too_small": "❌ Скриншот слишком маленький.\n\n📸 Отправь скриншот экрана телефона целиком.",
+    "aspect": (
+        "❌ Это не похоже на скриншот сторис.\n\n"
+        "📸 Отправь вертикальный скриншот экрана телефона целиком."
+    ),
+    "no_poster": (
+        "❌ На скриншоте не видно афиши розыгрыша.\n\n"
+        "📸 Выложи в сторис афишу и отправь скриншот ещё раз."
+    ),
+}
+SOCIAL_ALREADY_USED_TEMPLATE = (
+    "❌ Ты уже использовал {social}.\n\n"
+    "📱 Выбери другую соцсеть из оставшихся."
+)
+HELP_HEADER_TEXT = "👋 Используй кнопки ниже для взаимодействия с ботом:\n\n"
+HELP_BOOST_TEMPLATE = (
+    HELP_HEADER_TEXT
+    + "🎫 Твои билеты: {tickets}\n\n"
+    "• «🎁 Повысить шанс» — отправь скриншот репоста (+1 билет)\n"
+    "• «🎫 Мои билеты» — посмотри количество билетов"
+)
+HELP_REQUIRED_TEXT = (
+    HELP_HEADER_TEXT
+    + "• «📸 Выполнить обязательное условие» — сторис с афишей (обязательно)\n"
+    "• После выполнения сможешь повысить шанс дополнительными репостами"
+)
+HELP_SUBSCRIBE_TEXT = (
+    HELP_HEADER_TEXT
+    + "• «✅ Проверить подписку» — проверь вступление в чат\n"
+    "• После вступления выполни обязательное условие"
+)
+# Шаги воронки в /stats
+FUNNEL_STEP_NAMES = {
+    "started": "Нажали /start",
+    "subscribed": "Подписаны на чат",
+    "required_done": "Выполнили обязательное условие",
+    "boosted": "Сделали дополнительный репост",
+}
+
+# Тексты окна соцсети: (где выложить сторис, куда сделать репост)
+_SOCIAL_SCREEN_TEXTS = {
+    "Telegram": ("Stories", "Telegram Stories или чате"),
+    "WhatsApp": ("Status", "WhatsApp Status"),
+    "Instagram": ("Stories", "Instagram Stories"),
+}
+# Готовые тексты выбора соцсети для доп. билета (для обязательного условия - в _giveaway_texts)
+_SOCIAL_BOOST_TEXTS = {
+    social: (
+        f"{SOCIAL_EMOJIS[social]} Выбрана соцсеть: {social}\n\n"
+        f"📸 Отправь скриншот репоста поста в {repost_place}.\n\n"
+        "💡 Убедись, что на скриншоте видно:\n"
+        "• Твой профиль\n"
+        "• Репост нашего поста\n\n"
+        "🎫 За каждый репост получишь +1 билет!"
+    )
+    for social, (_, repost_place) in _SOCIAL_SCREEN_TEXTS.items()
+}
+
+
+@lru_cache(maxsize=None)
+def _giveaway_texts(giveaway: Giveaway) -> dict[str, str]:
+    """Тексты, зависящие от настроек розыгрыша"""
+    chat_link = giveaway.chat_url.removeprefix("https://")
+    return {
+        "story_poster": STORY_POSTER_TEMPLATE.format(chat_link=chat_link),
+        "end_date": f"📅 Дата итогов: {giveaway.end_date}\n" if giveaway.end_date else "",
+        **{
+            f"required_{social}": (
+                f"{SOCIAL_EMOJIS[social]} Соцсеть выбрана: {social}\n\n"
+                f"📸 Отправь скриншот своего {story_name} с афишей розыгрыша.\n\n"
+                "💡 Убедись, что на скриншоте видно:\n"
+                "• Твой профиль\n"
+                "• Афиша розыгрыша\n"
+                f"• Ссылка на чат: {chat_link}\n\n"
+                "✅ После отправки получишь 1 билет (обязательное условие)!"
+            )
+            for social, (story_name, _) in _SOCIAL_SCREEN_TEXTS.items()
+        },
+    }
+
+
+def prebuild_screens(giveaway: Giveaway) -> int:
+    """Строит все варианты клавиатур и текстов розыгрыша заранее (при запуске), возвращает их число
+    Дальше обработчики только берут готовые объекты из кэшей _build_*"""
+    builds = [
+        _build_welcome_keyboard(giveaway),
+        _build_profile_keyboard(giveaway),
+        _build_subscribe_keyboard(giveaway),
+        _build_social_keyboard(giveaway, BACK_TO_MAIN),
+        _build_social_keyboard(giveaway, NEXT_TO_REQUIRED),
+        _build_back_keyboard(giveaway, REQUIRED_STORY),
+        _giveaway_texts(giveaway),
     ]
-    return InlineKeyboardMarkup(buttons)
+    for flag in (False, True):
+        builds += [
+            _build_subscription_check_keyboard(giveaway, flag),
+            _build_required_condition_keyboard(giveaway, flag),
+            _build_main_menu_keyboard(giveaway, flag),
+            _build_main_keyboard(giveaway, flag, None, 0),
+            _build_main_keyboard(giveaway, flag, False, 0),
+        ]
+        # Билетов не больше, чем обязательное условие и репосты во всех соцсетях (без ручных начислений)
+        builds += [_build_main_keyboard(giveaway, flag, True, tickets) for tickets in range(len(SOCIALS) + 2)]
+    builds += [_build_boost_keyboard(giveaway, remaining) for remaining in set(_REMAINING_SOCIALS.values())]
+    return len(builds)
+
+
+def get_display_name(user) -> str:
+    """Имя пользователя для карточки профиля"""
+    user_name = user.first_name or "Пользователь"
+    if user.last_name:
+        user_name += f" {user.last_name}"
+    return user_name
+
+
+def render_profile_card(user, tickets: int) -> str:
+    """Карточка профиля: имя, ID и билеты (без нижнего разделителя)"""
+    return PROFILE_CARD_TEMPLATE.format(name=get_display_name(user), user_id=user.id, tickets=tickets)
+
+
+def render_boost_options(giveaway: Giveaway, user_id: int) -> str:
+    """Подсказка, в каких соцсетях ещё можно получить билеты"""
+    required_social = get_required_social(giveaway, user_id)
+    if required_social:
+        return BOOST_OPTIONS_TEMPLATE.format(
+            required_social=required_social,
+            remaining=get_remaining_names(get_remaining_socials(giveaway, user_id)),
+        )
+    return BOOST_OPTIONS_ANY_TEXT
 
 
 async def check_single_subscription(
-    context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: str
+    context: ContextTypes.DEFAULT_TYPE,
+    user_id: int,
+    chat_id: str,
+    strict: bool = False,
+    lane: str | None = None,
 ) -> bool:
-    """Проверяет подписку пользователя на один чат/канал"""
+    """Проверяет подписку пользователя на один чат/канал
+    Одновременные проверки одной пары (пользователь, чат) ждут один общий запрос.
+    strict - ошибки API (RetryAfter, сеть) пробрасываются, а не считаются отсутствием подписки;
+    lane - полоса приоритета запроса (ratelimit.py), по умолчанию определяется по методу"""
+    key = (user_id, chat_id)
+    task = _inflight_checks.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_single_subscription(context, user_id, chat_id, lane))
+        _inflight_checks[key] = task
+        task.add_done_callback(lambda _: _inflight_checks.pop(key, None))
     try:
-        member = await context.bot.get_chat_member(chat_id, user_id)
-        return (
-            member.status == ChatMemberStatus.MEMBER or
-            member.status == ChatMemberStatus.ADMINISTRATOR or
-            member.status == ChatMemberStatus.RESTRICTED
-        )
+        # shield: отмена одного из ожидающих не должна отменять запрос для остальных
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        raise
     except Exception as exc:
+        if strict:
+            raise
+        logger.error("❌ Ошибка при проверке подписки %s: %s", chat_id, exc, extra={"sample_key": chat_id})
+        return False
+
+
+async def _fetch_single_subscription(
+    context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: str, lane: str | None = None
+) -> bool:
+    """Запрашивает статус участника через Bot API"""
+    try:
+        member = await context.bot.get_chat_member(chat_id, user_id, rate_limit_args=lane)
+    except BadRequest as exc:
         error_msg = str(exc).lower()
         if "user not found" in error_msg or "chat member not found" in error_msg or "member not found" in error_msg:
+            _membership.record(chat_id, user_id, False)
             return False
-        logger.error(f"❌ Ошибка при проверке подписки {chat_id}: {exc}")
-        return False
+        raise
+    is_member = member.status in MEMBER_STATUSES
+    _membership.record(chat_id, user_id, is_member)
+    return is_member
+
+
+async def _check_target(
+    context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: str, use_index: bool, lane: str | None = None
+) -> bool:
+    """Берёт статус из индекса участников, к API обращается только для неизвестных"""
+    if use_index:
+        is_member = _membership.get(chat_id, user_id)
+        if is_member is not None:
+            return is_member
+    return await check_single_subscription(context, user_id, chat_id, lane=lane)
+
+
+def _forget_subscription(user_id: int) -> None:
+    """Сбрасывает кэш подписки пользователя во всех розыгрышах"""
+    for chats in {giveaway.required_chats for giveaway in _giveaways}:
+        _subscription_cache.pop((chats, user_id))
 
 
 async def is_member_cached(
-    context: ContextTypes.DEFAULT_TYPE, user_id: int, use_cache: bool = True
+    context: ContextTypes.DEFAULT_TYPE,
+    giveaway: Giveaway,
+    user_id: int,
+    use_cache: bool = True,
+    lane: str | None = None,
 ) -> bool:
-    """Проверяет подписку на чат И канал с кэшированием"""
-    current_time = time.time()
-    
-    # Проверяем кэш
-    if use_cache and user_id in _subscription_cache:
-        is_member, cached_time = _subscription_cache[user_id]
-        if current_time - cached_time < CACHE_TTL:
+    """Проверяет подписку на чат И канал розыгрыша с кэшированием
+    (розыгрыши с одинаковыми чатами делят записи кэша)
+    lane - полоса приоритета запросов (проверки в группе идут как moderation)"""
+    cache_key = (giveaway.required_chats, user_id)
+    # Проверяем кэш (устаревшие записи кэш удаляет сам)
+    if use_cache:
+        is_member = _subscription_cache.get(cache_key)
+        if is_member is not None:
             return is_member
-        # Кэш устарел, удаляем
-        del _subscription_cache[user_id]
     
     # Делаем API запрос (параллельно проверяем чат и канал)
     try:
         # Параллельная проверка подписки на чат и канал для ускорения
         is_chat_member, is_channel_member = await asyncio.gather(
-            check_single_subscription(context, user_id, TARGET_CHAT),
-            check_single_subscription(context, user_id, TARGET_CHANNEL),
+            _check_target(context, user_id, giveaway.chat, use_cache, lane),
+            _check_target(context, user_id, giveaway.channel, use_cache, lane),
             return_exceptions=False
         )
         
@@ -352,18 +970,49 @@ async def is_member_cached(
         is_member = is_chat_member and is_channel_member
         
         # Сохраняем в кэш
-        _subscription_cache[user_id] = (is_member, current_time)
+        _subscription_cache.set(cache_key, is_member)
+        if is_member and giveaway.required_chats == _primary.required_chats:
+            # Подписался - больше не нарушитель в группе
+            _moderation.clear(user_id)
         return is_member
         
     except Exception as exc:
-        logger.error(f"❌ Ошибка при проверке подписки пользователя {user_id}: {exc}")
+        logger.error("❌ Ошибка при проверке подписки пользователя %s: %s", user_id, exc)
         
         # В случае ошибки используем кэш, если есть
-        if user_id in _subscription_cache:
-            return _subscription_cache[user_id][0]
-        return False
+        return _subscription_cache.get(cache_key, False)
+
+
+@_handler_metrics.timed("handle_chat_member_update")
+async def handle_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обновляет индекс участников по событиям вступления/выхода в целевых чатах"""
+    if update.chat_member:
+        member_update = update.chat_member
+        target = _membership.resolve(member_update.chat.id, member_update.chat.username)
+        if target is None:
+            return
+        user_id = member_update.new_chat_member.user.id
+        is_member = member_update.new_chat_member.status in MEMBER_STATUSES
+        _membership.record(target, user_id, is_member)
+        # Сбрасываем кэши, чтобы следующая проверка сразу увидела новый статус
+        _forget_subscription(user_id)
+        _moderation.clear(user_id)
+        return
+
+    if update.my_chat_member:
+        member_update = update.my_chat_member
+        target = _membership.resolve(member_update.chat.id, member_update.chat.username)
+        if target is None:
+            return
+        status = member_update.new_chat_member.status
+        logger.info(f"🤖 Статус бота в {target} изменился: {status}")
+        if status != ChatMemberStatus.ADMINISTRATOR:
+            # Без прав администратора события chat_member не приходят - индекс устареет
+            logger.warning(f"⚠️ Бот больше не администратор в {target}, индекс участников сброшен")
+            _membership.forget_chat(target)
 
 
+@_handler_metrics.timed("check_subscription_in_chat")
 async def check_subscription_in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Проверяет подписку пользователя при отправке сообщения в чат"""
     message = update.message
@@ -377,869 +1026,1237 @@ async def check_subscription_in_chat(update: Update, context: ContextTypes.DEFAU
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    # Проверяем подписку (с кэшем)
-    if not await is_member_cached(context, user_id):
+    # Нарушитель из негативного кэша: в пределах окна подписку заново не проверяем
+    offender = _moderation.get(user_id)
+    if offender is None:
+        # Проверяем подписку (с кэшем)
+        if await is_member_cached(context, _primary, user_id, lane="moderation"):
+            return
+        offender = _moderation.flag(user_id)
+    
+    try:
+        # Предупреждение - не чаще одного за окно, остальные сообщения только удаляем
+        if not _moderation.should_warn(offender):
+            await context.bot.delete_message(chat_id, message.message_id, rate_limit_args="moderation")
+            return
+        
+        username = message.from_user.username or 'Пользователь'
+        warning_text = (
+            f"👋 @{username}\n\n"
+            f"⚠️ Для участия в чате необходимо вступить в чат {_primary.chat} и подписаться на канал {_primary.channel}.\n\n"
+            f"🔗 Вступи в чат и подпишись на канал, затем попробуй снова."
+        )
+        
+        # Параллельно удаляем сообщение и отправляем предупреждение
+        delete_task = context.bot.delete_message(chat_id, message.message_id, rate_limit_args="moderation")
+        warning_task = context.bot.send_message(chat_id=chat_id, text=warning_text)
+        
+        # Выполняем параллельно
+        results = await asyncio.gather(delete_task, warning_task, return_exceptions=True)
+        
+        # Удаляем предупреждение через 10 секунд (очередь отложенного удаления)
+        warning = results[1] if len(results) > 1 and not isinstance(results[1], Exception) else None
+        if warning and hasattr(warning, 'chat_id'):
+            _cleanup.schedule_delete(warning.chat_id, warning.message_id, 10)
+    except Exception as exc:
+        logger.exception("Failed to handle non-subscriber: %s", exc)
+
+
+async def _process_new_member(context: ContextTypes.DEFAULT_TYPE, chat_id: int, new_member) -> bool:
+    """Проверяет подписку нового участника и удаляет неподписанного
+    Возвращает True, если участник остался в чате"""
+    async with _join_slots:
+        # Проверяем подписку (без кэша для новых участников)
+        if await is_member_cached(context, _primary, new_member.id, use_cache=False, lane="moderation"):
+            return True
         try:
-            username = message.from_user.username or 'Пользователь'
-            warning_text = (
-                f"👋 @{username}\n\n"
-                f"⚠️ Для участия в чате необходимо вступить в чат {TARGET_CHAT} и подписаться на канал {TARGET_CHANNEL}.\n\n"
-                f"🔗 Вступи в чат и подпишись на канал, затем попробуй снова."
-            )
-            
-            # Параллельно удаляем сообщение и отправляем предупреждение
-            delete_task = message.delete()
-            warning_task = context.bot.send_message(chat_id=chat_id, text=warning_text)
-            
-            # Выполняем параллельно
-            results = await asyncio.gather(delete_task, warning_task, return_exceptions=True)
-            
-            # Удаляем предупреждение через 10 секунд (не блокируем)
-            warning = results[1] if len(results) > 1 and not isinstance(results[1], Exception) else None
-            if warning and hasattr(warning, 'chat_id'):
-                asyncio.create_task(
-                    _delete_message_after_delay(context, warning.chat_id, warning.message_id, 10)
-                )
+            # Удаляем пользователя из чата
+            await context.bot.ban_chat_member(chat_id=chat_id, user_id=new_member.id)
+            await context.bot.unban_chat_member(chat_id=chat_id, user_id=new_member.id)
         except Exception as exc:
-            logger.exception("Failed to handle non-subscriber: %s", exc)
+            logger.exception("Failed to remove non-subscriber from chat: %s", exc)
+        return False
 
 
-async def _delete_message_after_delay(
-    context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, delay: int
-) -> None:
-    """Удаляет сообщение через указанное время (не блокирует)"""
-    await asyncio.sleep(delay)
-    try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except Exception:
-        pass  # Игнорируем ошибки удаления (сообщение уже удалено или нет прав)
+MAX_MENTIONS = 30  # Больше упоминаний в одном сообщении не показываем (лимит длины сообщения)
+
+
+def _mentions(members: list) -> str:
+    """Упоминания участников через запятую"""
+    text = ", ".join(f"@{member.username or 'Пользователь'}" for member in members[:MAX_MENTIONS])
+    if len(members) > MAX_MENTIONS:
+        text += f" и ещё {len(members) - MAX_MENTIONS}"
+    return text
 
 
+@_handler_metrics.timed("handle_new_chat_members")
 async def handle_new_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обрабатывает новых участников чата и проверяет их подписку"""
+    """Обрабатывает новых участников чата и проверяет их подписку
+    Участники одного обновления проверяются параллельно (не больше JOIN_CONCURRENCY за раз),
+    приветствие и предупреждение отправляются одним сообщением на всех"""
     if not update.message or not update.message.new_chat_members:
         return
     
+    started = time.perf_counter()
     chat_id = update.message.chat.id
-    tasks = []
+    # Пропускаем бота
+    new_members = [
+        member for member in update.message.new_chat_members
+        if not (member.is_bot and member.id == context.bot.id)
+    ]
+    if not new_members:
+        return
+    
+    results = await asyncio.gather(
+        *(_process_new_member(context, chat_id, member) for member in new_members)
+    )
+    welcomed = [member for member, stayed in zip(new_members, results) if stayed]
+    removed = [member for member, stayed in zip(new_members, results) if not stayed]
     
-    for new_member in update.message.new_chat_members:
-        # Пропускаем бота
-        if new_member.is_bot and new_member.id == context.bot.id:
+    notices = []
+    if removed:
+        # Предупреждение удалённым, удаляем через 30 секунд
+        notices.append((
+            f"👋 {_mentions(removed)}\n\n"
+            f"❌ {'Был удалён' if len(removed) == 1 else 'Удалены'} из чата.\n\n"
+            f"⚠️ Для участия необходимо вступить в чат {_primary.chat} и подписаться на канал {_primary.channel}.\n"
+            f"🔗 После вступления попробуй присоединиться снова.",
+            30,
+        ))
+    if welcomed:
+        # Пользователи подписаны - приветствие, удаляем через 10 секунд
+        notices.append((
+            f"👋 Добро пожаловать, {_mentions(welcomed)}!\n\n"
+            f"✅ Вступление в чат подтверждено.\n\n"
+            f"🎉 Приятного общения!",
+            10,
+        ))
+    
+    sent = await asyncio.gather(
+        *(context.bot.send_message(chat_id=chat_id, text=text) for text, _ in notices),
+        return_exceptions=True,
+    )
+    for (_, delay), message in zip(notices, sent):
+        if isinstance(message, Exception):
+            logger.error("❌ Не удалось отправить сообщение новым участникам: %s", message)
             continue
-        
-        user_id = new_member.id
-        
-        # Проверяем подписку (без кэша для новых участников)
-        if not await is_member_cached(context, user_id, use_cache=False):
-            try:
-                # Удаляем пользователя из чата
-                await context.bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
-                await context.bot.unban_chat_member(chat_id=chat_id, user_id=user_id)
-                
-                # Отправляем предупреждение
-                warning = await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"👋 @{new_member.username or 'Пользователь'}\n\n"
-                         f"❌ Был удалён из чата.\n\n"
-                         f"⚠️ Для участия необходимо вступить в чат {TARGET_CHAT} и подписаться на канал {TARGET_CHANNEL}.\n"
-                         f"🔗 После вступления попробуй присоединиться снова.",
-                )
-                # Удаляем предупреждение через 30 секунд
-                asyncio.create_task(
-                    _delete_message_after_delay(context, warning.chat_id, warning.message_id, 30)
-                )
-            except Exception as exc:
-                logger.exception("Failed to remove non-subscriber from chat: %s", exc)
-        else:
-            # Пользователь подписан - отправляем приветствие
-            try:
-                welcome = await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"👋 Добро пожаловать, @{new_member.username or 'Пользователь'}!\n\n"
-                         f"✅ Вступление в чат подтверждено.\n\n"
-                         f"🎉 Приятного общения!",
-                )
-                # Удаляем приветствие через 10 секунд
-                asyncio.create_task(
-                    _delete_message_after_delay(context, welcome.chat_id, welcome.message_id, 10)
-                )
-            except Exception:
-                pass  # Игнорируем ошибки приветствия
-
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик команды /start - показывает первое окно приветствия"""
-    text = (
-        "🎉 Добро пожаловать на розыгрыш iPhone 17 Pro Max!\n\n"
-        "📱 От Торговли КФУ совместно с 9:41 store"
+        _cleanup.schedule_delete(message.chat_id, message.message_id, delay)
+    
+    logger.info(
+        "👥 Вступление: %d участников (осталось %d, удалено %d) за %.0f мс",
+        len(new_members), len(welcomed), len(removed), (time.perf_counter() - started) * 1000,
     )
-    await update.message.reply_text(text, reply_markup=get_welcome_keyboard())
 
 
-async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик нажатий на кнопки"""
-    query = update.callback_query
-    if not query:
-        return
+GIVEAWAY_STATUS_NAMES = {"upcoming": "ещё не начался", "open": "идёт", "finished": "завершён"}
 
-    try:
-        await query.answer()
-        user_id = query.from_user.id
-        callback_data = query.data
 
-        if callback_data == CHECK_SUBSCRIPTION:
-            # Очищаем кэш для этого пользователя, чтобы проверить актуальный статус
-            if user_id in _subscription_cache:
-                del _subscription_cache[user_id]
-            
-            # Проверяем подписку (без кэша для актуальной проверки)
-            if await is_member_cached(context, user_id, use_cache=False):
-                text = (
-                    "✅ Отлично! Ты подписан на чат и канал.\n\n"
-                    "Нажми «Далее», чтобы перейти к следующему шагу."
-                )
-                await query.edit_message_text(
-                    text,
-                    reply_markup=get_subscription_check_keyboard(is_subscribed=True),
-                )
-            else:
-                await query.edit_message_text(
-                    "❌ Ты ещё не подписан на чат и канал.",
-                    reply_markup=get_subscription_check_keyboard(is_subscribed=False),
-                )
-            return
+def _current_giveaway(context: ContextTypes.DEFAULT_TYPE) -> Giveaway:
+    """Розыгрыш, с которым пользователь работает сейчас (последняя ссылка или кнопка)"""
+    return _giveaways.get(context.user_data.get("giveaway")) or _primary
 
-        if callback_data == NEXT_TO_SUBSCRIPTION:
-            # Окно 2: Проверка подписки
-            user_id = query.from_user.id
-            # Очищаем кэш для актуальной проверки
-            if user_id in _subscription_cache:
-                del _subscription_cache[user_id]
-            is_subscribed = await is_member_cached(context, user_id, use_cache=False)
-            
-            if is_subscribed:
-                text = (
-                    "✅ Отлично! Ты подписан на чат и канал.\n\n"
-                    "Нажми «Далее», чтобы перейти к следующему шагу."
-                )
-            else:
-                text = "Для участия нужно подписаться"
-            
-            await query.edit_message_text(
-                text,
-                reply_markup=get_subscription_check_keyboard(is_subscribed),
-            )
-            return
 
-        if callback_data == NEXT_TO_REQUIRED:
-            # Окно 3: Обязательное условие
-            user_id = query.from_user.id
-            has_required = has_required_condition(user_id)
-            
-            if has_required:
-                # Если условие выполнено, переходим к окну увеличения шансов
-                tickets = get_user_tickets(user_id)
-                remaining_socials = get_remaining_socials(user_id)
-                required_social = get_required_social(user_id)
-                
-                text = (
-                    f"✅ Обязательное условие уже выполнено!\n\n"
-                    f"🎫 Твои билеты: {tickets}\n\n"
-                )
-                
-                if required_social:
-                    remaining_names = [name for name, _, _ in remaining_socials]
-                    text += (
-                        f"✅ Обязательное условие выполнено в {required_social}\n\n"
-                        f"📋 Можешь повысить шанс:\n"
-                        f"• Выложи истории в оставшихся соцсетях: {', '.join(remaining_names)}\n"
-                        f"• Каждая история = +1 билет\n\n"
-                    )
-                else:
-                    text += (
-                        "📋 Можешь повысить шанс:\n"
-                        "• Отправь скриншот репоста в любой соцсети\n"
-                        "• Каждый репост = +1 билет\n\n"
-                    )
-                
-                text += "✨ Чем больше билетов, тем выше шанс выиграть!"
-                
-                await query.edit_message_text(
-                    text,
-                    reply_markup=get_boost_keyboard(user_id),
-                )
-            else:
-                # Отправляем изображение для сторис с текстом и кнопками
-                text = (
-                    "📸 Афиша розыгрыша для Stories\n\n"
-                    "Для участия в розыгрыше нужно:\n\n"
-                    "1️⃣ Скачай это изображение и выложи в Stories (Telegram/WhatsApp/Instagram)\n"
-                    "2️⃣ Добавь ссылку на наш чат: t.me/torgovlya_kfu\n\n"
-                    "3️⃣ Нажми кнопку «📸 Выполнить обязательное условие» и выбери соцсеть\n"
-                    "4️⃣ Отправь скриншот своего Stories сюда\n\n"
-                    "✅ После выполнения получишь 1 билет (обязательное условие)\n"
-                    "🎁 Затем сможешь повысить шанс дополнительными репостами!"
-                )
-                
-                try:
-                    if os.path.exists(STORY_IMAGE_PATH):
-                        # Редактируем сообщение, заменяя его на фото с подписью
-                        with open(STORY_IMAGE_PATH, "rb") as photo:
-                            await query.edit_message_media(
-                                media=InputMediaPhoto(
-                                    media=photo,
-                                    caption=text,
-                                ),
-                                reply_markup=get_required_condition_keyboard(has_required),
-                            )
-                    else:
-                        # Если файла нет, показываем обычный текст
-                        logger.warning(f"⚠️ Файл изображения {STORY_IMAGE_PATH} не найден. Добавьте изображение для сторис.")
-                        await query.edit_message_text(
-                            text,
-                            reply_markup=get_required_condition_keyboard(has_required),
-                        )
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при отправке изображения: {e}")
-                    # Если ошибка, показываем обычный текст
-                    await query.edit_message_text(
-                        text,
-                        reply_markup=get_required_condition_keyboard(has_required),
-                    )
-            return
+def _select_giveaway(context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    if context.user_data.get("giveaway") != giveaway.key:
+        context.user_data["giveaway"] = giveaway.key
 
-        if callback_data == NEXT_TO_BOOST:
-            # Окно 4: Увеличение шансов
-            user_id = query.from_user.id
-            tickets = get_user_tickets(user_id)
-            
-            # Получаем оставшиеся соцсети
-            remaining_socials = get_remaining_socials(user_id)
-            required_social = get_required_social(user_id)
-            
-            text = (
-                f"🎫 Твои билеты: {tickets}\n\n"
-            )
-            
-            if required_social:
-                remaining_names = [name for name, _, _ in remaining_socials]
-                text += (
-                    f"✅ Обязательное условие выполнено в {required_social}\n\n"
-                    f"📋 Можешь повысить шанс:\n"
-                    f"• Выложи истории в оставшихся соцсетях: {', '.join(remaining_names)}\n"
-                    f"• Каждая история = +1 билет\n\n"
-                )
-            else:
-                text += (
-                    "📋 Можешь повысить шанс:\n"
-                    "• Отправь скриншот репоста в любой соцсети\n"
-                    "• Каждый репост = +1 билет\n\n"
+
+@_handler_metrics.timed("start")
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /start - показывает первое окно приветствия
+    /start <key> (ссылка t.me/<бот>?start=<key>) выбирает розыгрыш, без параметра - текущий"""
+    giveaway = _giveaways.get(context.args[0].lower()) if context.args else None
+    if giveaway is None:
+        giveaway = _current_giveaway(context)
+    _select_giveaway(context, giveaway)
+    _runtime(giveaway).stats.mark_step(context.user_data, "started")
+    status = giveaway.status()
+    if status == "upcoming":
+        await update.message.reply_text(f"{giveaway.welcome}\n\n{GIVEAWAY_UPCOMING_TEXT}")
+        return
+    if status == "finished":
+        await update.message.reply_text(
+            f"{giveaway.welcome}\n\n{GIVEAWAY_FINISHED_TEXT}", reply_markup=get_profile_keyboard(giveaway)
+        )
+        return
+    await update.message.reply_text(giveaway.welcome, reply_markup=get_welcome_keyboard(giveaway))
+
+
+def _admin_giveaway(args: list[str]) -> tuple[Giveaway, list[str]]:
+    """Розыгрыш из первого аргумента команды администратора (без ключа - главный) и остальные аргументы"""
+    giveaway = _giveaways.get(args[0].lower()) if args else None
+    if giveaway is None:
+        return _primary, args
+    return giveaway, args[1:]
+
+
+def _open_ledgers() -> None:
+    """Открывает журналы билетов и сверяет с ними хранилище (вызывать в потоке до приёма обновлений)
+    Сверяются только участники из хвоста журнала: всё до снимка хранилище уже сохранило"""
+    for runtime in _runtimes.values():
+        store, ledger = runtime.store, runtime.ledger
+        touched = ledger.open(seed=lambda: ((user_id, record.tickets) for user_id, record in store.iter_records()))
+        restored = 0
+        for user_id in touched:
+            record = store.get(user_id)
+            if (record.tickets if record else 0) != ledger.balance(user_id):
+                # Хранилище пишет пачками и могло не успеть сохранить билеты перед падением
+                with store.edit(user_id) as record:
+                    record.tickets = ledger.balance(user_id)
+                restored += 1
+        if restored:
+            logger.warning(f"🧾 Билеты восстановлены из журнала {ledger.path}: {restored} участников")
+
+
+def _load_stats(persistence: SqliteUserDataPersistence | None) -> dict[str, GiveawayStats]:
+    """Статистика из базы: один проход по участникам каждого розыгрыша (вызывать в потоке)
+    Счётчики собираются заново, в runtime их подставляет event loop; в многопроцессном
+    режиме считаются только пользователи этого воркера"""
+    loaded = {}
+    for key, runtime in _runtimes.items():
+        stats = GiveawayStats(flag_prefix=runtime.stats.flag_prefix)
+        owns = runtime.store.owns
+        flag_counts = persistence.count_true(stats.flag_keys, owns) if persistence is not None else {}
+        stats.load(runtime.store.iter_state_counts(), flag_counts)
+        loaded[key] = stats
+    return loaded
+
+
+def render_stats(giveaway: Giveaway, stats: GiveawayStats) -> str:
+    """Текст /stats из счётчиков (без обращения к базе)"""
+    lines = [f"📊 Статистика розыгрыша {giveaway.title} ({giveaway.key})", "", "Воронка:"]
+    for step, count, rate in stats.funnel():
+        suffix = f" ({rate:.0%} от предыдущего шага)" if rate is not None else ""
+        lines.append(f"▫️ {FUNNEL_STEP_NAMES[step]}: {count}{suffix}")
+    lines += ["", f"🎫 Билетов: {stats.total_tickets} у {stats.participants} участников"]
+    for tickets, users in sorted(stats.tickets_histogram.items()):
+        lines.append(f"▫️ {tickets} 🎫: {users}")
+    lines += ["", "Соцсети (обязательное условие / дополнительные репосты):"]
+    for name, _, emoji in SOCIALS:
+        lines.append(f"{emoji} {name}: {stats.required_socials[name]} / {stats.boost_socials[name]}")
+    return "\n".join(lines)
+
+
+async def _publish_stats(giveaways: list[Giveaway]) -> None:
+    """Публикует изменившиеся счётчики воркера в общую базу"""
+    if _shared_stats is None:
+        return
+    shard, _ = _shard
+    for giveaway in giveaways:
+        # Снимок счётчиков берётся в event loop, в поток уходит готовая строка
+        state = json.dumps(_runtime(giveaway).stats.state(), ensure_ascii=False, sort_keys=True)
+        if _published_stats.get(giveaway.key) != state:
+            await asyncio.to_thread(_shared_stats.publish, giveaway.key, shard, state)
+            _published_stats[giveaway.key] = state
+
+
+async def _publish_stats_every(interval: float) -> None:
+    """Периодическая публикация счётчиков воркера (их читают /stats и /giveaways других воркеров)"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await _publish_stats(list(_giveaways))
+        except Exception as exc:
+            logger.error(f"❌ Не удалось опубликовать статистику: {exc}")
+
+
+async def _giveaway_stats(giveaway: Giveaway) -> GiveawayStats:
+    """Статистика розыгрыша: в многопроцессном режиме - сумма счётчиков всех воркеров
+    (чужие - с задержкой до STATS_PUBLISH_INTERVAL секунд)"""
+    stats = _runtime(giveaway).stats
+    if _shared_stats is None:
+        return stats
+    await _publish_stats([giveaway])
+    states = await asyncio.to_thread(_shared_stats.read, giveaway.key, _shard[1])
+    return GiveawayStats.merged(states, stats.flag_prefix)
+
+
+@_handler_metrics.timed("stats")
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /stats [розыгрыш] для администраторов"""
+    giveaway, _ = _admin_giveaway(context.args)
+    await update.message.reply_text(render_stats(giveaway, await _giveaway_stats(giveaway)))
+
+
+def render_giveaways(bot_username: str, stats_by_key: dict[str, GiveawayStats]) -> str:
+    """Текст /giveaways: розыгрыши процесса, их сроки и ссылки"""
+    lines = ["🎁 Розыгрыши:"]
+    for giveaway in _giveaways:
+        stats = stats_by_key[giveaway.key]
+        lines += [
+            "",
+            f"{giveaway.title} ({giveaway.key}): {GIVEAWAY_STATUS_NAMES[giveaway.status()]}",
+            f"Чат {giveaway.chat}, канал {giveaway.channel}",
+            f"🎫 Билетов: {stats.total_tickets} у {stats.participants} участников",
+            f"🔗 {giveaway.deep_link(bot_username)}",
+        ]
+    return "\n".join(lines)
+
+
+@_handler_metrics.timed("giveaways")
+async def giveaways_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /giveaways для администраторов - список розыгрышей со ссылками"""
+    stats_by_key = {giveaway.key: await _giveaway_stats(giveaway) for giveaway in _giveaways}
+    await update.message.reply_text(
+        render_giveaways(context.bot.username, stats_by_key), disable_web_page_preview=True
+    )
+
+
+async def _is_still_subscribed(context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway, user_id: int) -> bool:
+    """Перепроверка участника: чат и канал напрямую через API, ошибки пробрасываются (повторит Reverification)
+    Запросы идут в полосе broadcast, уступая лимит ответам пользователям и модерации"""
+    is_chat_member, is_channel_member = await asyncio.gather(
+        check_single_subscription(context, user_id, giveaway.chat, strict=True, lane="broadcast"),
+        check_single_subscription(context, user_id, giveaway.channel, strict=True, lane="broadcast"),
+    )
+    return is_chat_member and is_channel_member
+
+
+def render_reverification(giveaway: Giveaway) -> str:
+    """Текст /reverify status"""
+    runtime = _runtime(giveaway)
+    progress = runtime.reverification.progress()
+    if not progress:
+        return f"Перепроверка ({giveaway.key}) ещё не запускалась. /reverify {giveaway.key} - начать."
+    state = "идёт" if progress["running"] else ("завершена" if progress["snapshot"] else "остановлена")
+    lines = [
+        f"🔁 Перепроверка #{progress['run_id']} ({giveaway.key}): {state}",
+        f"Проверено: {progress['checked']} из ~{runtime.stats.participants}",
+        f"Подписаны: {progress['eligible']}, не удалось проверить: {progress['failed']}",
+    ]
+    if progress["running"]:
+        lines.append(f"Параллельность: {progress['concurrency']}, ответов 429: {progress['retry_after']}")
+    if progress["snapshot"]:
+        lines.append(f"Снимок для розыгрыша: {progress['snapshot']}")
+    return "\n".join(lines)
+
+
+async def _notify_reverification_done(bot, giveaway: Giveaway, run: ReverificationRun) -> None:
+    """Итог перепроверки всем администраторам"""
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(admin_id, render_reverification(giveaway))
+        except TelegramError as exc:
+            logger.warning(f"⚠️ Не удалось отправить итог перепроверки {admin_id}: {exc}")
+
+
+def _start_reverification(application: Application, giveaway: Giveaway) -> ReverificationRun:
+    context = CallbackContext(application)
+    return _runtime(giveaway).reverification.start(
+        partial(_is_still_subscribed, context, giveaway),
+        on_done=partial(_notify_reverification_done, application.bot, giveaway),
+    )
+
+
+@_handler_metrics.timed("reverify")
+async def reverify_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /reverify [розыгрыш] [status] для администраторов - перепроверка подписки всех участников с билетами"""
+    giveaway, args = _admin_giveaway(context.args)
+    runtime = _runtime(giveaway)
+    if args and args[0].lower() == "status" or runtime.reverification.running:
+        await update.message.reply_text(render_reverification(giveaway))
+        return
+    run = _start_reverification(context.application, giveaway)
+    logger.info(f"🔁 Перепроверка #{run.run_id} ({giveaway.key}) запущена администратором {update.message.from_user.id}")
+    await update.message.reply_text(
+        f"🔁 Перепроверка #{run.run_id} ({giveaway.key}) запущена: участников с билетами ~{runtime.stats.participants}.\n"
+        f"Ход - /reverify {giveaway.key} status, по окончании пришлю итог."
+    )
+
+
+_export_lock = asyncio.Lock()  # Одна выгрузка за раз: она читает всю базу
+
+
+@_handler_metrics.timed("export")
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /export [розыгрыш] [csv|jsonl] для администраторов - выгрузка участников документом"""
+    message = update.message
+    giveaway, args = _admin_giveaway(context.args)
+    fmt = args[0].lower() if args else "csv"
+    if fmt not in EXPORT_FORMATS:
+        await message.reply_text(f"Формат: {' или '.join(EXPORT_FORMATS)}, например /export csv")
+        return
+    if _export_lock.locked():
+        await message.reply_text("⏳ Выгрузка уже готовится, подожди.")
+        return
+
+    async with _export_lock:
+        await message.reply_text("⏳ Готовлю выгрузку участников...")
+        started = time.time()
+        # Запись в файл идёт в потоке: event loop продолжает обрабатывать пользователей
+        path, rows = await asyncio.to_thread(export_to_file, _runtime(giveaway).store, fmt)
+        try:
+            with open(path, "rb") as document:
+                await message.reply_document(
+                    document,
+                    filename=export_filename(fmt, started, giveaway.store_namespace),
+                    caption=f"📤 Участников: {rows}",
+                    write_timeout=120,
                 )
-            
-            text += "✨ Чем больше билетов, тем выше шанс выиграть!"
-            
-            await query.edit_message_text(
-                text,
-                reply_markup=get_boost_keyboard(user_id),
-            )
+        finally:
+            os.remove(path)
+    logger.info(
+        f"📤 Выгрузка {giveaway.key} {fmt} для {message.from_user.id}: {rows} участников за {time.time() - started:.1f} с"
+    )
+
+
+TICKET_REASON_NAMES = {
+    REASON_REQUIRED_STORY: "обязательное условие",
+    REASON_BOOST_SOCIAL: "дополнительный репост",
+    REASON_ADMIN: "администратор",
+}
+TICKET_HISTORY_LIMIT = 20  # Последних событий в ответе /tickets
+
+
+def render_ticket_event(event: TicketEvent) -> str:
+    """Строка истории билетов: когда, сколько, почему"""
+    when = time.strftime("%d.%m %H:%M:%S", time.localtime(event.at))
+    details = [TICKET_REASON_NAMES.get(event.reason, event.reason)]
+    if event.social:
+        details.append(event.social)
+    if event.admin_id:
+        details.append(f"админ {event.admin_id}")
+    if event.note:
+        details.append(event.note)
+    return f"▫️ {when} {event.delta:+d} → {event.balance} 🎫 ({', '.join(details)})"
+
+
+@_handler_metrics.timed("tickets")
+async def tickets_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /tickets [розыгрыш] <user_id> [+N|-N] [причина] для администраторов
+    Без изменения - билеты участника и история из журнала, с изменением - начисление или списание.
+    В многопроцессном режиме фронт отправляет команду воркеру участника (sharding.routing_key),
+    поэтому билеты меняет тот же процесс, что и его скриншоты"""
+    message = update.message
+    giveaway, args = _admin_giveaway(context.args)
+    if not args or not args[0].isdigit():
+        await message.reply_text("Формат: /tickets [розыгрыш] <user_id> [+N|-N] [причина], например /tickets 123 -1 фейк")
+        return
+    user_id = int(args[0])
+    runtime = _runtime(giveaway)
+
+    if len(args) > 1:
+        try:
+            delta = int(args[1])
+        except ValueError:
+            await message.reply_text("Изменение билетов - целое число, например +1 или -1")
             return
+        note = " ".join(args[2:]) or None
+        tickets = add_ticket(giveaway, user_id, delta, REASON_ADMIN, admin_id=message.from_user.id, note=note)
+        logger.info(
+            f"🧾 Администратор {message.from_user.id} изменил билеты {user_id} ({giveaway.key}) на {delta:+d}: "
+            f"теперь {tickets}"
+        )
+        await message.reply_text(f"🎫 Билетов у {user_id} ({giveaway.key}): {tickets}")
+        return
 
-        if callback_data == REQUIRED_STORY:
-            try:
-                # Проверяем подписку
-                if not await is_member_cached(context, user_id):
-                    await query.edit_message_text(
-                        "⚠️ Сначала нужно вступить в чат!\n\n"
-                        "Вернись к шагу проверки подписки.",
-                        reply_markup=get_subscription_check_keyboard(is_subscribed=False),
-                    )
-                    return
-                
-                # Окно выбора соцсети
-                text = (
-                    "📸 Выбери соцсеть, где выложишь сторис:\n\n"
-                    "💡 Выбери одну из соцсетей ниже"
-                )
-                context.user_data["awaiting_required_story"] = True
-                buttons = [
-                    [
-                        InlineKeyboardButton("📱 Telegram", callback_data=SOCIAL_TELEGRAM),
-                    ],
-                    [
-                        InlineKeyboardButton("💬 WhatsApp", callback_data=SOCIAL_WHATSAPP),
-                        InlineKeyboardButton("📸 Instagram", callback_data=SOCIAL_INSTAGRAM),
-                    ],
-                    [
-                        InlineKeyboardButton("↩️ Назад", callback_data=NEXT_TO_REQUIRED),
-                    ],
-                ]
-                
-                # Если текущее сообщение - это медиа (фото), используем edit_message_media, иначе edit_message_text
-                try:
-                    if query.message.photo:
-                        # Если сообщение с фото, пытаемся отредактировать медиа
-                        await query.edit_message_caption(
-                            caption=text,
-                            reply_markup=InlineKeyboardMarkup(buttons),
-                        )
-                    else:
-                        # Обычное текстовое сообщение
-                        await query.edit_message_text(
-                            text,
-                            reply_markup=InlineKeyboardMarkup(buttons),
-                        )
-                except Exception as edit_exc:
-                    # Если не удалось отредактировать, пробуем отправить новое сообщение
-                    logger.error(f"❌ Ошибка при редактировании сообщения: {edit_exc}")
-                    await query.message.reply_text(
-                        text,
-                        reply_markup=InlineKeyboardMarkup(buttons),
-                    )
-                    try:
-                        await query.message.delete()
-                    except:
-                        pass
-                
-                return
-            except Exception as e:
-                logger.exception(f"❌ Ошибка в обработчике REQUIRED_STORY: {e}")
-                await query.answer("Произошла ошибка. Попробуй ещё раз.", show_alert=True)
+    # Журнал читается целиком - в потоке, чтобы не держать event loop
+    events = await asyncio.to_thread(runtime.ledger.history, user_id)
+    lines = [f"🎫 Билетов у {user_id} ({giveaway.key}): {get_user_tickets(giveaway, user_id)}"]
+    if events:
+        if len(events) > TICKET_HISTORY_LIMIT:
+            lines.append(f"Последние {TICKET_HISTORY_LIMIT} из {len(events)} изменений:")
+        lines += [render_ticket_event(event) for event in events[-TICKET_HISTORY_LIMIT:]]
+    else:
+        lines.append("В журнале нет изменений.")
+    await message.reply_text("\n".join(lines))
 
-        if callback_data == MY_TICKETS:
-            tickets = get_user_tickets(user_id)
-            
-            user = query.from_user
-            user_name = user.first_name or "Пользователь"
-            if user.last_name:
-                user_name += f" {user.last_name}"
-            user_id_display = user.id
-            
-            text = (
-                f"━━━━━━━━━━━━━━━━━━━━\n"
-                f"👤 Имя: {user_name}\n"
-                f"🆔 ID: {user_id_display}\n"
-                f"🎫 Билетов: {tickets}\n"
-            )
-            
-            if GIVEAWAY_END_DATE:
-                text += f"📅 Дата итогов: {GIVEAWAY_END_DATE}\n"
-            
-            text += f"━━━━━━━━━━━━━━━━━━━━"
-            
-            await query.edit_message_text(
-                text,
-                reply_markup=get_main_menu_keyboard(user_id),
+
+async def _edit_with_story_image(
+    query, giveaway: Giveaway, caption: str, reply_markup: InlineKeyboardMarkup
+) -> None:
+    """Заменяет сообщение на афишу розыгрыша: по file_id, если она уже загружена, иначе загружает файл"""
+    file_id = _media_cache.get_file_id(giveaway.poster)
+    if file_id:
+        try:
+            await query.edit_message_media(
+                media=InputMediaPhoto(media=file_id, caption=caption),
+                reply_markup=reply_markup,
             )
             return
+        except BadRequest as exc:
+            # file_id мог стать недействительным (например, сменился токен бота)
+            logger.warning("⚠️ Не удалось отправить афишу по file_id, загружаю заново: %s", exc)
+            _media_cache.invalidate(giveaway.poster)
+
+    with open(giveaway.poster, "rb") as photo:
+        message = await query.edit_message_media(
+            media=InputMediaPhoto(media=photo, caption=caption),
+            reply_markup=reply_markup,
+        )
+    if isinstance(message, Message) and message.photo:
+        _media_cache.remember(giveaway.poster, message.photo[-1].file_id)
 
-        if callback_data == BOOST_CHANCE:
-            # Проверяем подписку
-            if not await is_member_cached(context, user_id):
-                await query.edit_message_text(
-                    "⚠️ Сначала нужно вступить в чат!\n\n"
-                    "Вернись к шагу проверки подписки.",
-                    reply_markup=get_subscription_check_keyboard(is_subscribed=False),
-                )
-                return
-            
-            # Проверяем обязательное условие - ОБЯЗАТЕЛЬНО перед повышением шанса
-            if not has_required_condition(user_id):
-                await query.edit_message_text(
-                    "⚠️ Сначала нужно выполнить обязательное условие!\n\n"
-                    "📸 Выложи в Stories афишу розыгрыша с ссылкой на пост.\n"
-                    "После выполнения обязательного условия ты получишь 1 билет и сможешь повысить шанс дополнительными репостами.\n\n"
-                    "💡 Обязательное условие = 1 билет (минимум для участия)\n"
-                    "🎁 Дополнительные репосты = +1 билет за каждый",
-                    reply_markup=get_required_condition_keyboard(has_required=False),
-                )
-                return
-            
-            # Показываем окно с выбором оставшихся соцсетей
-            tickets = get_user_tickets(user_id)
-            remaining_socials = get_remaining_socials(user_id)
-            required_social = get_required_social(user_id)
-            
-            if not remaining_socials:
-                # Все соцсети использованы - показываем только кнопку Профиль
-                user = query.from_user
-                user_name = user.first_name or "Пользователь"
-                if user.last_name:
-                    user_name += f" {user.last_name}"
-                user_id_display = user.id
-                
-                await query.edit_message_text(
-                    f"🎉 Ты использовал все доступные соцсети!\n\n"
-                    f"━━━━━━━━━━━━━━━━━━━━\n"
-                    f"👤 Имя: {user_name}\n"
-                    f"🆔 ID: {user_id_display}\n"
-                    f"🎫 Билетов: {tickets}\n"
-                    f"━━━━━━━━━━━━━━━━━━━━\n\n"
-                    f"✨ Удачи в розыгрыше!",
-                    reply_markup=get_profile_keyboard(),
-                )
-                return
-            
-            remaining_names = [name for name, _, _ in remaining_socials]
-            text = (
-                f"📋 Выбери соцсеть для увеличения шанса:\n\n"
-                f"💡 Доступные соцсети: {', '.join(remaining_names)}\n"
-                f"🎫 Каждая история = +1 билет\n\n"
-                f"✨ Чем больше билетов, тем выше шанс выиграть!"
+
+async def _edit_text_or_caption(query, text: str, reply_markup: InlineKeyboardMarkup | None) -> None:
+    """Редактирует текст сообщения или подпись, если сообщение с фото
+    Если редактирование не удалось, отправляет новое сообщение вместо старого"""
+    try:
+        if query.message.photo:
+            # Если сообщение с фото, редактируем подпись
+            await query.edit_message_caption(
+                caption=text,
+                reply_markup=reply_markup,
             )
-            
+        else:
+            # Обычное текстовое сообщение
             await query.edit_message_text(
                 text,
-                reply_markup=get_boost_keyboard(user_id),
+                reply_markup=reply_markup,
             )
-            return
-        
-        if callback_data == "back_to_main_menu":
-            # Возврат в главное меню
-            user = query.from_user
-            user_name = user.first_name or "Пользователь"
-            if user.last_name:
-                user_name += f" {user.last_name}"
-            user_id_display = user.id
-            tickets = get_user_tickets(user_id)
-            
-            text = (
-                f"━━━━━━━━━━━━━━━━━━━━\n"
-                f"👤 Имя: {user_name}\n"
-                f"🆔 ID: {user_id_display}\n"
-                f"🎫 Билетов: {tickets}\n"
-                f"━━━━━━━━━━━━━━━━━━━━\n\n"
-                f"🎁 Нажми «Увеличить шанс», чтобы получить дополнительные билеты!"
+    except Exception as edit_exc:
+        # Если не удалось отредактировать, отправляем новое сообщение
+        logger.error("❌ Ошибка при редактировании сообщения: %s", edit_exc)
+        await query.message.reply_text(
+            text,
+            reply_markup=reply_markup,
+        )
+        try:
+            await query.message.delete()
+        except:
+            pass
+
+
+def _closed_text(giveaway: Giveaway) -> str | None:
+    """Текст для розыгрыша вне сроков (скриншоты не принимаются) или None, если он идёт"""
+    status = giveaway.status()
+    if status == "upcoming":
+        return GIVEAWAY_UPCOMING_TEXT
+    if status == "finished":
+        return GIVEAWAY_FINISHED_TEXT
+    return None
+
+
+async def _show_closed(query, giveaway: Giveaway) -> bool:
+    """Показывает, что розыгрыш вне сроков; True - дальше идти не нужно"""
+    text = _closed_text(giveaway)
+    if text is None:
+        return False
+    keyboard = get_profile_keyboard(giveaway) if giveaway.status() == "finished" else None
+    await _edit_text_or_caption(query, text, keyboard)
+    return True
+
+
+@_callbacks.exact(CHECK_SUBSCRIPTION)
+async def _on_check_subscription(query, context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    user_id = query.from_user.id
+    # Очищаем кэш для этого пользователя, чтобы проверить актуальный статус
+    _subscription_cache.pop((giveaway.required_chats, user_id))
+
+    # Проверяем подписку (без кэша для актуальной проверки)
+    if await is_member_cached(context, giveaway, user_id, use_cache=False):
+        _runtime(giveaway).stats.mark_step(context.user_data, "subscribed")
+        await query.edit_message_text(
+            SUBSCRIBED_TEXT,
+            reply_markup=get_subscription_check_keyboard(giveaway, is_subscribed=True),
+        )
+    else:
+        await query.edit_message_text(
+            NOT_SUBSCRIBED_TEXT,
+            reply_markup=get_subscription_check_keyboard(giveaway, is_subscribed=False),
+        )
+
+
+@_callbacks.exact(NEXT_TO_SUBSCRIPTION)
+async def _on_next_to_subscription(query, context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    # Окно 2: Проверка подписки
+    user_id = query.from_user.id
+    # Очищаем кэш для актуальной проверки
+    _subscription_cache.pop((giveaway.required_chats, user_id))
+    is_subscribed = await is_member_cached(context, giveaway, user_id, use_cache=False)
+    if is_subscribed:
+        _runtime(giveaway).stats.mark_step(context.user_data, "subscribed")
+
+    await query.edit_message_text(
+        SUBSCRIBED_TEXT if is_subscribed else SUBSCRIPTION_NEEDED_TEXT,
+        reply_markup=get_subscription_check_keyboard(giveaway, is_subscribed),
+    )
+
+
+@_callbacks.exact(NEXT_TO_REQUIRED)
+async def _on_next_to_required(query, context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    # Окно 3: Обязательное условие
+    user_id = query.from_user.id
+    has_required = has_required_condition(giveaway, user_id)
+
+    if has_required:
+        # Если условие выполнено, переходим к окну увеличения шансов
+        text = (
+            f"✅ Обязательное условие уже выполнено!\n\n"
+            f"🎫 Твои билеты: {get_user_tickets(giveaway, user_id)}\n\n"
+            f"{render_boost_options(giveaway, user_id)}"
+            f"{MORE_TICKETS_TEXT}"
+        )
+        await query.edit_message_text(
+            text,
+            reply_markup=get_boost_keyboard(giveaway, user_id),
+        )
+        return
+
+    # Отправляем изображение для сторис с текстом и кнопками
+    story_poster_text = _giveaway_texts(giveaway)["story_poster"]
+    try:
+        if os.path.exists(giveaway.poster):
+            # Редактируем сообщение, заменяя его на фото с подписью
+            await _edit_with_story_image(
+                query, giveaway, story_poster_text, get_required_condition_keyboard(giveaway, has_required)
             )
-            
+        else:
+            # Если файла нет, показываем обычный текст
+            logger.warning("⚠️ Файл изображения %s не найден. Добавьте изображение для сторис.", giveaway.poster)
             await query.edit_message_text(
-                text,
-                reply_markup=get_main_menu_keyboard(user_id),
+                story_poster_text,
+                reply_markup=get_required_condition_keyboard(giveaway, has_required),
             )
-            return
+    except Exception as e:
+        logger.error("❌ Ошибка при отправке изображения: %s", e)
+        # Если ошибка, показываем обычный текст
+        await query.edit_message_text(
+            story_poster_text,
+            reply_markup=get_required_condition_keyboard(giveaway, has_required),
+        )
 
-        if callback_data == SOCIAL_TELEGRAM:
-            try:
-                context.user_data["selected_social"] = "Telegram"
-                is_required = context.user_data.get("awaiting_required_story", False)
-                
-                if is_required:
-                    # Сохраняем выбранную соцсеть для обязательного условия
-                    set_required_social(user_id, "Telegram")
-                    context.user_data["awaiting_required_story"] = True
-                    text = (
-                        "📱 Соцсеть выбрана: Telegram\n\n"
-                        "📸 Отправь скриншот своего Stories с афишей розыгрыша.\n\n"
-                        "💡 Убедись, что на скриншоте видно:\n"
-                        "• Твой профиль\n"
-                        "• Афиша розыгрыша\n"
-                        f"• Ссылка на чат: t.me/torgovlya_kfu\n\n"
-                        "✅ После отправки получишь 1 билет (обязательное условие)!"
-                    )
-                    buttons = [
-                        [
-                            InlineKeyboardButton("↩️ Назад", callback_data=REQUIRED_STORY),
-                        ],
-                    ]
-                    keyboard = InlineKeyboardMarkup(buttons)
-                else:
-                    # Проверяем, что это не та же соцсеть, что для обязательного условия и не использована для дополнительных билетов
-                    required_social = get_required_social(user_id)
-                    used_boost = get_used_boost_socials(user_id)
-                    if required_social == "Telegram" or "Telegram" in used_boost:
-                        await query.answer("❌ Ты уже использовал Telegram. Выбери другую соцсеть!", show_alert=True)
-                        return
-                    context.user_data["awaiting_screenshot"] = True
-                    text = (
-                        "📱 Выбрана соцсеть: Telegram\n\n"
-                        "📸 Отправь скриншот репоста поста в Telegram Stories или чате.\n\n"
-                        "💡 Убедись, что на скриншоте видно:\n"
-                        "• Твой профиль\n"
-                        "• Репост нашего поста\n\n"
-                        "🎫 За каждый репост получишь +1 билет!"
-                    )
-                    keyboard = get_boost_keyboard(user_id)
-                
-                # Пытаемся отредактировать сообщение (поддерживаем и медиа, и текст)
-                try:
-                    if query.message.photo:
-                        # Если сообщение с фото, редактируем подпись
-                        await query.edit_message_caption(
-                            caption=text,
-                            reply_markup=keyboard,
-                        )
-                    else:
-                        # Обычное текстовое сообщение
-                        await query.edit_message_text(
-                            text,
-                            reply_markup=keyboard,
-                        )
-                except Exception as edit_exc:
-                    # Если не удалось отредактировать, отправляем новое сообщение
-                    logger.error(f"❌ Ошибка при редактировании сообщения: {edit_exc}")
-                    await query.message.reply_text(
-                        text,
-                        reply_markup=keyboard,
-                    )
-                    try:
-                        await query.message.delete()
-                    except:
-                        pass
-                
-                return
-            except Exception as e:
-                logger.exception(f"❌ Ошибка в обработчике SOCIAL_TELEGRAM: {e}")
-                await query.answer("Произошла ошибка. Попробуй ещё раз.", show_alert=True)
 
-        if callback_data == SOCIAL_WHATSAPP:
-            context.user_data["selected_social"] = "WhatsApp"
-            is_required = context.user_data.get("awaiting_required_story", False)
-            
-            if is_required:
-                # Сохраняем выбранную соцсеть для обязательного условия
-                set_required_social(user_id, "WhatsApp")
-                context.user_data["awaiting_required_story"] = True
-                text = (
-                    "💬 Соцсеть выбрана: WhatsApp\n\n"
-                    "📸 Отправь скриншот своего Status с афишей розыгрыша.\n\n"
-                    "💡 Убедись, что на скриншоте видно:\n"
-                    "• Твой профиль\n"
-                    "• Афиша розыгрыша\n"
-                    f"• Ссылка на чат: t.me/torgovlya_kfu\n\n"
-                    "✅ После отправки получишь 1 билет (обязательное условие)!"
-                )
-                buttons = [
-                    [
-                        InlineKeyboardButton("↩️ Назад", callback_data=REQUIRED_STORY),
-                    ],
-                ]
-                keyboard = InlineKeyboardMarkup(buttons)
-            else:
-                # Проверяем, что это не та же соцсеть, что для обязательного условия и не использована для дополнительных билетов
-                required_social = get_required_social(user_id)
-                used_boost = get_used_boost_socials(user_id)
-                if required_social == "WhatsApp" or "WhatsApp" in used_boost:
-                    await query.answer("❌ Ты уже использовал WhatsApp. Выбери другую соцсеть!", show_alert=True)
-                    return
-                context.user_data["awaiting_screenshot"] = True
-                text = (
-                    "💬 Выбрана соцсеть: WhatsApp\n\n"
-                    "📸 Отправь скриншот репорта поста в WhatsApp Status.\n\n"
-                    "💡 Убедись, что на скриншоте видно:\n"
-                    "• Твой профиль\n"
-                    "• Репост нашего поста\n\n"
-                    "🎫 За каждый репост получишь +1 билет!"
-                )
-                keyboard = get_boost_keyboard(user_id)
-            await query.edit_message_text(
-                text,
-                reply_markup=keyboard,
-            )
+@_callbacks.exact(NEXT_TO_BOOST)
+async def _on_next_to_boost(query, context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    # Окно 4: Увеличение шансов
+    user_id = query.from_user.id
+    text = (
+        f"🎫 Твои билеты: {get_user_tickets(giveaway, user_id)}\n\n"
+        f"{render_boost_options(giveaway, user_id)}"
+        f"{MORE_TICKETS_TEXT}"
+    )
+    await query.edit_message_text(
+        text,
+        reply_markup=get_boost_keyboard(giveaway, user_id),
+    )
+
+
+@_callbacks.exact(REQUIRED_STORY)
+async def _on_required_story(query, context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    user_id = query.from_user.id
+    try:
+        if await _show_closed(query, giveaway):
             return
 
-        if callback_data == SOCIAL_INSTAGRAM:
-            context.user_data["selected_social"] = "Instagram"
-            is_required = context.user_data.get("awaiting_required_story", False)
-            
-            if is_required:
-                # Сохраняем выбранную соцсеть для обязательного условия
-                set_required_social(user_id, "Instagram")
-                context.user_data["awaiting_required_story"] = True
-                text = (
-                    "📸 Соцсеть выбрана: Instagram\n\n"
-                    "📸 Отправь скриншот своего Stories с афишей розыгрыша.\n\n"
-                    "💡 Убедись, что на скриншоте видно:\n"
-                    "• Твой профиль\n"
-                    "• Афиша розыгрыша\n"
-                    f"• Ссылка на чат: t.me/torgovlya_kfu\n\n"
-                    "✅ После отправки получишь 1 билет (обязательное условие)!"
-                )
-                buttons = [
-                    [
-                        InlineKeyboardButton("↩️ Назад", callback_data=REQUIRED_STORY),
-                    ],
-                ]
-                keyboard = InlineKeyboardMarkup(buttons)
-            else:
-                # Проверяем, что это не та же соцсеть, что для обязательного условия и не использована для дополнительных билетов
-                required_social = get_required_social(user_id)
-                used_boost = get_used_boost_socials(user_id)
-                if required_social == "Instagram" or "Instagram" in used_boost:
-                    await query.answer("❌ Ты уже использовал Instagram. Выбери другую соцсеть!", show_alert=True)
-                    return
-                context.user_data["awaiting_screenshot"] = True
-                text = (
-                    "📸 Выбрана соцсеть: Instagram\n\n"
-                    "📸 Отправь скриншот репоста поста в Instagram Stories.\n\n"
-                    "💡 Убедись, что на скриншоте видно:\n"
-                    "• Твой профиль\n"
-                    "• Репост нашего поста\n\n"
-                    "🎫 За каждый репост получишь +1 билет!"
-                )
-                keyboard = get_boost_keyboard(user_id)
-            await query.edit_message_text(
-                text,
-                reply_markup=keyboard,
+        # Проверяем подписку
+        if not await is_member_cached(context, giveaway, user_id):
+            await _edit_text_or_caption(
+                query, SUBSCRIBE_FIRST_TEXT, get_subscription_check_keyboard(giveaway, is_subscribed=False)
             )
             return
 
-        if callback_data == BACK_TO_MAIN:
-            # Возвращаем в первое окно приветствия
-            text = (
-                "🎉 Добро пожаловать на розыгрыш iPhone 17 Pro Max!\n\n"
-                "📱 От Торговли КФУ совместно с 9:41 store"
-            )
-            await query.edit_message_text(
-                text,
-                reply_markup=get_welcome_keyboard(),
-            )
+        # Окно выбора соцсети
+        _runtime(giveaway).stats.mark_step(context.user_data, "subscribed")
+        context.user_data[giveaway.state_key("awaiting_required_story")] = True
+
+        # Если текущее сообщение - это медиа (фото), редактируем подпись, иначе текст
+        await _edit_text_or_caption(query, CHOOSE_REQUIRED_SOCIAL_TEXT, get_required_social_keyboard(giveaway))
+    except Exception as e:
+        logger.exception("❌ Ошибка в обработчике REQUIRED_STORY: %s", e)
+        await query.answer("Произошла ошибка. Попробуй ещё раз.", show_alert=True)
+
+
+@_callbacks.exact(MY_TICKETS)
+async def _on_my_tickets(query, context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    user_id = query.from_user.id
+    text = (
+        f"{render_profile_card(query.from_user, get_user_tickets(giveaway, user_id))}"
+        f"{_giveaway_texts(giveaway)['end_date']}"
+        f"{CARD_SEPARATOR}"
+    )
+    await query.edit_message_text(
+        text,
+        reply_markup=get_main_menu_keyboard(giveaway, user_id),
+    )
+
+
+@_callbacks.exact(BOOST_CHANCE)
+async def _on_boost_chance(query, context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    user_id = query.from_user.id
+    if await _show_closed(query, giveaway):
+        return
+
+    # Проверяем подписку
+    if not await is_member_cached(context, giveaway, user_id):
+        await query.edit_message_text(
+            SUBSCRIBE_FIRST_TEXT,
+            reply_markup=get_subscription_check_keyboard(giveaway, is_subscribed=False),
+        )
+        return
+
+    # Проверяем обязательное условие - ОБЯЗАТЕЛЬНО перед повышением шанса
+    if not has_required_condition(giveaway, user_id):
+        await query.edit_message_text(
+            REQUIRED_FIRST_TEXT,
+            reply_markup=get_required_condition_keyboard(giveaway, has_required=False),
+        )
+        return
+
+    # Показываем окно с выбором оставшихся соцсетей
+    remaining_socials = get_remaining_socials(giveaway, user_id)
+
+    if not remaining_socials:
+        # Все соцсети использованы - показываем только кнопку Профиль
+        await query.edit_message_text(
+            f"{ALL_SOCIALS_USED_TEXT}\n\n"
+            f"{render_profile_card(query.from_user, get_user_tickets(giveaway, user_id))}"
+            f"{CARD_SEPARATOR}\n\n"
+            f"{GOOD_LUCK_TEXT}",
+            reply_markup=get_profile_keyboard(giveaway),
+        )
+        return
+
+    await query.edit_message_text(
+        CHOOSE_BOOST_SOCIAL_TEMPLATE.format(remaining=get_remaining_names(remaining_socials)),
+        reply_markup=get_boost_keyboard(giveaway, user_id),
+    )
+
+
+@_callbacks.exact(BACK_TO_MAIN_MENU)
+async def _on_back_to_main_menu(query, context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    # Возврат в главное меню
+    user_id = query.from_user.id
+    text = (
+        f"{render_profile_card(query.from_user, get_user_tickets(giveaway, user_id))}"
+        f"{CARD_SEPARATOR}\n\n"
+        f"{BOOST_HINT_TEXT}"
+    )
+    await query.edit_message_text(
+        text,
+        reply_markup=get_main_menu_keyboard(giveaway, user_id),
+    )
+
+
+async def _on_social(query, context: ContextTypes.DEFAULT_TYPE, social: str, giveaway: Giveaway) -> None:
+    """Выбор соцсети: для обязательного условия или для дополнительного билета"""
+    user_id = query.from_user.id
+    user_data = context.user_data
+    try:
+        user_data[giveaway.state_key("selected_social")] = social
+        is_required = user_data.get(giveaway.state_key("awaiting_required_story"), False)
+
+        if is_required:
+            # Сохраняем выбранную соцсеть для обязательного условия
+            set_required_social(giveaway, user_id, social)
+            text = _giveaway_texts(giveaway)[f"required_{social}"]
+            keyboard = get_back_to_required_story_keyboard(giveaway)
+        else:
+            # Проверяем, что это не та же соцсеть, что для обязательного условия и не использована для дополнительных билетов
+            required_social = get_required_social(giveaway, user_id)
+            used_boost = get_used_boost_socials(giveaway, user_id)
+            if required_social == social or social in used_boost:
+                await query.answer(f"❌ Ты уже использовал {social}. Выбери другую соцсеть!", show_alert=True)
+                return
+            user_data[giveaway.state_key("awaiting_screenshot")] = True
+            text = _SOCIAL_BOOST_TEXTS[social]
+            keyboard = get_boost_keyboard(giveaway, user_id)
+
+        # Поддерживаем и сообщения с афишей (подпись), и текстовые
+        await _edit_text_or_caption(query, text, keyboard)
+    except Exception as e:
+        logger.exception("❌ Ошибка в обработчике соцсети %s: %s", social, e)
+        await query.answer("Произошла ошибка. Попробуй ещё раз.", show_alert=True)
+
+
+for _social_name, _social_callback, _ in SOCIALS:
+    _callbacks.add_exact(_social_callback, _on_social, social=_social_name)
+
+
+@_callbacks.exact(BACK_TO_MAIN)
+async def _on_back_to_main(query, context: ContextTypes.DEFAULT_TYPE, giveaway: Giveaway) -> None:
+    # Возвращаем в первое окно приветствия
+    await query.edit_message_text(
+        giveaway.welcome,
+        reply_markup=get_welcome_keyboard(giveaway),
+    )
+
+
+@_handler_metrics.timed("handle_buttons")
+async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик нажатий на кнопки (маршрутизация по таблице _callbacks)
+    callback_data "<розыгрыш>:<действие>" - обработчик получает розыгрыш аргументом giveaway"""
+    query = update.callback_query
+    if not query:
+        return
+
+    try:
+        await query.answer()
+        parsed = _giveaways.parse_callback(query.data or "")
+        if parsed is None:
+            # Кнопка розыгрыша, которого больше нет в конфигурации
+            await query.edit_message_text(GIVEAWAY_NOT_FOUND_TEXT)
             return
+        giveaway, action = parsed
+        _select_giveaway(context, giveaway)
+        if not await _callbacks.dispatch(query, context, data=action, giveaway=giveaway):
+            logger.warning("⚠️ Неизвестная кнопка: %s", query.data)
 
     except Exception as exc:
-        logger.exception(f"Error in handle_buttons: {exc}")
+        logger.exception("Error in handle_buttons: %s", exc)
         try:
             await query.answer("Произошла ошибка. Попробуй ещё раз.", show_alert=True)
         except:
             pass
 
 
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик фото"""
-    user_id = update.message.from_user.id
-    is_subscribed = await is_member_cached(context, user_id)
-    
-    # Проверяем, это обязательное условие или дополнительный репост
-    is_required = context.user_data.get("awaiting_required_story", False)
-    is_boost = context.user_data.get("awaiting_screenshot", False)
-    
-    if not (is_required or is_boost):
-        await update.message.reply_text(
-            "📸 Я жду скриншот только после выбора действия.\n\n"
-            "Выбери действие через кнопки меню.",
-            reply_markup=get_main_keyboard(show_check_button=not is_subscribed, user_id=user_id),
-        )
-        return
+def _screenshot_retry_keyboard(giveaway: Giveaway, user_id: int, is_required: bool) -> InlineKeyboardMarkup:
+    """Клавиатура под ответом, если скриншот не принят"""
+    return get_back_to_required_story_keyboard(giveaway) if is_required else get_boost_keyboard(giveaway, user_id)
+
+
+def _is_social_used(giveaway: Giveaway, user_id: int, social: str) -> bool:
+    """Соцсеть уже дала билет (обязательное условие или дополнительный репост)"""
+    required_social = get_required_social(giveaway, user_id)
+    return bool(required_social and social == required_social) or social in get_used_boost_socials(giveaway, user_id)
+
+
+async def _reject_duplicate(message: Message, submission, social: str, keyboard: InlineKeyboardMarkup) -> bool:
+    """Записывает повтор в лог; True - скриншот отклонён (ответ пользователю отправлен)"""
+    logger.warning(
+        "🖼 Повторный скриншот от %s (%s): совпадает с %s пользователя %s, расстояние %s",
+        message.from_user.id, social, submission.duplicate_of,
+        _screenshots.owner(submission.duplicate_of), submission.distance,
+    )
+    if not REJECT_DUPLICATE_SCREENSHOTS:
+        return False
+    await message.reply_text(DUPLICATE_SCREENSHOT_TEXT, reply_markup=keyboard)
+    return True
+
+
+async def _grant_screenshot(
+    message: Message,
+    context: ContextTypes.DEFAULT_TYPE,
+    giveaway: Giveaway,
+    is_required: bool,
+    selected_social: str,
+) -> None:
+    """Начисляет билет за принятый скриншот и показывает итог"""
+    user = message.from_user
+    user_id = user.id
 
-    selected_social = context.user_data.get("selected_social", "соцсети")
-    
     if is_required:
         # Обязательное условие выполнено
-        context.user_data["awaiting_required_story"] = False
+        context.user_data[giveaway.state_key("awaiting_required_story")] = False
         # Сохраняем выбранную соцсеть (уже сохранена при выборе)
-        set_required_condition(user_id, True)
-        tickets = add_ticket(user_id, 1)  # +1 билет за обязательное условие
-        
-        # Получаем информацию о пользователе
-        user = update.message.from_user
-        user_name = user.first_name or "Пользователь"
-        if user.last_name:
-            user_name += f" {user.last_name}"
-        user_id_display = user.id
-        
+        set_required_condition(giveaway, user_id, True)
+        # +1 билет за обязательное условие
+        tickets = add_ticket(giveaway, user_id, 1, REASON_REQUIRED_STORY, social=selected_social)
+
         # Показываем главное меню
         text = (
-            f"✅ Отлично! Обязательное условие выполнено!\n\n"
-            f"📸 Скриншот Stories из {selected_social} получен.\n\n"
-            f"🎫 Ты получил 1 билет (обязательное условие)!\n\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n"
-            f"👤 Имя: {user_name}\n"
-            f"🆔 ID: {user_id_display}\n"
-            f"🎫 Билетов: {tickets}\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"🎁 Нажми «Увеличить шанс», чтобы получить дополнительные билеты!"
+            f"{REQUIRED_DONE_TEMPLATE.format(social=selected_social)}"
+            f"{render_profile_card(user, tickets)}"
+            f"{CARD_SEPARATOR}\n\n"
+            f"{BOOST_HINT_TEXT}"
         )
-        
-        # Показываем главное меню
-        keyboard = get_main_menu_keyboard(user_id)
+        keyboard = get_main_menu_keyboard(giveaway, user_id)
     else:
-        # Дополнительный репост
-        # Проверяем, что это не та же соцсеть, что для обязательного условия и не использована для дополнительных билетов
-        required_social = get_required_social(user_id)
-        used_boost = get_used_boost_socials(user_id)
-        
-        if (required_social and selected_social == required_social) or selected_social in used_boost:
-            await update.message.reply_text(
-                f"❌ Ты уже использовал {selected_social}.\n\n"
-                f"📱 Выбери другую соцсеть из оставшихся.",
-                reply_markup=get_boost_keyboard(user_id),
+        # Дополнительный репост (соцсеть проверяем ещё раз: пока шла проверка, её могли использовать)
+        if _is_social_used(giveaway, user_id, selected_social):
+            await message.reply_text(
+                SOCIAL_ALREADY_USED_TEMPLATE.format(social=selected_social),
+                reply_markup=get_boost_keyboard(giveaway, user_id),
             )
             return
-        
+
         # Сохраняем использованную соцсеть для дополнительных билетов
-        add_used_boost_social(user_id, selected_social)
-        context.user_data["awaiting_screenshot"] = False
-        context.user_data["selected_social"] = None
-        tickets = add_ticket(user_id, 1)  # +1 билет за дополнительный репост
-        
-        # Получаем информацию о пользователе
-        user = update.message.from_user
-        user_name = user.first_name or "Пользователь"
-        if user.last_name:
-            user_name += f" {user.last_name}"
-        user_id_display = user.id
-        
+        add_used_boost_social(giveaway, user_id, selected_social)
+        context.user_data[giveaway.state_key("awaiting_screenshot")] = False
+        context.user_data[giveaway.state_key("selected_social")] = None
+        # +1 билет за дополнительный репост
+        tickets = add_ticket(giveaway, user_id, 1, REASON_BOOST_SOCIAL, social=selected_social)
+
         # Получаем оставшиеся соцсети
-        remaining_socials = get_remaining_socials(user_id)
-        
+        remaining_socials = get_remaining_socials(giveaway, user_id)
+
         text = (
-            f"✅ Отлично! Скриншот из {selected_social} получен!\n\n"
-            f"🎫 Ты получил +1 билет!\n\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n"
-            f"👤 Имя: {user_name}\n"
-            f"🆔 ID: {user_id_display}\n"
-            f"🎫 Билетов: {tickets}\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n\n"
+            f"{BOOST_DONE_TEMPLATE.format(social=selected_social)}"
+            f"{render_profile_card(user, tickets)}"
+            f"{CARD_SEPARATOR}\n\n"
         )
-        
+
         if remaining_socials:
-            remaining_names = [name for name, _, _ in remaining_socials]
             text += (
-                f"💡 Можешь отправить ещё скриншоты из оставшихся соцсетей: {', '.join(remaining_names)}\n"
-                f"✨ Чем больше билетов, тем выше шанс выиграть!"
+                f"💡 Можешь отправить ещё скриншоты из оставшихся соцсетей: {get_remaining_names(remaining_socials)}\n"
+                f"{MORE_TICKETS_TEXT}"
             )
             # Возвращаемся в главное меню
-            keyboard = get_main_menu_keyboard(user_id)
+            keyboard = get_main_menu_keyboard(giveaway, user_id)
         else:
-            text += (
-                f"🎉 Ты использовал все доступные соцсети!\n"
-                f"✨ Удачи в розыгрыше!"
-            )
+            text += f"{ALL_SOCIALS_USED_TEXT}\n{GOOD_LUCK_TEXT}"
             # Все соцсети использованы - показываем только кнопку Профиль
-            keyboard = get_profile_keyboard()
-    
-    await update.message.reply_text(
+            keyboard = get_profile_keyboard(giveaway)
+
+    await message.reply_text(
         text,
         reply_markup=keyboard,
     )
 
 
+async def _finish_screenshot(
+    message: Message,
+    context: ContextTypes.DEFAULT_TYPE,
+    giveaway: Giveaway,
+    is_required: bool,
+    selected_social: str,
+    result: VerificationResult | None,
+) -> None:
+    """Поиск похожих скриншотов и начисление билета (result=None - проверка выключена)"""
+    user_id = message.from_user.id
+    phash = result.phash if result else None
+    submission = await _screenshots.record(message.photo[-1].file_unique_id, phash, user_id, selected_social)
+    if submission.is_duplicate:
+        # Хэш считается без афиши (verification.py), поэтому похожие скриншоты - это
+        # тот же снимок, а не просто другая сторис с той же афишей
+        keyboard = _screenshot_retry_keyboard(giveaway, user_id, is_required)
+        if await _reject_duplicate(message, submission, selected_social, keyboard):
+            return
+    await _grant_screenshot(message, context, giveaway, is_required, selected_social)
+
+
+async def _on_screenshot_verified(
+    message: Message,
+    context: ContextTypes.DEFAULT_TYPE,
+    giveaway: Giveaway,
+    is_required: bool,
+    selected_social: str,
+    result: VerificationResult,
+) -> None:
+    """Результат проверки из очереди: начисляем билет или объясняем отказ"""
+    user_id = message.from_user.id
+    context.user_data.pop(giveaway.state_key("screenshot_pending_at"), None)
+    try:
+        if result.ok:
+            await _finish_screenshot(message, context, giveaway, is_required, selected_social, result)
+        else:
+            await message.reply_text(
+                SCREENSHOT_REJECTED_TEXTS.get(result.reason, SCREENSHOT_CHECK_FAILED_TEXT),
+                reply_markup=_screenshot_retry_keyboard(giveaway, user_id, is_required),
+            )
+    finally:
+        # user_data изменён вне обработки обновления - помечаем для сохранения
+        context.application.mark_data_for_update_persistence(user_ids=user_id)
+
+
+@_handler_metrics.timed("handle_photo")
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик фото: ставит скриншот в очередь проверки, билет начисляется по её результату"""
+    message = update.message
+    user_id = message.from_user.id
+    user_data = context.user_data
+    giveaway = _current_giveaway(context)
+    is_subscribed = await is_member_cached(context, giveaway, user_id)
+
+    # Проверяем, это обязательное условие или дополнительный репост
+    is_required = user_data.get(giveaway.state_key("awaiting_required_story"), False)
+    is_boost = user_data.get(giveaway.state_key("awaiting_screenshot"), False)
+
+    if not (is_required or is_boost):
+        await message.reply_text(
+            SCREENSHOT_NOT_EXPECTED_TEXT,
+            reply_markup=get_main_keyboard(giveaway, show_check_button=not is_subscribed, user_id=user_id),
+        )
+        return
+
+    # Вне сроков розыгрыша скриншоты не принимаются
+    closed_text = _closed_text(giveaway)
+    if closed_text is not None:
+        await message.reply_text(closed_text, reply_markup=get_profile_keyboard(giveaway))
+        return
+
+    selected_social = user_data.get(giveaway.state_key("selected_social"), "соцсети")
+    keyboard = _screenshot_retry_keyboard(giveaway, user_id, is_required)
+
+    # Проверяем, что это не та же соцсеть, что для обязательного условия и не использована для дополнительных билетов
+    if not is_required and _is_social_used(giveaway, user_id, selected_social):
+        await message.reply_text(
+            SOCIAL_ALREADY_USED_TEMPLATE.format(social=selected_social),
+            reply_markup=get_boost_keyboard(giveaway, user_id),
+        )
+        return
+
+    # Пока предыдущий скриншот в очереди, новый не принимаем (иначе билет начислится дважды)
+    pending_key = giveaway.state_key("screenshot_pending_at")
+    pending_at = user_data.get(pending_key)
+    if pending_at and time.time() - pending_at < SCREENSHOT_PENDING_TIMEOUT:
+        await message.reply_text(SCREENSHOT_PENDING_TEXT)
+        return
+
+    # Тот же файл ловится сразу, без скачивания
+    exact = _screenshots.check_exact(message.photo[-1].file_unique_id)
+    if exact is not None and await _reject_duplicate(message, exact, selected_social, keyboard):
+        return
+
+    if not _verifier.enabled:
+        await _finish_screenshot(message, context, giveaway, is_required, selected_social, None)
+        return
+
+    job = VerificationJob(
+        photo=message.photo[-1],
+        on_done=partial(_on_screenshot_verified, message, context, giveaway, is_required, selected_social),
+        poster_path=giveaway.poster,
+    )
+    if not _verifier.submit(job):
+        await message.reply_text(SCREENSHOT_QUEUE_FULL_TEXT, reply_markup=keyboard)
+        return
+    user_data[pending_key] = time.time()
+    await message.reply_text(SCREENSHOT_CHECKING_TEXT)
+
+
+@_handler_metrics.timed("handle_text")
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик текстовых сообщений"""
+    """Обработчик текстовых сообщений (подсказка по текущему розыгрышу)"""
     user_id = update.message.from_user.id
-    is_subscribed = await is_member_cached(context, user_id)
-    has_required = has_required_condition(user_id)
-    tickets = get_user_tickets(user_id)
-    
+    giveaway = _current_giveaway(context)
+    is_subscribed = await is_member_cached(context, giveaway, user_id)
+
     if is_subscribed:
-        if has_required:
-            text = (
-                "👋 Используй кнопки ниже для взаимодействия с ботом:\n\n"
-                f"🎫 Твои билеты: {tickets}\n\n"
-                "• «🎁 Повысить шанс» — отправь скриншот репоста (+1 билет)\n"
-                "• «🎫 Мои билеты» — посмотри количество билетов"
-            )
-            keyboard = get_boost_keyboard(user_id)
+        if has_required_condition(giveaway, user_id):
+            text = HELP_BOOST_TEMPLATE.format(tickets=get_user_tickets(giveaway, user_id))
+            keyboard = get_boost_keyboard(giveaway, user_id)
         else:
-            text = (
-                "👋 Используй кнопки ниже для взаимодействия с ботом:\n\n"
-                "• «📸 Выполнить обязательное условие» — сторис с афишей (обязательно)\n"
-                "• После выполнения сможешь повысить шанс дополнительными репостами"
-            )
-            keyboard = get_required_condition_keyboard(has_required=False)
+            text = HELP_REQUIRED_TEXT
+            keyboard = get_required_condition_keyboard(giveaway, has_required=False)
     else:
-        text = (
-            "👋 Используй кнопки ниже для взаимодействия с ботом:\n\n"
-            "• «✅ Проверить подписку» — проверь вступление в чат\n"
-            "• После вступления выполни обязательное условие"
-        )
-        keyboard = get_subscription_check_keyboard(is_subscribed=False)
-    
+        text = HELP_SUBSCRIBE_TEXT
+        keyboard = get_subscription_check_keyboard(giveaway, is_subscribed=False)
+
     await update.message.reply_text(
         text,
         reply_markup=keyboard,
     )
 
 
-def build_application(token: str) -> Application:
-    """Создает и настраивает приложение бота"""
-    return (
+def build_application(
+    token: str,
+    request: BaseRequest | None = None,
+    rate_limiter: BaseRateLimiter | None = None,
+) -> Application:
+    """Создает и настраивает приложение бота
+    request - свой транспорт Bot API (например, фейковый в bench.py),
+    rate_limiter - замена ограничителя частоты запросов"""
+    builder = (
         Application.builder()
         .token(token)
-        .rate_limiter(AIORateLimiter())
+        .rate_limiter(rate_limiter or _rate_limiter)
         .concurrent_updates(True)  # Разрешаем параллельную обработку обновлений
-        .build()
     )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    # Шаг воронки (context.user_data) переживает перезапуск
+    persistence = create_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    return builder.build()
 
 
-async def check_bot_permissions(application: Application) -> None:
-    """Проверяет права бота в целевом чате при запуске"""
+async def _check_chat_permissions(bot, target_chat: str, suffix: str) -> None:
+    """Проверяет права бота в чате розыгрыша (suffix - к именам проверок в /readyz)"""
     try:
-        bot = application.bot
-        logger.info(f"🔍 Проверяю права бота в {TARGET_CHAT}...")
+        logger.info(f"🔍 Проверяю права бота в {target_chat}...")
         
         # Проверяем, может ли бот получить информацию о чате
-        chat = await bot.get_chat(TARGET_CHAT)
+        chat = await bot.get_chat(target_chat)
         logger.info(f"✅ Чат найден: {chat.title} (тип: {chat.type})")
+        _membership.resolve(chat.id, chat.username)
+        _readiness.set(f"target_chat{suffix}", True, target_chat)
         
         # Проверяем статус бота в чате
-        bot_member = await bot.get_chat_member(TARGET_CHAT, bot.id)
+        bot_member = await bot.get_chat_member(target_chat, bot.id)
         status_name = bot_member.status.name if hasattr(bot_member.status, 'name') else str(bot_member.status)
         logger.info(f"🤖 Статус бота в чате: {status_name}")
         
         if bot_member.status != ChatMemberStatus.ADMINISTRATOR:
-            logger.warning(f"⚠️ Бот НЕ является администратором в {TARGET_CHAT}!")
+            logger.warning(f"⚠️ Бот НЕ является администратором в {target_chat}!")
             logger.warning(f"💡 Добавь бота как администратора с правами:")
             logger.warning(f"   - Просмотр участников (View members)")
             logger.warning(f"   - Просмотр информации о канале (View channel info)")
+            _readiness.set(f"bot_admin{suffix}", False, status_name)
         else:
-            logger.info(f"✅ Бот является администратором в {TARGET_CHAT}")
+            logger.info(f"✅ Бот является администратором в {target_chat}")
+            _readiness.set(f"bot_admin{suffix}", True)
             
         # Тестовая проверка подписки (проверяем самого бота)
         try:
-            test_member = await bot.get_chat_member(TARGET_CHAT, bot.id)
+            test_member = await bot.get_chat_member(target_chat, bot.id)
             logger.info(f"✅ Тестовая проверка подписки прошла успешно")
+            _readiness.set(f"subscription_check{suffix}", True)
         except Exception as test_exc:
+            _readiness.set(f"subscription_check{suffix}", False, str(test_exc))
             logger.error(f"❌ Тестовая проверка подписки не удалась: {test_exc}")
             logger.error(f"💡 Бот не может проверять подписки. Убедись в правах администратора.")
             
     except Exception as exc:
         error_msg = str(exc).lower()
         logger.error(f"❌ Не могу проверить права бота: {exc}")
+        _readiness.set(f"target_chat{suffix}", False, str(exc))
         
         if "chat not found" in error_msg or "chat_id_invalid" in error_msg:
-            logger.error(f"💡 Чат {TARGET_CHAT} не найден!")
+            logger.error(f"💡 Чат {target_chat} не найден!")
             logger.error(f"💡 Убедись, что:")
-            logger.error(f"   1. Username чата правильный: {TARGET_CHAT}")
+            logger.error(f"   1. Username чата правильный: {target_chat}")
             logger.error(f"   2. Бот добавлен в чат")
             logger.error(f"   3. Бот является администратором")
         elif "not enough rights" in error_msg or "forbidden" in error_msg:
-            logger.error(f"💡 У бота нет доступа к {TARGET_CHAT}")
+            logger.error(f"💡 У бота нет доступа к {target_chat}")
             logger.error(f"💡 Добавь бота в чат и сделай его администратором")
         else:
             logger.exception("Неожиданная ошибка при проверке прав")
 
 
-def main() -> None:
-    """Главная функция запуска бота"""
-    load_dotenv()
-    
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        raise RuntimeError(
-            "Set BOT_TOKEN env variable or create .env file with BOT_TOKEN=your_token"
+async def check_bot_permissions(application: Application) -> None:
+    """Проверяет права бота в чатах розыгрышей при запуске
+    Результаты записываются в _readiness (эндпоинт /readyz): у чата главного розыгрыша
+    прежние имена проверок, у остальных - с суффиксом :<чат>"""
+    for chat in dict.fromkeys(giveaway.chat for giveaway in _giveaways):
+        suffix = "" if chat == _primary.chat else f":{chat}"
+        await _check_chat_permissions(application.bot, chat, suffix)
+
+
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик ошибок"""
+    error = context.error
+    if isinstance(error, Conflict):
+        logger.warning(
+            "⚠️ Conflict: Другой экземпляр бота получает обновления. "
+            "Убедись, что локальный бот остановлен. Бот будет переподключаться..."
         )
-
-    application = build_application(token)
+        # Бот автоматически переподключится через некоторое время
+    else:
+        logger.error("Необработанная ошибка: %s", error, exc_info=error)
+
+
+def setup_application(
+    token: str,
+    shard: int | None = None,
+    request: BaseRequest | None = None,
+    rate_limiter: BaseRateLimiter | None = None,
+    workers: int = 1,
+) -> Application:
+    """Создает приложение с обработчиками и хуками запуска/остановки
+    shard - номер процесса-воркера в многопроцессном режиме (workers - их число),
+    request и rate_limiter передаются в build_application"""
+    global _shard, _shared_stats, _rate_limiter
+    if shard is not None and workers > 1:
+        # Лимиты Bot API действуют на токен, а не на процесс: у воркера своя доля
+        _rate_limiter = PriorityRateLimiter.shared_by(workers, _api_metrics, overall_rate=API_RATE_LIMIT)
+    application = build_application(token, request=request, rate_limiter=rate_limiter)
+    screens = sum(prebuild_screens(giveaway) for giveaway in _giveaways)
+    logger.info(f"🧩 Клавиатуры и тексты экранов построены заранее: {screens}")
+    
+    if shard is not None:
+        _shard = (shard, workers)
+        if database_path() is not None:
+            _shared_stats = SharedStats(database_path())
+        # Файлы, которые пишутся целиком, у каждого воркера свои (пользователи поделены по воркерам)
+        if _membership.path:
+            _membership.path = f"{_membership.path}.shard{shard}"
+        if _cleanup.path:
+            _cleanup.path = f"{_cleanup.path}.shard{shard}"
+        # Скриншоты пишут все воркеры в одну таблицу: перед проверкой дочитываем чужие
+        _screenshots.shared = True
+        for runtime in _runtimes.values():
+            runtime.ledger.use_shard(shard)
+            # Пользователь обрабатывается только своим воркером, записи остальных читаются из базы
+            runtime.store.owns = lambda user_id: jump_hash(user_id, workers) == shard
+    
+    # Сервер метрик: у каждого воркера свой порт (METRICS_PORT + номер воркера)
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = create_metrics_server(_metrics, _readiness, lambda: application.running)
+    
+    background: list[asyncio.Task] = []  # Фоновые задачи процесса, отменяются при остановке
     
     # Проверяем права бота при запуске
     async def post_init(app: Application) -> None:
+        for runtime in _runtimes.values():
+            runtime.store.start()
+        await asyncio.to_thread(_open_ledgers)
+        for key, stats in (await asyncio.to_thread(_load_stats, app.persistence)).items():
+            _runtimes[key].stats = stats
+        if _shared_stats is not None:
+            await _publish_stats(list(_giveaways))
+            background.append(asyncio.create_task(_publish_stats_every(STATS_PUBLISH_INTERVAL)))
+        _screenshots.load()
+        _subscription_cache.start_sweeper()
+        # Все режимы запускаются с drop_pending_updates=True: выходы из чатов за время простоя
+        # потеряны, поэтому сохранённые статусы не используем, а участники перепроверяются через API
+        _membership.load(members=False)
+        _membership.start_autosave()
+        _cleanup.start(app.bot)
+        await _verifier.start(app.bot)
+        for runtime in _runtimes.values():
+            runtime.ledger.start()
+        if metrics_server is not None:
+            port = METRICS_PORT + (shard or 0)
+            try:
+                await metrics_server.start(METRICS_LISTEN, port)
+            except OSError as exc:
+                logger.error(f"❌ Не удалось запустить сервер метрик на порту {port}: {exc}")
         await check_bot_permissions(app)
+        # Перепроверку, прерванную падением или перезапуском, продолжает один процесс
+        if shard in (None, 0):
+            for runtime in _runtimes.values():
+                if runtime.reverification.pending_run() is not None:
+                    _start_reverification(app, runtime.giveaway)
+    
+    # Сохраняем накопленные изменения участников при остановке
+    async def post_shutdown(app: Application) -> None:
+        _subscription_cache.stop_sweeper()
+        for task in background:
+            task.cancel()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await _membership.stop_autosave()
+        await _cleanup.stop()
+        await _verifier.stop()
+        # Несохранённая страница перепроверки будет проверена заново при следующем запуске
+        for runtime in _runtimes.values():
+            await runtime.reverification.stop()
+            # Последний снимок журнала: следующий запуск проиграет пустой хвост
+            await runtime.ledger.close()
+        logger.info(f"📊 Кэш подписок: {_subscription_cache.stats()}")
+        logger.info(f"📊 Время обработки кнопок: {_callbacks.stats()}")
+        logger.info(f"📊 Модерация группы: {_moderation.stats()}")
+        logger.info(f"📊 Отложенное удаление: {_cleanup.stats()}")
+        if app.persistence is not None:
+            logger.info(f"📊 Состояние воронки (user_data): {app.persistence.stats()}")
+        logger.info(f"📊 Скриншоты: {_screenshots.stats()}, проверка: {_verifier.stats()}")
+        ledger_stats = {key: runtime.ledger.stats() for key, runtime in _runtimes.items()}
+        logger.info(f"📊 Журналы билетов: {ledger_stats}")
+        logger.info(f"📊 Лог: {_logs.stats()}")
+        _screenshots.close()
+        for runtime in _runtimes.values():
+            runtime.store.close()
     
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
     
     # Оптимизированный порядок обработчиков (от более специфичных к общим)
     # 1. Команды (самые специфичные)
     application.add_handler(CommandHandler("start", start))
+    admin_only = filters.User(ADMIN_IDS) & filters.ChatType.PRIVATE
+    application.add_handler(CommandHandler("export", export_command, filters=admin_only))
+    application.add_handler(CommandHandler("stats", stats_command, filters=admin_only))
+    application.add_handler(CommandHandler("reverify", reverify_command, filters=admin_only))
+    application.add_handler(CommandHandler("giveaways", giveaways_command, filters=admin_only))
+    application.add_handler(CommandHandler("tickets", tickets_command, filters=admin_only))
     
     # 2. Callback queries (кнопки) - должны быть перед MessageHandler
     application.add_handler(CallbackQueryHandler(handle_buttons))
     
-    # 3. Новые участники (специфичный статус)
+    # 3. Вступления/выходы в целевых чатах (индекс участников)
+    application.add_handler(
+        ChatMemberHandler(handle_chat_member_update, ChatMemberHandler.ANY_CHAT_MEMBER)
+    )
+    
+    # 4. Новые участники (специфичный статус)
     application.add_handler(
         MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_chat_members)
     )
     
-    # 4. Проверка подписки в группах (только группы, не команды)
+    # 5. Проверка подписки в группах (только группы, не команды)
     application.add_handler(
         MessageHandler(
             filters.ChatType.GROUPS & ~filters.COMMAND,
@@ -1247,12 +2264,12 @@ def main() -> None:
         )
     )
     
-    # 5. Фото в личных чатах
+    # 6. Фото в личных чатах
     application.add_handler(
         MessageHandler(filters.PHOTO & filters.ChatType.PRIVATE, handle_photo)
     )
     
-    # 6. Текст в личных чатах (самый общий, последний)
+    # 7. Текст в личных чатах (самый общий, последний)
     application.add_handler(
         MessageHandler(
             filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE,
@@ -1261,19 +2278,48 @@ def main() -> None:
     )
     
     # Обработчик ошибок для Conflict (когда бот запущен в нескольких местах)
-    async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Обработчик ошибок"""
-        error = context.error
-        if isinstance(error, Conflict):
-            logger.warning(
-                "⚠️ Conflict: Другой экземпляр бота получает обновления. "
-                "Убедись, что локальный бот остановлен. Бот будет переподключаться..."
-            )
-            # Бот автоматически переподключится через некоторое время
-        else:
-            logger.error(f"Необработанная ошибка: {error}", exc_info=error)
-    
     application.add_error_handler(error_handler)
+    return application
+
+
+def main() -> None:
+    """Главная функция запуска бота"""
+    load_dotenv()
+    
+    parser = argparse.ArgumentParser(description="Telegram бот розыгрыша")
+    parser.add_argument(
+        "--mode",
+        choices=("polling", "webhook"),
+        default=os.getenv("BOT_MODE", "polling"),
+        help="способ получения обновлений (по умолчанию BOT_MODE или polling)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("BOT_WORKERS", "1")),
+        help="число процессов-обработчиков; больше 1 - обновления делятся по user_id (по умолчанию BOT_WORKERS или 1)",
+    )
+    args = parser.parse_args()
+    
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise RuntimeError(
+            "Set BOT_TOKEN env variable or create .env file with BOT_TOKEN=your_token"
+        )
+
+    webhook_config = WebhookConfig.from_env() if args.mode == "webhook" else None
+
+    if args.workers > 1:
+        logger.info(f"Bot starting ({args.mode}, {args.workers} workers)...")
+        run_sharded(token, args.workers, webhook_config)
+        return
+
+    application = setup_application(token)
+
+    if webhook_config is not None:
+        logger.info("Bot starting (webhook)...")
+        run_webhook(application, webhook_config)
+        return
 
     logger.info("Bot starting...")
     application.run_polling(
@@ -0,0 +1,105 @@
+"""Ограниченный кэш с TTL и вытеснением самых старых записей"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Кэш с временем жизни записей и лимитом размера
+
+    Все операции O(1): записи лежат в OrderedDict в порядке записи (set), самые старые в начале.
+    TTL у всех записей одинаковый, поэтому этот порядок совпадает с порядком истечения:
+    фоновая очистка снимает просроченные записи с головы, не обходя весь кэш.
+    Чтение порядок не меняет (иначе за свежей записью застряли бы просроченные).
+    """
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # {key: (value, expires_at)}
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._sweeper: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Вытеснено из-за лимита размера
+        self.expirations = 0  # Удалено по истечении TTL
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает значение, если оно есть и не устарело"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Сохраняет значение, вытесняя самую давнюю запись при переполнении"""
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        """Удаляет запись, если она есть"""
+        self._data.pop(key, None)
+
+    def sweep(self, limit: int = 10_000) -> int:
+        """Удаляет просроченные записи с головы кэша, возвращает их количество"""
+        now = time.monotonic()
+        removed = 0
+        while self._data and removed < limit:
+            key, (_, expires_at) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            del self._data[key]
+            removed += 1
+        self.expirations += removed
+        return removed
+
+    def stats(self) -> dict[str, int]:
+        """Счётчики для подбора размера кэша"""
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def start_sweeper(self, interval: float = 30.0) -> None:
+        """Запускает фоновую очистку в текущем event loop"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+
+    def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug("Cache sweep: removed=%d stats=%s", removed, self.stats())
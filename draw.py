@@ -0,0 +1,226 @@
+"""Розыгрыш: выбор победителей с весом по количеству билетов
+
+Билеты не разворачиваются в список: веса участников лежат в дереве Фенвика,
+поэтому каждый выбор занимает O(log n) даже при миллионах билетов.
+Случайные числа выводятся из seed через SHA-256, так что розыгрыш можно
+повторить и проверить офлайн по сохранённым seed, снимку участников и результату.
+
+Запуск:
+    python draw.py run --winners 3               # провести розыгрыш
+    python draw.py run --winners 3 --snapshot draws/eligible_X.csv  # только по перепроверенным участникам
+    python draw.py verify draws/draw_XXXX.json   # перепроверить проведённый розыгрыш
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import secrets
+import sys
+import time
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+from giveaways import DEFAULT_KEY
+from storage import ParticipantStore, create_store
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "fenwick-sha256-v1"
+
+
+class FenwickTree:
+    """Дерево Фенвика над весами: префиксные суммы, обновление и поиск за O(log n)"""
+
+    def __init__(self, weights: list[int]) -> None:
+        self.size = len(weights)
+        self._tree = [0] * (self.size + 1)
+        # Построение за O(n)
+        for i, weight in enumerate(weights, start=1):
+            self._tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self._tree[parent] += self._tree[i]
+        self._top_bit = 1 << (self.size.bit_length() - 1) if self.size else 0
+
+    def add(self, index: int, delta: int) -> None:
+        """Изменяет вес элемента index (с нуля) на delta"""
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, target: int) -> int:
+        """Индекс (с нуля) элемента, в чей диапазон попадает target: prefix(i) <= target < prefix(i + 1)"""
+        position = 0
+        step = self._top_bit
+        while step:
+            next_position = position + step
+            if next_position <= self.size and self._tree[next_position] <= target:
+                position = next_position
+                target -= self._tree[next_position]
+            step >>= 1
+        return position
+
+
+def _uniform(seed: str, counter: int, bound: int) -> int:
+    """Равномерное число из [0, bound), детерминированно выведенное из seed и номера шага"""
+    bits = max(bound.bit_length(), 1)
+    attempt = 0
+    while True:
+        digest = hashlib.sha256(f"{seed}:{counter}:{attempt}".encode()).digest()
+        value = int.from_bytes(digest, "big") >> (256 - bits)
+        # Отбрасываем значения вне диапазона, чтобы не было смещения
+        if value < bound:
+            return value
+        attempt += 1
+
+
+def snapshot_hash(participants: list[tuple[int, int]]) -> str:
+    """SHA-256 снимка участников (отсортированные строки "user_id:tickets")"""
+    digest = hashlib.sha256()
+    for user_id, tickets in participants:
+        digest.update(f"{user_id}:{tickets}\n".encode())
+    return digest.hexdigest()
+
+
+def draw_winners(participants: list[tuple[int, int]], winners: int, seed: str) -> list[int]:
+    """Выбирает до winners разных победителей, вероятность пропорциональна билетам
+
+    participants - список (user_id, tickets), отсортированный по user_id.
+    """
+    weights = [tickets for _, tickets in participants]
+    tree = FenwickTree(weights)
+    total = sum(weights)
+    result = []
+    for pick in range(min(winners, len(participants))):
+        if total <= 0:
+            break
+        index = tree.find(_uniform(seed, pick, total))
+        result.append(participants[index][0])
+        # Победитель выбывает: обнуляем его вес
+        tree.add(index, -weights[index])
+        total -= weights[index]
+        weights[index] = 0
+    return result
+
+
+@dataclass
+class DrawResult:
+    """Результат розыгрыша для аудита"""
+    seed: str
+    snapshot_sha256: str
+    participants: int
+    total_tickets: int
+    winners: list[int]
+    created_at: float
+    algorithm: str = ALGORITHM
+
+
+def load_participants(store: ParticipantStore) -> list[tuple[int, int]]:
+    """Снимок участников с билетами, отсортированный по user_id"""
+    return sorted(
+        (user_id, record.tickets) for user_id, record in store.iter_records() if record.tickets > 0
+    )
+
+
+def run_draw(
+    participants: list[tuple[int, int]], winners: int, seed: str | None, out_dir: str
+) -> tuple[DrawResult, str]:
+    """Проводит розыгрыш и сохраняет снимок участников и протокол, возвращает (результат, путь к протоколу)"""
+    seed = seed or secrets.token_hex(16)
+    result = DrawResult(
+        seed=seed,
+        snapshot_sha256=snapshot_hash(participants),
+        participants=len(participants),
+        total_tickets=sum(tickets for _, tickets in participants),
+        winners=draw_winners(participants, winners, seed),
+        created_at=time.time(),
+    )
+
+    os.makedirs(out_dir, exist_ok=True)
+    name = time.strftime("draw_%Y%m%d_%H%M%S", time.localtime(result.created_at))
+    snapshot_path = os.path.join(out_dir, f"{name}_snapshot.csv")
+    audit_path = os.path.join(out_dir, f"{name}.json")
+    with open(snapshot_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["user_id", "tickets"])
+        writer.writerows(participants)
+    with open(audit_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {**result.__dict__, "requested_winners": winners, "snapshot_file": os.path.basename(snapshot_path)},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    return result, audit_path
+
+
+def read_snapshot(path: str) -> list[tuple[int, int]]:
+    """Читает снимок участников, сохранённый run_draw"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Заголовок
+        return [(int(user_id), int(tickets)) for user_id, tickets in reader]
+
+
+def verify_draw(audit_path: str) -> bool:
+    """Перепроводит розыгрыш по протоколу и сравнивает результат"""
+    with open(audit_path, "r", encoding="utf-8") as f:
+        audit = json.load(f)
+    participants = read_snapshot(os.path.join(os.path.dirname(audit_path), audit["snapshot_file"]))
+    if snapshot_hash(participants) != audit["snapshot_sha256"]:
+        logger.error("❌ Хэш снимка участников не совпадает с протоколом")
+        return False
+    winners = draw_winners(participants, audit["requested_winners"], audit["seed"])
+    if winners != audit["winners"]:
+        logger.error(f"❌ Победители не совпадают: протокол {audit['winners']}, пересчёт {winners}")
+        return False
+    logger.info(f"✅ Розыгрыш подтверждён, победители: {winners}")
+    return True
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Точка входа командной строки"""
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s %(message)s", level=logging.INFO)
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Розыгрыш победителей по билетам")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="провести розыгрыш")
+    run_parser.add_argument("--winners", type=int, default=1, help="количество победителей")
+    run_parser.add_argument("--seed", help="seed (по умолчанию случайный)")
+    run_parser.add_argument("--out-dir", default="draws", help="папка для протоколов")
+    run_parser.add_argument("--snapshot", help="снимок участников user_id,tickets (например, после перепроверки)")
+    run_parser.add_argument("--giveaway", default=DEFAULT_KEY, help="ключ розыгрыша из GIVEAWAYS_PATH")
+    verify_parser = commands.add_parser("verify", help="перепроверить розыгрыш по протоколу")
+    verify_parser.add_argument("audit", help="путь к JSON-протоколу")
+    args = parser.parse_args(argv)
+
+    if args.command == "verify":
+        return 0 if verify_draw(args.audit) else 1
+
+    if args.snapshot:
+        participants = sorted(row for row in read_snapshot(args.snapshot) if row[1] > 0)
+    else:
+        store = create_store(None if args.giveaway == DEFAULT_KEY else args.giveaway)
+        try:
+            participants = load_participants(store)
+        finally:
+            store.close()
+    if not participants:
+        logger.error("❌ Нет участников с билетами")
+        return 1
+    result, audit_path = run_draw(participants, args.winners, args.seed, args.out_dir)
+    logger.info(
+        f"🎉 Победители: {result.winners} (участников: {result.participants}, "
+        f"билетов: {result.total_tickets}, seed: {result.seed})"
+    )
+    logger.info(f"📄 Протокол: {audit_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Выгрузка участников в CSV или JSONL (для розыгрыша и спонсоров)
+
+Участники читаются из хранилища по одному (SQLite-курсор, а не список), строки
+копятся в небольшом буфере и пишутся в файл кусками по CHUNK_ROWS, поэтому память
+не растёт с числом участников. Бот сжимает выгрузку в gzip и отправляет документом.
+
+Запуск:
+    python export.py --format csv --out participants.csv
+    python export.py --format jsonl --gzip --out participants.jsonl.gz
+    python export.py --format csv > participants.csv
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import BinaryIO, Iterable, Iterator
+
+from dotenv import load_dotenv
+
+from giveaways import DEFAULT_KEY
+from storage import ParticipantStore, UserRecord, create_store, participants_table
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+FIELDS = ("user_id", "tickets", "required_done", "required_social", "boost_socials", "created_at", "updated_at")
+CHUNK_ROWS = 5000  # Строк в одном куске записи
+
+
+@lru_cache(maxsize=65536)
+def _timestamp(seconds: int) -> str:
+    # Участники приходят волнами, поэтому секунды часто повторяются, а форматирование
+    # даты - самая дорогая часть строки
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+def export_row(user_id: int, record: UserRecord) -> tuple:
+    """Строка выгрузки в порядке FIELDS"""
+    return (
+        user_id,
+        record.tickets,
+        record.required_done,
+        record.required_social,
+        ",".join(sorted(record.boost_socials)),
+        _timestamp(int(record.created_at)),
+        _timestamp(int(record.updated_at)),
+    )
+
+
+def iter_chunks(
+    records: Iterable[tuple[int, UserRecord]], fmt: str, chunk_rows: int = CHUNK_ROWS
+) -> Iterator[bytes]:
+    """Выгрузка кусками по chunk_rows строк (для CSV первый кусок начинается с заголовка)"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(FIELDS)
+    rows = 0
+    for user_id, record in records:
+        row = export_row(user_id, record)
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False))
+            buffer.write("\n")
+        rows += 1
+        if rows % chunk_rows == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def write_export(store: ParticipantStore, fmt: str, output: BinaryIO) -> int:
+    """Пишет всех участников в output, возвращает количество строк"""
+    rows = 0
+
+    def counted() -> Iterator[tuple[int, UserRecord]]:
+        nonlocal rows
+        for item in store.iter_records():
+            rows += 1
+            yield item
+
+    for chunk in iter_chunks(counted(), fmt):
+        output.write(chunk)
+    return rows
+
+
+def export_to_file(store: ParticipantStore, fmt: str, directory: str | None = None) -> tuple[str, int]:
+    """Выгрузка во временный .gz файл (вызывать в потоке), возвращает (путь, строк)
+
+    Файл удаляет вызывающий.
+    """
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=f".{fmt}.gz", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as output:
+            rows = write_export(store, fmt, output)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, rows
+
+
+def export_filename(fmt: str, created_at: float | None = None, namespace: str | None = None) -> str:
+    """Имя файла выгрузки для пользователя (namespace - ключ розыгрыша, кроме основного)"""
+    stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(created_at))
+    return f"{participants_table(namespace)}_{stamp}.{fmt}.gz"
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Точка входа командной строки"""
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s %(message)s", level=logging.INFO)
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Выгрузка участников розыгрыша")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="формат выгрузки")
+    parser.add_argument("--out", help="файл (по умолчанию stdout)")
+    parser.add_argument("--gzip", action="store_true", help="сжать выгрузку gzip")
+    parser.add_argument("--giveaway", default=DEFAULT_KEY, help="ключ розыгрыша из GIVEAWAYS_PATH")
+    args = parser.parse_args(argv)
+
+    store = create_store(None if args.giveaway == DEFAULT_KEY else args.giveaway)
+    started = time.perf_counter()
+    try:
+        raw = open(args.out, "wb") if args.out else sys.stdout.buffer
+        try:
+            if args.gzip:
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as output:
+                    rows = write_export(store, args.format, output)
+            else:
+                rows = write_export(store, args.format, raw)
+        finally:
+            if args.out:
+                raw.close()
+            else:
+                raw.flush()
+    finally:
+        store.close()
+    logger.info(f"📤 Выгружено участников: {rows} за {time.perf_counter() - started:.1f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
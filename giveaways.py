@@ -0,0 +1,214 @@
+"""Розыгрыши из файла конфигурации
+
+Один процесс обслуживает несколько розыгрышей. Они описываются в GIVEAWAYS_PATH
+(JSON, список объектов), и у каждого свои:
+- билеты: таблица participants_<key> в общей базе (у розыгрыша main - participants);
+- чат и канал для проверки подписки, афиша (file_id кэшируется по пути файла) и сроки;
+- кнопки: callback_data "<key>:<действие>" (у main - просто "<действие>", как раньше);
+- ссылка https://t.me/<бот>?start=<key>, по которой пользователь попадает в розыгрыш.
+Без файла работает один розыгрыш main с прежними настройками.
+
+Пример giveaways.json:
+[
+  {
+    "key": "main",
+    "title": "iPhone 17 Pro Max",
+    "chat": "@torgovlya_kfu",
+    "channel": "@kfu_torgovlya",
+    "post_url": "https://t.me/torgovlya_kfu/1",
+    "poster": "story_image.png",
+    "starts_at": "2025-11-20T10:00",
+    "ends_at": "2025-12-14T20:00"
+  }
+]
+Необязательные поля: welcome (текст первого окна), chat_url и channel_url (по умолчанию
+t.me/<username>), end_date (дата итогов в карточке, по умолчанию из ends_at),
+starts_at и ends_at (ISO, местное время; вне сроков скриншоты не принимаются).
+"""
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterator
+
+from ledger import TicketLedger
+from reverify import Reverification
+from stats import GiveawayStats
+from storage import ParticipantStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEY = "main"  # Розыгрыш с прежними таблицами, callback_data и ключами user_data
+KEY_PATTERN = re.compile(r"[a-z0-9_]{1,32}")  # Попадает в имя таблицы, callback_data и ссылку
+CALLBACK_SEPARATOR = ":"
+
+
+@dataclass(frozen=True)
+class Giveaway:
+    """Настройки одного розыгрыша (неизменяемые: по ним кэшируются клавиатуры и тексты)"""
+    key: str
+    title: str
+    chat: str  # @username чата, в который нужно вступить
+    channel: str  # @username канала, на который нужно подписаться
+    poster: str  # Путь к афише для сторис
+    post_url: str = ""
+    welcome: str = ""
+    chat_url: str = ""
+    channel_url: str = ""
+    end_date: str = ""
+    starts_at: float | None = None
+    ends_at: float | None = None
+
+    @property
+    def is_default(self) -> bool:
+        return self.key == DEFAULT_KEY
+
+    @property
+    def required_chats(self) -> tuple[str, str]:
+        """Чаты, подписка на которые обязательна"""
+        return (self.chat, self.channel)
+
+    @property
+    def store_namespace(self) -> str | None:
+        """Пространство билетов в хранилище (None - прежняя таблица participants)"""
+        return None if self.is_default else self.key
+
+    def callback(self, action: str) -> str:
+        """callback_data кнопки этого розыгрыша"""
+        return action if self.is_default else f"{self.key}{CALLBACK_SEPARATOR}{action}"
+
+    def state_key(self, name: str) -> str:
+        """Ключ состояния пользователя в user_data (у каждого розыгрыша своё)"""
+        return name if self.is_default else f"{self.key}{CALLBACK_SEPARATOR}{name}"
+
+    def status(self, now: float | None = None) -> str:
+        """upcoming - ещё не начался, open - идёт, finished - приём закрыт"""
+        now = time.time() if now is None else now
+        if self.starts_at is not None and now < self.starts_at:
+            return "upcoming"
+        if self.ends_at is not None and now >= self.ends_at:
+            return "finished"
+        return "open"
+
+    def deep_link(self, bot_username: str) -> str:
+        return f"https://t.me/{bot_username}?start={self.key}"
+
+
+# Розыгрыш, который работал до появления файла конфигурации
+DEFAULT_GIVEAWAY = Giveaway(
+    key=DEFAULT_KEY,
+    title="iPhone 17 Pro Max",
+    welcome=(
+        "🎉 Добро пожаловать на розыгрыш iPhone 17 Pro Max!\n\n"
+        "📱 От Торговли КФУ совместно с 9:41 store"
+    ),
+    chat="@torgovlya_kfu",
+    chat_url="https://t.me/torgovlya_kfu",
+    channel="@kfu_torgovlya",
+    channel_url="https://t.me/kfu_torgovlya",
+    post_url="https://t.me/torgovlya_kfu/1",  # TODO: заменить на реальную ссылку
+    end_date="14.12.2025",  # Воскресенье
+    poster="story_image.png",
+)
+
+
+def _username_url(target: str) -> str:
+    return f"https://t.me/{target.lstrip('@')}"
+
+
+def _timestamp(value: Any, field_name: str) -> float | None:
+    if value in (None, ""):
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        raise ValueError(f"{field_name}: expected ISO date/time, got {value!r}") from None
+
+
+def parse_giveaway(data: dict[str, Any]) -> Giveaway:
+    """Розыгрыш из объекта конфигурации"""
+    key = str(data.get("key", ""))
+    if not KEY_PATTERN.fullmatch(key):
+        raise ValueError(f"Giveaway key must match {KEY_PATTERN.pattern}, got {key!r}")
+    for field_name in ("title", "chat", "channel", "poster"):
+        if not data.get(field_name):
+            raise ValueError(f"Giveaway {key}: missing {field_name}")
+    starts_at = _timestamp(data.get("starts_at"), f"{key}.starts_at")
+    ends_at = _timestamp(data.get("ends_at"), f"{key}.ends_at")
+    end_date = data.get("end_date") or (time.strftime("%d.%m.%Y", time.localtime(ends_at)) if ends_at else "")
+    return Giveaway(
+        key=key,
+        title=data["title"],
+        welcome=data.get("welcome") or f"🎉 Добро пожаловать на розыгрыш {data['title']}!",
+        chat=data["chat"],
+        chat_url=data.get("chat_url") or _username_url(data["chat"]),
+        channel=data["channel"],
+        channel_url=data.get("channel_url") or _username_url(data["channel"]),
+        post_url=data.get("post_url", ""),
+        end_date=end_date,
+        poster=data["poster"],
+        starts_at=starts_at,
+        ends_at=ends_at,
+    )
+
+
+class GiveawayRegistry:
+    """Розыгрыши процесса по ключам"""
+
+    def __init__(self, giveaways: list[Giveaway]) -> None:
+        if not giveaways:
+            raise ValueError("At least one giveaway is required")
+        self._by_key: dict[str, Giveaway] = {}
+        for giveaway in giveaways:
+            if giveaway.key in self._by_key:
+                raise ValueError(f"Duplicate giveaway key: {giveaway.key}")
+            self._by_key[giveaway.key] = giveaway
+        # Главный розыгрыш: /start без параметра и модерация группы
+        self.primary = self._by_key.get(DEFAULT_KEY, giveaways[0])
+
+    def __iter__(self) -> Iterator[Giveaway]:
+        return iter(self._by_key.values())
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def get(self, key: str | None) -> Giveaway | None:
+        return self._by_key.get(key) if key else None
+
+    def parse_callback(self, data: str) -> tuple[Giveaway, str] | None:
+        """(розыгрыш, действие) по callback_data; None - розыгрыша больше нет в конфигурации"""
+        key, separator, action = data.partition(CALLBACK_SEPARATOR)
+        if not separator:
+            key, action = DEFAULT_KEY, data
+        giveaway = self._by_key.get(key)
+        return (giveaway, action) if giveaway is not None else None
+
+    def targets(self) -> list[str]:
+        """Все чаты и каналы, подписку на которые проверяет бот (без повторов)"""
+        return list(dict.fromkeys(target for giveaway in self for target in giveaway.required_chats))
+
+
+def load_giveaways(path: str | None) -> GiveawayRegistry:
+    """Розыгрыши из JSON-файла; без файла - один DEFAULT_GIVEAWAY"""
+    if not path or not os.path.exists(path):
+        return GiveawayRegistry([DEFAULT_GIVEAWAY])
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    if not isinstance(items, list):
+        raise ValueError(f"{path}: expected a list of giveaways")
+    registry = GiveawayRegistry([parse_giveaway(item) for item in items])
+    logger.info(f"🎁 Розыгрышей в {path}: {len(registry)} ({', '.join(g.key for g in registry)})")
+    return registry
+
+
+@dataclass
+class GiveawayRuntime:
+    """Состояние розыгрыша в процессе: билеты и их журнал, статистика, перепроверка"""
+    giveaway: Giveaway
+    store: ParticipantStore
+    ledger: TicketLedger
+    stats: GiveawayStats
+    reverification: Reverification
@@ -0,0 +1,148 @@
+"""Минимальный асинхронный HTTP/1.1 сервер на asyncio (без внешних зависимостей)
+
+Нужен для приёма вебхуков Telegram и служебных эндпоинтов (health).
+Поддерживает keep-alive, Content-Length и лимит одновременных соединений.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+KEEP_ALIVE_TIMEOUT = 75.0  # Секунды ожидания следующего запроса в соединении
+
+
+@dataclass
+class HttpRequest:
+    """Входящий HTTP-запрос"""
+    method: str
+    path: str
+    query: str
+    headers: dict[str, str]
+    body: bytes
+
+
+@dataclass
+class HttpResponse:
+    """Ответ обработчика"""
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+Handler = Callable[[HttpRequest], Awaitable[HttpResponse]]
+
+
+class HttpServer:
+    """HTTP-сервер с таблицей маршрутов {(метод, путь): обработчик}"""
+
+    def __init__(self, max_connections: int = 100) -> None:
+        self._routes: dict[tuple[str, str], Handler] = {}
+        self._slots = asyncio.Semaphore(max_connections)
+        self._server: asyncio.AbstractServer | None = None
+        self._connections: set[asyncio.Task] = set()
+
+    def route(self, method: str, path: str, handler: Handler) -> None:
+        """Регистрирует обработчик для метода и пути"""
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self, host: str, port: int) -> None:
+        """Начинает принимать соединения"""
+        self._server = await asyncio.start_server(self._on_connection, host, port, limit=MAX_HEADER_SIZE)
+        logger.info(f"🌐 HTTP сервер слушает {host}:{port}")
+
+    async def stop(self) -> None:
+        """Прекращает приём соединений и закрывает открытые"""
+        if self._server is None:
+            return
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            # Лишние соединения ждут свободного слота (ограничение max_connections)
+            async with self._slots:
+                await self._serve(reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+            except asyncio.LimitOverrunError:
+                await self._write(writer, HttpResponse(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE), False)
+                return
+
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = request_line.split(" ", 2)
+            except ValueError:
+                await self._write(writer, HttpResponse(HTTPStatus.BAD_REQUEST), False)
+                return
+            headers = {}
+            for line in header_lines:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+
+            keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            if "chunked" in headers.get("transfer-encoding", "").lower():
+                await self._write(writer, HttpResponse(HTTPStatus.LENGTH_REQUIRED), False)
+                return
+            try:
+                length = int(headers.get("content-length", "0"))
+            except ValueError:
+                length = -1
+            if length < 0 or length > MAX_BODY_SIZE:
+                await self._write(writer, HttpResponse(HTTPStatus.REQUEST_ENTITY_TOO_LARGE), False)
+                return
+            body = await reader.readexactly(length) if length else b""
+
+            path, _, query = target.partition("?")
+            request = HttpRequest(method=method.upper(), path=path, query=query, headers=headers, body=body)
+            await self._write(writer, await self._dispatch(request), keep_alive)
+            if not keep_alive:
+                return
+
+    async def _dispatch(self, request: HttpRequest) -> HttpResponse:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return HttpResponse(HTTPStatus.METHOD_NOT_ALLOWED)
+            return HttpResponse(HTTPStatus.NOT_FOUND)
+        try:
+            return await handler(request)
+        except Exception:
+            logger.exception(f"Ошибка обработки HTTP {request.method} {request.path}")
+            return HttpResponse(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, response: HttpResponse, keep_alive: bool) -> None:
+        status = HTTPStatus(response.status)
+        headers = {
+            "Content-Type": response.content_type,
+            "Content-Length": str(len(response.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **response.headers,
+        }
+        head = f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + response.body)
+        await writer.drain()
@@ -0,0 +1,305 @@
+"""Журнал билетов: каждое начисление и списание с причиной
+
+Файл журнала только дописывается: одна JSON-строка на событие (номер, время,
+пользователь, изменение, баланс после него, причина и подробности). По нему можно
+разобрать любой спор: откуда у участника столько билетов.
+
+Чтобы запуск не зависел от длины журнала, балансы периодически сохраняются в снимок
+(<журнал>.snapshot): заголовок JSON с номером события и смещением в журнале, затем
+пары (user_id, билеты) массивом int64. При запуске читается снимок и проигрывается
+только хвост журнала после него. Снимок пишется в фоне после сохранения хранилища
+участников (before_snapshot), поэтому хранилище отстаёт от журнала не дальше хвоста -
+его и сверяют при запуске (open возвращает пользователей из хвоста).
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+from storage import database_path
+
+logger = logging.getLogger(__name__)
+
+# Причины изменения билетов
+REASON_REQUIRED_STORY = "required_story"  # Обязательное условие - сторис с афишей
+REASON_BOOST_SOCIAL = "boost_social"  # Дополнительный репост
+REASON_ADMIN = "admin"  # Ручное начисление или списание администратором
+SNAPSHOT_EVERY = 10000  # Событий между снимками
+SNAPSHOT_CHECK_INTERVAL = 30.0  # Секунды между проверками, пора ли делать снимок
+
+
+@dataclass
+class TicketEvent:
+    """Одно изменение билетов участника"""
+    seq: int
+    at: float
+    user_id: int
+    delta: int
+    balance: int  # Билетов после изменения
+    reason: str
+    social: str | None = None
+    admin_id: int | None = None
+    note: str | None = None
+
+    def to_line(self) -> str:
+        data = {key: value for key, value in vars(self).items() if value is not None}
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+    @classmethod
+    def from_line(cls, line: str) -> "TicketEvent":
+        return cls(**json.loads(line))
+
+
+class TicketLedger:
+    """Журнал билетов одного розыгрыша (path=None - только балансы в памяти)
+    before_snapshot - вызывается в потоке снимка до его записи (например, store.flush)"""
+
+    def __init__(
+        self,
+        path: str | None,
+        snapshot_every: int = SNAPSHOT_EVERY,
+        before_snapshot: Callable[[], None] | None = None,
+    ) -> None:
+        self.path = path
+        self.base_path = path  # Путь без номера воркера: по нему находятся журналы всех воркеров
+        self.snapshot_every = snapshot_every
+        self.before_snapshot = before_snapshot
+        self.balances: dict[int, int] = {}
+        self.seq = 0
+        self.replayed = 0  # Событий хвоста, проигранных при запуске
+        self.corrupt_lines = 0  # Повреждённых строк в середине журнала (пропущены при проигрывании)
+        self._file = None
+        self._offset = 0  # Конец журнала в байтах
+        self._snapshot_seq = 0
+        self._snapshot_loop: asyncio.Task | None = None
+
+    @property
+    def snapshot_path(self) -> str:
+        return f"{self.path}.snapshot"
+
+    def use_shard(self, shard: int) -> None:
+        """Многопроцессный режим: у каждого воркера свой файл журнала (<журнал>.shard<N>)"""
+        if self.base_path:
+            self.path = f"{self.base_path}.shard{shard}"
+
+    def _history_files(self) -> list[str]:
+        """Журнал без воркеров и журналы всех воркеров: после смены их числа
+        события пользователя могут лежать в разных файлах"""
+        pattern = re.compile(re.escape(self.base_path) + r"(\.shard\d+)?")
+        paths = glob.glob(glob.escape(self.base_path)) + glob.glob(glob.escape(self.base_path) + ".shard*")
+        return sorted(path for path in paths if pattern.fullmatch(path))
+
+    def balance(self, user_id: int) -> int:
+        return self.balances.get(user_id, 0)
+
+    def open(self, seed: Callable[[], Iterable[tuple[int, int]]] | None = None) -> set[int]:
+        """Читает снимок и хвост журнала, открывает журнал на дозапись (вызывать в потоке до приёма обновлений)
+        seed - начальные балансы из хранилища, если снимка нет или он повреждён (билеты, выданные до журнала).
+        Возвращает пользователей, чьи билеты менялись после снимка"""
+        if self.path is None or self._file is not None:
+            return set()
+        started = time.perf_counter()
+        offset = self._load_snapshot()
+        if offset is None:
+            # Снимка нет или он не читается: начальные балансы - из хранилища, журнал проигрывается
+            # с начала. В событии записан баланс после изменения, поэтому поверх хранилища
+            # получаются верные балансы, а билеты, выданные до журнала, не теряются
+            self.balances = {user_id: tickets for user_id, tickets in seed() if tickets} if seed is not None else {}
+            offset = 0
+            if not os.path.exists(self.path):
+                self._write_snapshot(self.balances, 0, 0)
+                logger.info(f"🧾 Журнал билетов {self.path} начат с {len(self.balances)} участников")
+        touched = self._replay(offset)
+        self._file = open(self.path, "a", encoding="utf-8", newline="\n")
+        self._offset = self._file.tell()
+        logger.info(
+            f"🧾 Журнал билетов {self.path}: событий {self.seq}, из хвоста {self.replayed}, "
+            f"участников {len(self.balances)} за {time.perf_counter() - started:.2f} с"
+        )
+        return touched
+
+    def _load_snapshot(self) -> int | None:
+        """Балансы из снимка; возвращает смещение журнала, с которого проигрывать хвост (None - снимка нет)"""
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                header = json.loads(f.readline())
+                pairs = array("q")
+                pairs.frombytes(f.read())
+            seq, offset = header["seq"], header["offset"]
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            # Повреждённый снимок не перезаписываем сразу: он остаётся рядом для разбора
+            logger.error(f"❌ Не удалось прочитать снимок {self.snapshot_path}, проигрываю весь журнал: {exc}")
+            try:
+                os.replace(self.snapshot_path, f"{self.snapshot_path}.corrupt")
+            except OSError:
+                pass
+            return None
+        if header.get("byteorder", sys.byteorder) != sys.byteorder:
+            pairs.byteswap()
+        self.balances = dict(zip(pairs[::2], pairs[1::2]))
+        self.seq = self._snapshot_seq = seq
+        return offset
+
+    def _replay(self, offset: int) -> set[int]:
+        touched: set[int] = set()
+        if not os.path.exists(self.path):
+            return touched
+        with open(self.path, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(offset)
+            for line in f:
+                try:
+                    event = TicketEvent.from_line(line.decode("utf-8"))
+                except (ValueError, TypeError) as exc:
+                    if offset + len(line) >= size:
+                        # Недописанная последняя строка после падения: отрезаем её, иначе новые события склеятся с ней
+                        logger.warning(f"⚠️ Обрезаю повреждённый конец журнала {self.path} на {offset} байте: {exc}")
+                        f.truncate(offset)
+                        break
+                    # Строка в середине: события после неё настоящие, журнал не трогаем, строку пропускаем
+                    logger.error(f"❌ Повреждённая строка журнала {self.path} на {offset} байте пропущена: {exc}")
+                    self.corrupt_lines += 1
+                    offset += len(line)
+                    continue
+                offset += len(line)
+                self.balances[event.user_id] = event.balance
+                self.seq = max(self.seq, event.seq)
+                touched.add(event.user_id)
+                self.replayed += 1
+                if not line.endswith(b"\n"):
+                    # Событие записано целиком, но без перевода строки - дописываем его
+                    f.write(b"\n")
+        return touched
+
+    def record(
+        self,
+        user_id: int,
+        delta: int,
+        balance: int,
+        reason: str,
+        social: str | None = None,
+        admin_id: int | None = None,
+        note: str | None = None,
+    ) -> TicketEvent:
+        """Дописывает изменение билетов (balance - билетов после него, как в хранилище)
+        Строка сразу уходит в ОС, поэтому падение процесса её не теряет"""
+        self.seq += 1
+        event = TicketEvent(self.seq, time.time(), user_id, delta, balance, reason, social, admin_id, note)
+        self.balances[user_id] = balance
+        if self._file is not None:
+            line = event.to_line()
+            self._file.write(line)
+            self._file.flush()
+            self._offset += len(line.encode("utf-8"))
+        return event
+
+    def history(self, user_id: int) -> list[TicketEvent]:
+        """Все события участника по времени (читает журналы целиком - вызывать в потоке)"""
+        if self.base_path is None:
+            return []
+        needle = f'"user_id":{user_id},'
+        events = []
+        for path in self._history_files():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    # Строка разбирается только если в ней есть нужный user_id
+                    if needle not in line:
+                        continue
+                    try:
+                        events.append(TicketEvent.from_line(line))
+                    except (ValueError, TypeError):
+                        # Повреждённая строка (пропускается и при проигрывании журнала)
+                        continue
+        return sorted(events, key=lambda event: event.at)
+
+    def _write_snapshot(self, balances: dict[int, int], seq: int, offset: int) -> None:
+        if self.before_snapshot is not None:
+            # Всё, что вошло в снимок, должно быть и в хранилище: при запуске сверяется только хвост
+            self.before_snapshot()
+        pairs = array("q")
+        for user_id, tickets in balances.items():
+            if tickets:
+                pairs.append(user_id)
+                pairs.append(tickets)
+        header = {"seq": seq, "offset": offset, "users": len(pairs) // 2, "at": time.time(),
+                  "byteorder": sys.byteorder}
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            pairs.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    async def snapshot(self) -> None:
+        """Сохраняет снимок балансов, если с прошлого были события (запись в отдельном потоке)"""
+        if self._file is None or self.seq == self._snapshot_seq:
+            return
+        # Снимок балансов и позиции журнала - в одном шаге event loop, чтобы они совпадали
+        balances, seq, offset = dict(self.balances), self.seq, self._offset
+        await asyncio.to_thread(os.fsync, self._file.fileno())
+        try:
+            await asyncio.to_thread(self._write_snapshot, balances, seq, offset)
+        except OSError as exc:
+            logger.error(f"❌ Не удалось сохранить снимок журнала билетов {self.snapshot_path}: {exc}")
+            return
+        self._snapshot_seq = seq
+        logger.info(f"🧾 Снимок журнала билетов: событие {seq}, участников {len(balances)}")
+
+    def start(self, interval: float = SNAPSHOT_CHECK_INTERVAL) -> None:
+        """Периодически делает снимок, когда накопилось snapshot_every событий"""
+        if self._file is not None and (self._snapshot_loop is None or self._snapshot_loop.done()):
+            self._snapshot_loop = asyncio.create_task(self._snapshot_every(interval))
+
+    async def _snapshot_every(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if self.seq - self._snapshot_seq >= self.snapshot_every:
+                await self.snapshot()
+
+    async def close(self) -> None:
+        """Останавливает фоновые снимки, сохраняет последний и закрывает журнал"""
+        if self._snapshot_loop is not None:
+            self._snapshot_loop.cancel()
+            await asyncio.gather(self._snapshot_loop, return_exceptions=True)
+            self._snapshot_loop = None
+        if self._file is None:
+            return
+        await self.snapshot()
+        self._file.close()
+        self._file = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "events": self.seq,
+            "since_snapshot": self.seq - self._snapshot_seq,
+            "replayed": self.replayed,
+            "corrupt_lines": self.corrupt_lines,
+            "users": len(self.balances),
+        }
+
+
+def ledger_path(namespace: str | None = None) -> str | None:
+    """Путь к журналу розыгрыша из TICKET_LEDGER_PATH (namespace - ключ розыгрыша, None - основной)
+    Без базы (STORAGE_BACKEND=memory) журнал тоже не ведётся"""
+    path = os.getenv("TICKET_LEDGER_PATH", "tickets.jsonl")
+    if not path or database_path() is None:
+        return None
+    if namespace:
+        base, ext = os.path.splitext(path)
+        path = f"{base}_{namespace}{ext}"
+    return path
+
+
+def create_ledger(namespace: str | None = None, before_snapshot: Callable[[], None] | None = None) -> TicketLedger:
+    """Создаёт журнал билетов по переменным окружения"""
+    return TicketLedger(ledger_path(namespace), before_snapshot=before_snapshot)
@@ -0,0 +1,163 @@
+"""Логирование без блокировки event loop
+
+Обработчик на корневом логгере только кладёт запись в очередь, в stdout и файл её
+выводит фоновый поток (QueueListener): медленный диск или stdout не задерживают бота.
+- сообщение собирается в фоновом потоке, поэтому на горячих путях используйте
+  %-форматирование (logger.info("... %s", value)), а не f-строки;
+- файл ротируется по размеру;
+- очередь ограничена: при переполнении запись отбрасывается и учитывается в dropped;
+- одинаковые сообщения (логгер, уровень, шаблон и sample_key из extra, например чат)
+  проходят не чаще sample_burst за sample_window секунд, остальные учитываются в sampled,
+  а их число дописывается к следующей записи с тем же ключом;
+- воркеры (sharding.py) отправляют записи в очередь главного процесса (forward/listen),
+  поэтому в файл пишет один процесс и ротация не конфликтует.
+"""
+import atexit
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+SAMPLER_MAX_KEYS = 10000  # Ключей сэмплирования в памяти, дальше окна начинаются заново
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который не ждёт места в очереди, а отбрасывает запись
+    lazy - не форматировать в вызывающем потоке (очередь того же процесса)"""
+
+    def __init__(self, log_queue, lazy: bool = True) -> None:
+        super().__init__(log_queue)
+        self.lazy = lazy
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if self.lazy:
+            return record
+        # Запись уходит в другой процесс: аргументы и traceback должны сериализоваться
+        return super().prepare(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает не больше burst одинаковых записей за window секунд"""
+
+    def __init__(self, window: float, burst: int) -> None:
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.sampled = 0
+        # {ключ: [начало окна, пропущено записей, отброшено записей]}
+        self._windows: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.CRITICAL:
+            return True
+        key = (record.name, record.levelno, record.msg, getattr(record, "sample_key", None))
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or record.created - state[0] >= self.window:
+                if state is None and len(self._windows) >= SAMPLER_MAX_KEYS:
+                    self._windows.clear()
+                self._windows[key] = [record.created, 1, 0]
+                if state is not None and state[2]:
+                    record.msg = f"{record.msg} [ещё {state[2]} таких же за {self.window:g} с пропущено]"
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            self.sampled += 1
+            return False
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Очередь ограничена: ждём места, поток вывода её разбирает
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """Очередь записей, фоновый вывод и счётчики"""
+
+    def __init__(self, handler: DroppingQueueHandler, sampler: SamplingFilter, targets: list[logging.Handler]) -> None:
+        self.handler = handler
+        self.sampler = sampler
+        self.targets = targets
+        self._listeners = [_Listener(handler.queue, *targets, respect_handler_level=True)]
+        self._listeners[0].start()
+
+    def listen(self, log_queue) -> None:
+        """Выводит и записи из очереди воркеров (multiprocessing.Queue)"""
+        listener = _Listener(log_queue, *self.targets, respect_handler_level=True)
+        listener.start()
+        self._listeners.append(listener)
+
+    def forward(self, log_queue) -> None:
+        """В процессе-воркере: отправлять записи в очередь главного процесса вместо своего вывода"""
+        self.stop()
+        self.handler.queue = log_queue
+        self.handler.lazy = False
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": self.handler.queue.qsize() if self._listeners else 0,
+            "dropped": self.handler.dropped,
+            "sampled": self.sampler.sampled,
+        }
+
+    def stop(self) -> None:
+        """Выводит оставшиеся записи и останавливает фоновые потоки"""
+        for listener in self._listeners:
+            listener.stop()
+        self._listeners = []
+        for target in self.targets:
+            target.flush()
+
+
+_pipeline: LogPipeline | None = None
+
+
+def setup_logging(
+    level: str = "INFO",
+    path: str | None = "bot.log",
+    max_bytes: int = 10 * 1024 * 1024,
+    backups: int = 5,
+    queue_size: int = 10000,
+    sample_window: float = 10.0,
+    sample_burst: int = 5,
+) -> LogPipeline:
+    """Настраивает корневой логгер: очередь, фоновый вывод в stdout и файл (path=None - только stdout)"""
+    global _pipeline
+    if _pipeline is not None:
+        return _pipeline
+    formatter = logging.Formatter(LOG_FORMAT)
+    targets: list[logging.Handler] = [logging.StreamHandler()]  # Для серверных платформ логи идут в консоль
+    if path:
+        try:
+            targets.append(RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"))
+        except OSError:
+            pass  # На некоторых серверах файловые логи недоступны, используем только stdout
+    for target in targets:
+        target.setFormatter(formatter)
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    sampler = SamplingFilter(sample_window, sample_burst)
+    handler.addFilter(sampler)
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+    _pipeline = LogPipeline(handler, sampler, targets)
+    atexit.register(_pipeline.stop)
+    return _pipeline
+
+
+def current_pipeline() -> LogPipeline | None:
+    """Конвейер, настроенный setup_logging в этом процессе"""
+    return _pipeline
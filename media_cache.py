@@ -0,0 +1,79 @@
+"""Кэш file_id для файлов, уже загруженных в Telegram
+
+Файл загружается один раз, дальше отправляется по file_id. Запись привязана
+к SHA-256 содержимого: если файл на диске заменили, он будет загружен заново.
+"""
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """Хранит {путь: {"sha256": ..., "file_id": ...}} в JSON-файле"""
+
+    def __init__(self, path: str | None) -> None:
+        self.path = path
+        self._entries: dict[str, dict[str, str]] = {}
+        # Хэш файла пересчитываем только при изменении размера/mtime: {путь: ((size, mtime_ns), sha256)}
+        self._hashes: dict[str, tuple[tuple[int, int], str]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError) as exc:
+            logger.error(f"❌ Не удалось прочитать кэш медиа {self.path}: {exc}")
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as exc:
+            logger.error(f"❌ Не удалось сохранить кэш медиа {self.path}: {exc}")
+
+    def _file_hash(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self._hashes.get(file_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        self._hashes[file_path] = (signature, sha256)
+        return sha256
+
+    def get_file_id(self, file_path: str) -> str | None:
+        """Возвращает file_id, если файл уже загружен и не менялся"""
+        entry = self._entries.get(file_path)
+        if not entry:
+            return None
+        if entry.get("sha256") != self._file_hash(file_path):
+            logger.info(f"🔄 Файл {file_path} изменился, будет загружен заново")
+            self.invalidate(file_path)
+            return None
+        return entry.get("file_id")
+
+    def remember(self, file_path: str, file_id: str) -> None:
+        """Запоминает file_id после загрузки файла"""
+        entry = {"sha256": self._file_hash(file_path), "file_id": file_id}
+        if self._entries.get(file_path) != entry:
+            self._entries[file_path] = entry
+            self._save()
+
+    def invalidate(self, file_path: str) -> None:
+        """Забывает file_id (например, Telegram его больше не принимает)"""
+        if self._entries.pop(file_path, None) is not None:
+            self._save()
@@ -0,0 +1,126 @@
+"""Индекс участников целевых чатов, обновляемый событиями chat_member"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE = 6 * 3600  # Секунды, сколько статус из индекса считается доказательством без запроса к API
+
+
+class MembershipIndex:
+    """Кто состоит в целевых чатах/каналах: {чат: {user_id: is_member}}
+
+    Заполняется событиями chat_member (вступил/вышел) и результатами get_chat_member,
+    поэтому проверка известного пользователя не требует запроса к API.
+    Статус старше max_age считается неизвестным: событие о выходе могло не дойти
+    (бот был остановлен или терял права), и его подтверждает новый запрос к API.
+    """
+
+    def __init__(self, targets: list[str], path: str | None = None, max_age: float = MAX_AGE) -> None:
+        self.targets = targets
+        self.path = path
+        self.max_age = max_age
+        # {чат: {user_id: (is_member, когда подтверждён)}}
+        self._members: dict[str, dict[int, tuple[bool, float]]] = {target: {} for target in targets}
+        # Числовые id целевых чатов (узнаём из событий), {chat_id: target}
+        self._chat_ids: dict[int, str] = {}
+        self._by_username = {target.lstrip("@").lower(): target for target in targets}
+        self._dirty = False
+        self._autosave: asyncio.Task | None = None
+
+    def resolve(self, chat_id: int, username: str | None) -> str | None:
+        """Возвращает целевой чат по id/username из события или None"""
+        target = self._chat_ids.get(chat_id)
+        if target is None and username:
+            target = self._by_username.get(username.lower())
+            if target is not None:
+                self._chat_ids[chat_id] = target
+        return target
+
+    def get(self, target: str, user_id: int) -> bool | None:
+        """Статус пользователя в чате или None, если он неизвестен или устарел"""
+        entry = self._members[target].get(user_id)
+        if entry is None or time.time() - entry[1] > self.max_age:
+            return None
+        return entry[0]
+
+    def record(self, target: str, user_id: int, is_member: bool) -> None:
+        """Запоминает подтверждённый событием или API статус пользователя"""
+        self._members[target][user_id] = (is_member, time.time())
+        self._dirty = True
+
+    def forget_chat(self, target: str) -> None:
+        """Сбрасывает данные по чату (например, бот потерял права и не видит события)"""
+        self._members[target].clear()
+        self._dirty = True
+
+    def __len__(self) -> int:
+        return sum(len(members) for members in self._members.values())
+
+    def load(self, members: bool = True) -> None:
+        """Загружает сохранённый индекс с диска (статусы старше max_age отбрасываются)
+        members=False - только id чатов: бот стартовал с drop_pending_updates, и события
+        chat_member, пришедшие пока он был остановлен, потеряны - сохранённым статусам верить нельзя"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as exc:
+            logger.error(f"❌ Не удалось прочитать индекс участников {self.path}: {exc}")
+            return
+        if members:
+            oldest = time.time() - self.max_age
+            for target, entries in data.get("members", {}).items():
+                if target in self._members:
+                    self._members[target] = {
+                        int(user_id): (bool(entry[0]), entry[1])
+                        for user_id, entry in entries.items()
+                        if isinstance(entry, list) and entry[1] >= oldest
+                    }
+        self._chat_ids = {int(chat_id): target for chat_id, target in data.get("chat_ids", {}).items()}
+        logger.info(f"📇 Индекс участников загружен: {len(self)} записей")
+
+    def _snapshot(self) -> dict:
+        return {
+            "members": {target: dict(members) for target, members in self._members.items()},
+            "chat_ids": dict(self._chat_ids),
+        }
+
+    @staticmethod
+    def _write(path: str, snapshot: dict) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    async def save(self) -> None:
+        """Сохраняет индекс на диск, если он менялся (запись в отдельном потоке)"""
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, self.path, self._snapshot())
+        except OSError as exc:
+            self._dirty = True
+            logger.error(f"❌ Не удалось сохранить индекс участников {self.path}: {exc}")
+
+    def start_autosave(self, interval: float = 60.0) -> None:
+        """Периодически сохраняет индекс в фоне"""
+        if self.path and (self._autosave is None or self._autosave.done()):
+            self._autosave = asyncio.create_task(self._autosave_loop(interval))
+
+    async def stop_autosave(self) -> None:
+        """Останавливает автосохранение и сохраняет последние изменения"""
+        if self._autosave is not None:
+            self._autosave.cancel()
+            self._autosave = None
+        await self.save()
+
+    async def _autosave_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.save()
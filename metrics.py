@@ -0,0 +1,329 @@
+"""Метрики бота в текстовом формате Prometheus и эндпоинты состояния
+
+- счётчики и гистограммы с метками хранятся в памяти процесса;
+- вызовы Bot API измеряются в ограничителе частоты (через него проходит каждый запрос);
+- /metrics, /livez и /readyz отдаются встроенным HTTP сервером на локальном порту.
+"""
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import wraps
+from http import HTTPStatus
+from typing import Any, Callable, Iterator
+
+from telegram.error import RetryAfter
+
+from http_server import HttpRequest, HttpResponse, HttpServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Границы корзин гистограмм, секунды (стандартные для Prometheus)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Общая часть метрик: имя, описание, метки"""
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Labels = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def _check(self, labelvalues: Labels) -> Labels:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {labelvalues}")
+        return tuple(str(value) for value in labelvalues)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Монотонный счётчик"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Labels = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        key = self._check(labelvalues)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(self._check(labelvalues), 0)
+
+    def total(self) -> float:
+        """Сумма по всем меткам"""
+        return sum(self._values.values())
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+@dataclass
+class _HistogramSeries:
+    counts: list[int]
+    total: float = 0.0
+    count: int = 0
+
+
+class Histogram(Metric):
+    """Гистограмма длительностей с фиксированными корзинами"""
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: Labels = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[Labels, _HistogramSeries] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        key = self._check(labelvalues)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(counts=[0] * (len(self.buckets) + 1))
+        # Последняя ячейка - значения больше всех границ (+Inf)
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.total += value
+        series.count += 1
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        """Измеряет время выполнения блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def samples(self) -> Iterator[str]:
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(series.total)}"
+            yield f"{self.name}_count{labels} {series.count}"
+
+
+class CallbackMetric(Metric):
+    """Метрика, значения которой берутся из функции при каждом сборе (размеры кэшей, очередей)"""
+
+    def __init__(
+        self, name: str, help_text: str, kind: str, labelnames: Labels,
+        collect: Callable[[], dict[Labels, float]],
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self._collect = collect
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._collect().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, self._check(key))} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Labels = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(
+        self, name: str, help_text: str, labelnames: Labels = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge_callback(
+        self, name: str, help_text: str, labelnames: Labels, collect: Callable[[], dict[Labels, float]]
+    ) -> CallbackMetric:
+        return self._register(CallbackMetric(name, help_text, "gauge", labelnames, collect))
+
+    def counter_callback(
+        self, name: str, help_text: str, labelnames: Labels, collect: Callable[[], dict[Labels, float]]
+    ) -> CallbackMetric:
+        return self._register(CallbackMetric(name, help_text, "counter", labelnames, collect))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        parts = []
+        for metric in self._metrics.values():
+            try:
+                parts.append(metric.render())
+            except Exception:
+                logger.exception(f"Ошибка сбора метрики {metric.name}")
+        return "\n".join(parts) + "\n"
+
+
+class HandlerMetrics:
+    """Время выполнения и ошибки обработчиков обновлений"""
+
+    def __init__(self, registry: MetricsRegistry) -> None:
+        self.seconds = registry.histogram(
+            "bot_handler_duration_seconds", "Время выполнения обработчика", ("handler",)
+        )
+        self.errors = registry.counter(
+            "bot_handler_errors_total", "Исключения, вышедшие из обработчика", ("handler",)
+        )
+        self.route_seconds = registry.histogram(
+            "bot_callback_route_duration_seconds", "Время обработки кнопки по маршруту", ("route",)
+        )
+        self.route_errors = registry.counter(
+            "bot_callback_route_errors_total", "Ошибки обработки кнопки по маршруту", ("route",)
+        )
+
+    def timed(self, name: str) -> Callable:
+        """Декоратор для async-обработчика"""
+        def decorator(handler: Callable) -> Callable:
+            @wraps(handler)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                started = time.perf_counter()
+                try:
+                    return await handler(*args, **kwargs)
+                except Exception:
+                    self.errors.inc(name)
+                    raise
+                finally:
+                    self.seconds.observe(time.perf_counter() - started, name)
+            return wrapper
+        return decorator
+
+    def observe_route(self, route: str, seconds: float, failed: bool) -> None:
+        """Наблюдатель для CallbackRouter"""
+        self.route_seconds.observe(seconds, route)
+        if failed:
+            self.route_errors.inc(route)
+
+
+class ApiMetrics:
+    """Метрики вызовов Bot API по методам
+
+    - bot_api_request_duration_seconds - одна попытка HTTP запроса;
+    - bot_api_call_duration_seconds - весь вызов с ожиданием лимита и повторами;
+    - bot_api_retry_after_total - ответы 429 (RetryAfter);
+    - bot_api_lane_wait_seconds - ожидание лимита по полосам приоритета (ratelimit.py).
+    """
+
+    def __init__(self, registry: MetricsRegistry) -> None:
+        self.requests = registry.counter(
+            "bot_api_requests_total", "Попытки запросов к Bot API", ("method", "outcome")
+        )
+        self.request_seconds = registry.histogram(
+            "bot_api_request_duration_seconds", "Длительность одной попытки запроса к Bot API", ("method",)
+        )
+        self.call_seconds = registry.histogram(
+            "bot_api_call_duration_seconds", "Длительность вызова Bot API с ожиданием лимита", ("method",)
+        )
+        self.retry_after = registry.counter(
+            "bot_api_retry_after_total", "Ответы 429 (RetryAfter) от Bot API", ("method",)
+        )
+        self.lane_wait_seconds = registry.histogram(
+            "bot_api_lane_wait_seconds", "Ожидание лимита Bot API по полосам приоритета", ("lane",)
+        )
+
+    def measured(self, callback: Callable, endpoint: str) -> Callable:
+        """Обёртка, записывающая каждую попытку запроса"""
+
+        async def wrapper(*call_args: Any, **call_kwargs: Any) -> Any:
+            started = time.perf_counter()
+            outcome = "ok"
+            try:
+                return await callback(*call_args, **call_kwargs)
+            except RetryAfter:
+                outcome = "retry_after"
+                self.retry_after.inc(endpoint)
+                raise
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                self.requests.inc(endpoint, outcome)
+                self.request_seconds.observe(time.perf_counter() - started, endpoint)
+
+        return wrapper
+
+
+class Readiness:
+    """Результаты стартовых проверок: бот готов, когда все проверки прошли"""
+
+    def __init__(self) -> None:
+        self.checks: dict[str, tuple[bool, str]] = {}
+
+    def set(self, name: str, ok: bool, detail: str = "") -> None:
+        self.checks[name] = (ok, detail)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.checks) and all(ok for ok, _ in self.checks.values())
+
+    def report(self) -> str:
+        if not self.checks:
+            return "pending: startup checks not finished\n"
+        return "".join(
+            f"{'ok' if ok else 'fail'}: {name}{f' ({detail})' if detail else ''}\n"
+            for name, (ok, detail) in self.checks.items()
+        )
+
+
+def create_metrics_server(
+    registry: MetricsRegistry, readiness: Readiness, is_alive: Callable[[], bool]
+) -> HttpServer:
+    """HTTP сервер с /metrics, /livez и /readyz"""
+    server = HttpServer(max_connections=10)
+
+    async def metrics(request: HttpRequest) -> HttpResponse:
+        return HttpResponse(HTTPStatus.OK, registry.render().encode(), content_type=CONTENT_TYPE)
+
+    async def livez(request: HttpRequest) -> HttpResponse:
+        if is_alive():
+            return HttpResponse(HTTPStatus.OK, b"ok\n")
+        return HttpResponse(HTTPStatus.SERVICE_UNAVAILABLE, b"not running\n")
+
+    async def readyz(request: HttpRequest) -> HttpResponse:
+        status = HTTPStatus.OK if is_alive() and readiness.ready else HTTPStatus.SERVICE_UNAVAILABLE
+        return HttpResponse(status, readiness.report().encode())
+
+    server.route("GET", "/metrics", metrics)
+    server.route("GET", "/livez", livez)
+    server.route("GET", "/readyz", readyz)
+    return server
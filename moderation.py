@@ -0,0 +1,61 @@
+"""Состояние модерации группы по пользователям: одно предупреждение за окно"""
+import time
+from dataclasses import dataclass
+
+from cache import TTLCache
+
+
+@dataclass
+class OffenderState:
+    """Неподписанный пользователь, который пишет в группу"""
+    flagged_at: float
+    last_warning_at: float = 0.0
+    deleted_messages: int = 0
+
+
+class GroupModeration:
+    """Учёт нарушителей в скользящем окне
+
+    - нарушитель попадает в негативный кэш на window секунд, за это время его
+      сообщения удаляются без повторной проверки подписки через API;
+    - предупреждение отправляется не чаще одного раза за window секунд,
+      остальные сообщения только удаляются.
+    """
+
+    def __init__(self, window: float, max_entries: int) -> None:
+        self.window = window
+        self._offenders = TTLCache(max_entries=max_entries, ttl=window)
+        self.warnings_sent = 0
+        self.warnings_suppressed = 0
+
+    def get(self, user_id: int) -> OffenderState | None:
+        """Нарушитель из негативного кэша (подписку заново не проверяем)"""
+        return self._offenders.get(user_id)
+
+    def flag(self, user_id: int) -> OffenderState:
+        """Запоминает пользователя как неподписанного"""
+        state = OffenderState(flagged_at=time.monotonic())
+        self._offenders.set(user_id, state)
+        return state
+
+    def clear(self, user_id: int) -> None:
+        """Убирает пользователя из нарушителей (например, он подписался)"""
+        self._offenders.pop(user_id)
+
+    def should_warn(self, state: OffenderState) -> bool:
+        """Учитывает удалённое сообщение и решает, нужно ли предупреждение"""
+        now = time.monotonic()
+        state.deleted_messages += 1
+        if now - state.last_warning_at >= self.window:
+            state.last_warning_at = now
+            self.warnings_sent += 1
+            return True
+        self.warnings_suppressed += 1
+        return False
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "offenders": len(self._offenders),
+            "warnings_sent": self.warnings_sent,
+            "warnings_suppressed": self.warnings_suppressed,
+        }
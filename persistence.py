@@ -0,0 +1,220 @@
+"""Сохранение context.user_data (шаг воронки пользователя) между перезапусками
+
+В отличие от PicklePersistence, файл не переписывается целиком:
+- пользователь подгружается из SQLite при первом обновлении от него (refresh_user_data);
+- при сбросе пишутся только пользователи, чьи данные действительно изменились (upsert),
+  поэтому стоимость сброса зависит от активности, а не от числа участников.
+Значения user_data должны сериализоваться в JSON (в боте это флаги и названия соцсетей).
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import HOT_MAX_ENTRIES, database_path
+
+logger = logging.getLogger(__name__)
+
+EMPTY = "{}"
+
+
+class SqliteUserDataPersistence(BasePersistence[dict, dict, dict]):
+    """Инкрементальное хранение user_data в таблице user_data (chat_data и bot_data не храним)"""
+
+    def __init__(self, path: str, update_interval: float = 10, max_known: int = HOT_MAX_ENTRIES) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._reader = self._connect()
+        self._writer = self._connect()
+        self._create_schema(self._reader)
+        # Последнее сохранённое состояние загруженных пользователей (JSON), по нему
+        # отсекаются неизменившиеся данные. Не больше max_known, давно не обращавшиеся вытесняются
+        self._saved: OrderedDict[int, str] = OrderedDict()
+        self.max_known = max_known
+        # Ждут записи: {user_id: JSON | None}, None - удалить
+        self._pending: dict[int, str | None] = {}
+        self._write_lock = asyncio.Lock()
+        self.loaded = 0
+        self.written = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_data (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    async def get_user_data(self) -> dict[int, dict]:
+        # Всех пользователей при запуске не загружаем - только по первому обновлению
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._saved:
+            self._saved.move_to_end(user_id)
+            return
+        if user_id in self._pending:
+            # Ещё не записано в базу: актуальное состояние - в очереди (None - удалено)
+            self._remember(user_id, self._pending[user_id] or EMPTY)
+            return
+        # Чтение по первичному ключу из WAL-базы быстрее перехода в поток
+        row = self._reader.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        encoded = row[0] if row else EMPTY
+        self._remember(user_id, encoded)
+        if row:
+            self.loaded += 1
+            for key, value in json.loads(encoded).items():
+                # То, что обработчики уже записали, не затираем
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        try:
+            encoded = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        except (TypeError, ValueError) as exc:
+            logger.error(f"❌ user_data пользователя {user_id} не сериализуется в JSON: {exc}")
+            return
+        if self._saved.get(user_id, EMPTY) == encoded:
+            return
+        self._remember(user_id, encoded)
+        self._pending[user_id] = encoded
+        await self._write_pending()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._remember(user_id, EMPTY)
+        self._pending[user_id] = None
+        await self._write_pending()
+
+    def _remember(self, user_id: int, encoded: str) -> None:
+        self._saved[user_id] = encoded
+        self._saved.move_to_end(user_id)
+        # Вытесненный пользователь при следующем обновлении прочитается из базы (или из очереди записи)
+        while len(self._saved) > self.max_known:
+            self._saved.popitem(last=False)
+
+    async def _write_pending(self) -> None:
+        # Application вызывает update_user_data для всех пользователей разом: первый
+        # вызов пишет всё накопленное одной транзакцией, остальные находят очередь пустой
+        async with self._write_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+                self.written += len(batch)
+            except sqlite3.Error as exc:
+                logger.error(f"❌ Ошибка записи user_data в {self.path}: {exc}")
+                # Возвращаем в очередь, если данные не успели измениться снова
+                for user_id, encoded in batch.items():
+                    self._pending.setdefault(user_id, encoded)
+
+    def _write_batch(self, batch: dict[int, str | None]) -> None:
+        conn = self._writer
+        now = time.time()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                """
+                INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                """,
+                [(user_id, encoded, now) for user_id, encoded in batch.items() if encoded is not None],
+            )
+            conn.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(user_id,) for user_id, encoded in batch.items() if encoded is None],
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def count_true(self, keys: Iterable[str], owns: Callable[[int], bool] | None = None) -> dict[str, int]:
+        """Сколько пользователей с user_data[key] == True (для начальной статистики, вызывать в потоке)
+        owns - считать только пользователей этого процесса"""
+        # Своё соединение: общее _reader читает в event loop (refresh_user_data)
+        conn = self._connect()
+        try:
+            where = "json_extract(data, ?) = 1"
+            if owns is not None:
+                conn.create_function("owns", 1, owns, deterministic=True)
+                where += " AND owns(user_id)"
+            return {
+                key: conn.execute(f"SELECT COUNT(*) FROM user_data WHERE {where}", (f'$."{key}"',)).fetchone()[0]
+                for key in keys
+            }
+        finally:
+            conn.close()
+
+    async def flush(self) -> None:
+        await self._write_pending()
+        self._reader.close()
+        self._writer.close()
+
+    def stats(self) -> dict[str, int]:
+        return {"known": len(self._saved), "loaded": self.loaded, "written": self.written}
+
+    # chat_data, bot_data, callback_data и разговоры бот не использует
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> Any:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+
+def create_persistence() -> SqliteUserDataPersistence | None:
+    """Создаёт хранилище user_data рядом с участниками (STORAGE_BACKEND=memory - без сохранения)"""
+    path = database_path()
+    if path is None:
+        return None
+    return SqliteUserDataPersistence(
+        path,
+        update_interval=float(os.getenv("USER_DATA_FLUSH_INTERVAL", "10")),
+    )
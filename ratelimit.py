@@ -0,0 +1,264 @@
+"""Ограничитель частоты запросов к Bot API с приоритетами
+
+Вместо AIORateLimiter (одна очередь на всех): запросы делятся на полосы
+interactive > moderation > cleanup > broadcast. Общий лимит (токен-бакет на весь бот)
+выдаётся строго по приоритету, поэтому ответы на кнопки в личке не ждут, пока
+разойдётся очередь удалений в группе во время наплыва.
+
+- полоса определяется по методу и чату (личка - interactive, удаление сообщений -
+  cleanup, прочие запросы в группу - moderation) или явно через rate_limit_args="<полоса>";
+- отправка сообщений дополнительно ограничена токен-бакетом чата (в группе 20 в минуту,
+  в личке всплеск до PRIVATE_BURST и дальше 1 в секунду);
+- RetryAfter останавливает выдачу токенов всем полосам на указанное время, запрос
+  повторяется до max_retries раз (broadcast - без повторов: его вызывающие сами
+  снижают темп по RetryAfter).
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import ApiMetrics
+
+logger = logging.getLogger(__name__)
+
+LANES = ("interactive", "moderation", "cleanup", "broadcast")  # По убыванию приоритета
+CLEANUP_METHODS = frozenset({"deleteMessage", "deleteMessages"})
+# Методы, которые публикуют сообщение в чат (на них действуют лимиты чата)
+SEND_METHODS = frozenset({"copyMessage", "copyMessages", "forwardMessage", "forwardMessages"})
+GROUP_RATE, GROUP_BURST = 20 / 60, 20  # Не больше 20 сообщений в минуту в группу
+PRIVATE_RATE, PRIVATE_BURST = 1.0, 10
+PRUNE_INTERVAL = 60  # Секунды между удалениями бакетов простаивающих чатов
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до свободного токена"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now: float) -> float:
+        """Забирает токен (в долг, если их нет) и возвращает, сколько ждать своей очереди"""
+        delay = self.delay(now)
+        self.tokens -= 1
+        return delay
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+def _chat_id(data: dict[str, Any]) -> int | str | None:
+    chat_id = data.get("chat_id")
+    if isinstance(chat_id, str):
+        try:
+            return int(chat_id)
+        except ValueError:
+            return chat_id  # @username канала или группы
+    return chat_id
+
+
+def _is_private(chat_id: int | str) -> bool:
+    return isinstance(chat_id, int) and chat_id > 0
+
+
+def classify(endpoint: str, chat_id: int | str | None) -> str:
+    """Полоса запроса по методу и чату"""
+    if chat_id is None or _is_private(chat_id) or endpoint.startswith("getChat"):
+        # Ответы пользователю и проверки подписки в его сценарии
+        return "interactive"
+    if endpoint in CLEANUP_METHODS:
+        return "cleanup"
+    return "moderation"
+
+
+class PriorityRateLimiter(BaseRateLimiter[str]):
+    """Общий и по-чатовые токен-бакеты с приоритетными полосами"""
+
+    @classmethod
+    def shared_by(
+        cls, workers: int, api_metrics: ApiMetrics | None = None, overall_rate: float = 30, **kwargs: Any
+    ) -> "PriorityRateLimiter":
+        """Ограничитель одного из workers процессов с общим токеном: общий лимит и лимит групп
+        делятся поровну (личные чаты поделены между процессами вместе с пользователями)"""
+        return cls(
+            api_metrics,
+            overall_rate=overall_rate / workers,
+            # Бакет меньше одного токена никогда не выдаст запрос
+            overall_burst=max(1.0, overall_rate / workers),
+            group_rate=GROUP_RATE / workers,
+            group_burst=max(1.0, GROUP_BURST / workers),
+            **kwargs,
+        )
+
+    def __init__(
+        self,
+        api_metrics: ApiMetrics | None = None,
+        overall_rate: float = 30,
+        overall_burst: float = 30,
+        max_retries: int = 1,
+        group_rate: float = GROUP_RATE,
+        group_burst: float = GROUP_BURST,
+        chat_limits: bool = True,
+    ) -> None:
+        self.metrics = api_metrics
+        self.max_retries = max_retries
+        # Лимит отправки в группы и каналы (меньше стандартного, если их делят несколько процессов)
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.chat_limits = chat_limits  # False - без лимитов чатов (нагрузочный тест bench.py)
+        # overall_rate <= 0 - без общего лимита
+        self._overall = TokenBucket(overall_rate, overall_burst) if overall_rate > 0 else None
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._lanes: dict[str, deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._paused_until = 0.0
+        self._wakeup: asyncio.Event | None = None
+        self._dispatcher: asyncio.Task | None = None
+        self._pruned_at = time.monotonic()
+
+    async def initialize(self) -> None:
+        if self._dispatcher is None and self._overall is not None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for waiters in self._lanes.values():
+            for future in waiters:
+                future.cancel()
+            waiters.clear()
+
+    def queue_depths(self) -> dict[str, int]:
+        """Запросы, ждущие общего токена, по полосам"""
+        return {lane: len(waiters) for lane, waiters in self._lanes.items()}
+
+    def _chat_bucket(self, chat_id: int | str, now: float) -> TokenBucket:
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            # Полный бакет ничем не отличается от нового - такие чаты можно забыть
+            self._chats = {key: bucket for key, bucket in self._chats.items() if not bucket.full(now)}
+            self._pruned_at = now
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if _is_private(chat_id):
+                bucket = TokenBucket(PRIVATE_RATE, PRIVATE_BURST)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, lane: str) -> None:
+        """Ждёт общий токен в своей полосе"""
+        if self._dispatcher is None:
+            await self.initialize()
+        now = time.monotonic()
+        if not any(self._lanes.values()) and now >= self._paused_until and self._overall.delay(now) == 0:
+            self._overall.reserve(now)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[lane].append(future)
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future in self._lanes[lane]:
+                self._lanes[lane].remove(future)
+            raise
+
+    def _next_waiter(self) -> deque[asyncio.Future] | None:
+        for lane in LANES:
+            waiters = self._lanes[lane]
+            while waiters and waiters[0].done():
+                waiters.popleft()  # Отменённые ожидания
+            if waiters:
+                return waiters
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            waiters = self._next_waiter()
+            if waiters is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            delay = max(self._overall.delay(now), self._paused_until - now)
+            if delay > 0:
+                # После паузы заново выбираем полосу: мог прийти более важный запрос
+                await asyncio.sleep(delay)
+                continue
+            self._overall.reserve(now)
+            waiters.popleft().set_result(None)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: str | None,
+    ) -> Any:
+        chat_id = _chat_id(data)
+        lane = rate_limit_args if rate_limit_args in self._lanes else classify(endpoint, chat_id)
+        if self.metrics is None:
+            return await self._call(callback, args, kwargs, endpoint, chat_id, lane)
+        with self.metrics.call_seconds.time(endpoint):
+            return await self._call(
+                self.metrics.measured(callback, endpoint), args, kwargs, endpoint, chat_id, lane
+            )
+
+    async def _wait(self, endpoint: str, chat_id: int | str | None, lane: str) -> None:
+        """Ждёт токен чата (для отправки сообщений), затем общий токен в своей полосе"""
+        started = time.perf_counter()
+        if chat_id is not None:
+            if self.chat_limits and (endpoint.startswith("send") or endpoint in SEND_METHODS):
+                now = time.monotonic()
+                delay = self._chat_bucket(chat_id, now).reserve(now)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if self._overall is not None:
+                await self._acquire(lane)
+        if self.metrics is not None:
+            self.metrics.lane_wait_seconds.observe(time.perf_counter() - started, lane)
+
+    async def _call(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        chat_id: int | str | None,
+        lane: str,
+    ) -> Any:
+        max_retries = 0 if lane == "broadcast" else self.max_retries
+        for attempt in range(max_retries + 1):
+            await self._wait(endpoint, chat_id, lane)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                delay = float(exc.retry_after) + 0.1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                if attempt == max_retries:
+                    raise
+                logger.info("⏳ Лимит Bot API (%s, %s): повтор через %s с", endpoint, lane, exc.retry_after)
+                await asyncio.sleep(delay)
@@ -0,0 +1,322 @@
+"""Перепроверка подписки всех участников с билетами перед розыгрышем
+
+- участники обходятся страницами по возрастанию user_id; результаты страницы и курсор
+  (последний проверенный user_id) пишутся в SQLite одной транзакцией, поэтому после
+  падения проверка продолжается с последней сохранённой страницы;
+- одновременно идёт не больше concurrency проверок; на RetryAfter все проверки ждут
+  указанное время, а параллельность падает вдвое и потом растёт на 1 после серии успехов;
+- по окончании в папку draws/ пишется снимок подходящих участников (формат draw.py:
+  user_id,tickets), по которому можно провести розыгрыш: python draw.py run --snapshot ...
+"""
+import asyncio
+import csv
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from telegram.error import RetryAfter
+
+from storage import ParticipantStore
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500  # Участников в одной сохраняемой странице
+MAX_ATTEMPTS = 5  # Попыток на участника при ошибках сети/API (RetryAfter не считается)
+INCREASE_AFTER = 50  # Успешных проверок подряд до увеличения параллельности на 1
+
+# Проверка одного участника: True - подписан; исключение - проверить не удалось
+CheckFunc = Callable[[int], Awaitable[bool]]
+
+
+class AdaptiveConcurrency:
+    """Ограничение параллельности, которое уменьшается на RetryAfter (AIMD)"""
+
+    def __init__(self, maximum: int, minimum: int = 1) -> None:
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum
+        self.active = 0
+        self.retry_after = 0
+        self._streak = 0
+        self._resume_at = 0.0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self) -> None:
+        async with self._changed:
+            self.active -= 1
+            self._changed.notify_all()
+
+    def success(self) -> None:
+        self._streak += 1
+        if self._streak >= INCREASE_AFTER and self.limit < self.maximum:
+            self._streak = 0
+            self.limit += 1
+
+    def backoff(self, seconds: float) -> None:
+        """Ответ 429: пауза для всех и параллельность вдвое меньше"""
+        self.retry_after += 1
+        self._streak = 0
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        self.limit = max(self.minimum, self.limit // 2)
+
+
+@dataclass
+class ReverificationRun:
+    """Состояние прохода перепроверки"""
+    run_id: int
+    started_at: float
+    cursor: int = 0  # Последний сохранённый user_id
+    checked: int = 0
+    eligible: int = 0
+    failed: int = 0  # Не удалось проверить за MAX_ATTEMPTS попыток
+    finished_at: float | None = None
+    snapshot_path: str | None = None
+
+
+class Reverification:
+    """Фоновая перепроверка участников с сохранением прогресса"""
+
+    def __init__(
+        self,
+        path: str | None,
+        store: ParticipantStore,
+        concurrency: int = 16,
+        snapshot_dir: str = "draws",
+        name: str | None = None,
+    ) -> None:
+        self.path = path or ":memory:"  # Без базы прогресс живёт только до перезапуска
+        self.store = store
+        self.concurrency = concurrency
+        self.snapshot_dir = snapshot_dir
+        self.name = name  # Ключ розыгрыша: свои таблицы прогресса и имя снимка
+        suffix = f"_{name}" if name else ""
+        self._runs = f"reverify_runs{suffix}"
+        self._results = f"reverify_results{suffix}"
+        self.run: ReverificationRun | None = None
+        self.limiter: AdaptiveConcurrency | None = None
+        self._conn: sqlite3.Connection | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            if self.path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self._runs} (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at REAL NOT NULL,
+                    finished_at REAL,
+                    cursor INTEGER NOT NULL DEFAULT 0,
+                    snapshot_path TEXT
+                );
+                CREATE TABLE IF NOT EXISTS {self._results} (
+                    run_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    eligible INTEGER,
+                    tickets INTEGER NOT NULL,
+                    checked_at REAL NOT NULL,
+                    PRIMARY KEY (run_id, user_id)
+                );
+                """
+            )
+        return self._conn
+
+    def _load_run(self, run_id: int | None = None) -> ReverificationRun | None:
+        """Проход по run_id или последний (с подсчётом результатов)"""
+        conn = self._db()
+        query = f"SELECT run_id, started_at, finished_at, cursor, snapshot_path FROM {self._runs} "
+        row = conn.execute(
+            query + ("WHERE run_id = ?" if run_id else "ORDER BY run_id DESC LIMIT 1"),
+            (run_id,) if run_id else (),
+        ).fetchone()
+        if row is None:
+            return None
+        run_id, started_at, finished_at, cursor, snapshot_path = row
+        checked, eligible, failed = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(eligible = 1), 0), COALESCE(SUM(eligible IS NULL), 0) "
+            f"FROM {self._results} WHERE run_id = ?",
+            (run_id,),
+        ).fetchone()
+        return ReverificationRun(
+            run_id=run_id,
+            started_at=started_at,
+            cursor=cursor,
+            checked=checked,
+            eligible=eligible,
+            failed=failed,
+            finished_at=finished_at,
+            snapshot_path=snapshot_path,
+        )
+
+    def _new_run(self) -> ReverificationRun:
+        started_at = time.time()
+        cursor = self._db().execute(f"INSERT INTO {self._runs} (started_at) VALUES (?)", (started_at,))
+        return ReverificationRun(run_id=cursor.lastrowid, started_at=started_at)
+
+    def _save_page(self, run: ReverificationRun, rows: list[tuple[int, bool | None, int]]) -> None:
+        conn = self._db()
+        now = time.time()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self._results} (run_id, user_id, eligible, tickets, checked_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (run.run_id, user_id, None if eligible is None else int(eligible), tickets, now)
+                    for user_id, eligible, tickets in rows
+                ],
+            )
+            conn.execute(f"UPDATE {self._runs} SET cursor = ? WHERE run_id = ?", (run.cursor, run.run_id))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def _write_snapshot(self, run: ReverificationRun) -> str:
+        """Подходящие участники в формате снимка draw.py"""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        prefix = f"eligible_{self.name}" if self.name else "eligible"
+        path = os.path.join(self.snapshot_dir, f"{prefix}_{run.run_id}_{time.strftime('%Y%m%d_%H%M%S')}.csv")
+        cursor = self._db().execute(
+            f"SELECT user_id, tickets FROM {self._results} WHERE run_id = ? AND eligible = 1 ORDER BY user_id",
+            (run.run_id,),
+        )
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["user_id", "tickets"])
+            writer.writerows(cursor)
+        self._db().execute(
+            f"UPDATE {self._runs} SET finished_at = ?, snapshot_path = ? WHERE run_id = ?",
+            (time.time(), path, run.run_id),
+        )
+        return path
+
+    def pending_run(self) -> ReverificationRun | None:
+        """Незавершённый проход (после падения или перезапуска)"""
+        run = self._load_run()
+        return run if run is not None and run.finished_at is None else None
+
+    def start(
+        self, check: CheckFunc, on_done: Callable[[ReverificationRun], Awaitable[None]] | None = None
+    ) -> ReverificationRun:
+        """Запускает проход в фоне: продолжает незавершённый или начинает новый"""
+        if self.running:
+            return self.run
+        run = self.pending_run()
+        if run is None:
+            run = self._new_run()
+        else:
+            logger.info(f"🔁 Продолжаю перепроверку #{run.run_id} после user_id {run.cursor} (проверено {run.checked})")
+        self.run = run
+        self.limiter = AdaptiveConcurrency(self.concurrency)
+        self._task = asyncio.create_task(self._run(run, check, on_done))
+        return run
+
+    async def stop(self) -> None:
+        """Останавливает проход (прогресс сохранён до последней страницы)"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(
+        self,
+        run: ReverificationRun,
+        check: CheckFunc,
+        on_done: Callable[[ReverificationRun], Awaitable[None]] | None,
+    ) -> None:
+        started = time.perf_counter()
+        try:
+            while True:
+                user_ids = await asyncio.to_thread(self.store.ticket_holders, run.cursor, PAGE_SIZE)
+                if not user_ids:
+                    break
+                results = await asyncio.gather(*(self._check_user(check, user_id) for user_id in user_ids))
+                rows = []
+                for user_id, eligible in zip(user_ids, results):
+                    record = self.store.get(user_id)
+                    rows.append((user_id, eligible, record.tickets if record else 0))
+                    run.checked += 1
+                    run.eligible += eligible is True
+                    run.failed += eligible is None
+                run.cursor = user_ids[-1]
+                await asyncio.to_thread(self._save_page, run, rows)
+            run.snapshot_path = await asyncio.to_thread(self._write_snapshot, run)
+            run.finished_at = time.time()
+            logger.info(
+                f"✅ Перепроверка #{run.run_id} завершена за {time.perf_counter() - started:.0f} с: "
+                f"проверено {run.checked}, подходят {run.eligible}, не удалось проверить {run.failed}, "
+                f"снимок {run.snapshot_path}"
+            )
+        except asyncio.CancelledError:
+            logger.info(f"⏸ Перепроверка #{run.run_id} остановлена на user_id {run.cursor}")
+            raise
+        except Exception:
+            logger.exception(f"❌ Перепроверка #{run.run_id} прервана на user_id {run.cursor}")
+            return
+        if on_done is not None:
+            await on_done(run)
+
+    async def _check_user(self, check: CheckFunc, user_id: int) -> bool | None:
+        """Проверка с повторами: None - не удалось за MAX_ATTEMPTS попыток"""
+        limiter = self.limiter
+        attempt = 0
+        while True:
+            await limiter.acquire()
+            error = None
+            try:
+                eligible = await check(user_id)
+            except RetryAfter as exc:
+                limiter.backoff(float(exc.retry_after))
+                continue
+            except Exception as exc:
+                error = exc
+            finally:
+                await limiter.release()
+            if error is None:
+                limiter.success()
+                return eligible
+            attempt += 1
+            if attempt >= MAX_ATTEMPTS:
+                logger.warning(f"⚠️ Не удалось перепроверить {user_id}: {error}")
+                return None
+            # Пауза без занятого места: остальные проверки продолжаются
+            await asyncio.sleep(min(30, 2 ** attempt))
+
+    def progress(self) -> dict:
+        """Текущее состояние для /reverify status"""
+        run = self.run or self._load_run()
+        if run is None:
+            return {}
+        return {
+            "run_id": run.run_id,
+            "running": self.running,
+            "checked": run.checked,
+            "eligible": run.eligible,
+            "failed": run.failed,
+            "concurrency": self.limiter.limit if self.limiter else 0,
+            "retry_after": self.limiter.retry_after if self.limiter else 0,
+            "snapshot": run.snapshot_path,
+        }
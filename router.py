@@ -0,0 +1,148 @@
+"""Маршрутизация callback_data кнопок по таблице обработчиков"""
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from telegram import CallbackQuery
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+SLOW_ROUTE_SECONDS = 1.0  # Медленнее этого обработка кнопки попадает в лог
+
+CallbackHandler = Callable[..., Awaitable[None]]
+RouteObserver = Callable[[str, float, bool], None]  # (маршрут, секунды, была ли ошибка)
+
+
+@dataclass
+class RouteStats:
+    """Счётчики времени обработки одного маршрута"""
+    calls: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    @property
+    def avg_seconds(self) -> float:
+        return self.total_seconds / self.calls if self.calls else 0.0
+
+
+@dataclass
+class Route:
+    """Маршрут: обработчик и аргументы, которые ему передаются"""
+    name: str
+    handler: CallbackHandler
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    stats: RouteStats = field(default_factory=RouteStats)
+
+
+class CallbackRouter:
+    """Таблица маршрутов callback_data
+
+    - точное совпадение: поиск в dict за O(1);
+    - префикс: остаток строки передаётся обработчику аргументом `arg`;
+    - регулярное выражение: именованные группы передаются аргументами.
+    Обработчик вызывается как handler(query, context, **аргументы).
+    observer получает время каждой обработки (например, для метрик).
+    """
+
+    def __init__(self, observer: RouteObserver | None = None) -> None:
+        self.observer = observer
+        self._exact: dict[str, Route] = {}
+        self._prefixes: list[tuple[str, Route]] = []
+        self._patterns: list[tuple[re.Pattern, Route]] = []
+
+    def exact(self, data: str, **kwargs: Any) -> Callable[[CallbackHandler], CallbackHandler]:
+        """Декоратор: обработчик для конкретного значения callback_data"""
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            self.add_exact(data, handler, **kwargs)
+            return handler
+        return decorator
+
+    def add_exact(self, data: str, handler: CallbackHandler, **kwargs: Any) -> None:
+        if data in self._exact:
+            raise ValueError(f"Callback route already registered: {data}")
+        self._exact[data] = Route(data, handler, kwargs)
+
+    def prefix(self, prefix: str, **kwargs: Any) -> Callable[[CallbackHandler], CallbackHandler]:
+        """Декоратор: обработчик для callback_data, начинающихся с prefix"""
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            self._prefixes.append((prefix, Route(f"{prefix}*", handler, kwargs)))
+            # Более длинные префиксы проверяем первыми
+            self._prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+            return handler
+        return decorator
+
+    def pattern(self, regex: str, **kwargs: Any) -> Callable[[CallbackHandler], CallbackHandler]:
+        """Декоратор: обработчик для callback_data, подходящих под регулярное выражение"""
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            compiled = re.compile(regex)
+            self._patterns.append((compiled, Route(regex, handler, kwargs)))
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> tuple[Route, dict[str, Any]] | None:
+        """Находит маршрут и аргументы для callback_data"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, route.kwargs
+        for prefix, route in self._prefixes:
+            if data.startswith(prefix):
+                return route, {**route.kwargs, "arg": data[len(prefix):]}
+        for compiled, route in self._patterns:
+            match = compiled.fullmatch(data)
+            if match:
+                return route, {**route.kwargs, **match.groupdict()}
+        return None
+
+    async def dispatch(
+        self, query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, data: str | None = None, **extra: Any
+    ) -> bool:
+        """Вызывает обработчик для query.data (или data, например без префикса розыгрыша),
+        возвращает False, если маршрут не найден. extra передаются обработчику аргументами"""
+        resolved = self.resolve(query.data or "" if data is None else data)
+        if resolved is None:
+            return False
+        route, kwargs = resolved
+        started = time.perf_counter()
+        failed = False
+        try:
+            await route.handler(query, context, **kwargs, **extra)
+        except Exception:
+            failed = True
+            route.stats.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = route.stats
+            stats.calls += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            if self.observer is not None:
+                self.observer(route.name, elapsed, failed)
+            if elapsed >= SLOW_ROUTE_SECONDS:
+                logger.warning("🐢 Медленная кнопка %s: %.2f с", route.name, elapsed)
+        return True
+
+    def routes(self) -> list[Route]:
+        """Все зарегистрированные маршруты"""
+        return [
+            *self._exact.values(),
+            *(route for _, route in self._prefixes),
+            *(route for _, route in self._patterns),
+        ]
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Время обработки по маршрутам: {маршрут: {calls, errors, avg_ms, max_ms}}"""
+        return {
+            route.name: {
+                "calls": route.stats.calls,
+                "errors": route.stats.errors,
+                "avg_ms": round(route.stats.avg_seconds * 1000, 2),
+                "max_ms": round(route.stats.max_seconds * 1000, 2),
+            }
+            for route in self.routes()
+            if route.stats.calls
+        }
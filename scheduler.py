@@ -0,0 +1,128 @@
+"""Отложенное удаление сообщений: одна очередь вместо задачи со sleep на каждое сообщение
+
+Задания лежат в куче по времени срабатывания и периодически сохраняются на диск,
+поэтому переживают перезапуск. Раз в тик все наступившие задания удаляются пачкой
+через deleteMessages (до 100 сообщений одного чата за запрос).
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+
+from telegram import Bot
+
+logger = logging.getLogger(__name__)
+
+TICK_SECONDS = 1.0
+DELETE_BATCH = 100  # Лимит deleteMessages
+
+
+class DeletionScheduler:
+    """Куча заданий (время, чат, сообщение) с сохранением в JSON"""
+
+    def __init__(self, path: str | None) -> None:
+        self.path = path
+        self._heap: list[tuple[float, int, int]] = []
+        self._dirty = False
+        self._bot: Bot | None = None
+        self._task: asyncio.Task | None = None
+        self.deleted = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule_delete(self, chat_id: int, message_id: int, delay: float) -> None:
+        """Удалит сообщение через delay секунд"""
+        heapq.heappush(self._heap, (time.time() + delay, chat_id, message_id))
+        self._dirty = True
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                jobs = json.load(f)
+        except (OSError, ValueError) as exc:
+            logger.error(f"❌ Не удалось прочитать очередь удаления {self.path}: {exc}")
+            return
+        self._heap = [(float(due), int(chat_id), int(message_id)) for due, chat_id, message_id in jobs]
+        heapq.heapify(self._heap)
+        if self._heap:
+            logger.info(f"🧹 Восстановлено отложенных удалений: {len(self._heap)}")
+
+    @staticmethod
+    def _write(path: str, jobs: list[tuple[float, int, int]]) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(jobs, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    async def _save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, self.path, list(self._heap))
+        except OSError as exc:
+            self._dirty = True
+            logger.error(f"❌ Не удалось сохранить очередь удаления {self.path}: {exc}")
+
+    def _pop_due(self) -> dict[int, list[int]]:
+        now = time.time()
+        due: dict[int, list[int]] = defaultdict(list)
+        while self._heap and self._heap[0][0] <= now:
+            _, chat_id, message_id = heapq.heappop(self._heap)
+            due[chat_id].append(message_id)
+            self._dirty = True
+        return due
+
+    async def _delete_batch(self, chat_id: int, message_ids: list[int]) -> None:
+        try:
+            await self._bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+            self.deleted += len(message_ids)
+        except Exception as exc:
+            # Сообщения уже удалены или нет прав - повторять бессмысленно
+            self.failed += len(message_ids)
+            logger.debug("Delete batch failed chat=%s count=%d: %s", chat_id, len(message_ids), exc)
+
+    async def run_due(self) -> None:
+        """Удаляет все наступившие сообщения"""
+        batches = [
+            self._delete_batch(chat_id, message_ids[i:i + DELETE_BATCH])
+            for chat_id, message_ids in self._pop_due().items()
+            for i in range(0, len(message_ids), DELETE_BATCH)
+        ]
+        if batches:
+            await asyncio.gather(*batches)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(TICK_SECONDS)
+            try:
+                await self.run_due()
+                await self._save()
+            except Exception:
+                logger.exception("Ошибка в очереди отложенного удаления")
+
+    def start(self, bot: Bot) -> None:
+        """Загружает сохранённые задания и запускает тики"""
+        self._bot = bot
+        self._load()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Останавливает тики и сохраняет оставшиеся задания"""
+        if self._task is not None:
+            self._task.cancel()
+            # Дожидаемся отмены: тик, который сейчас сохраняет очередь, не перезапишет финальный файл
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._save()
+
+    def stats(self) -> dict[str, int]:
+        return {"pending": len(self._heap), "deleted": self.deleted, "failed": self.failed}
@@ -0,0 +1,239 @@
+"""Защита от повторных скриншотов: один и тот же снимок не даёт билет дважды
+
+- точный повтор ловится по file_unique_id (одинаков у одного файла для всех ботов и пользователей);
+- похожие изображения (пересжатые, обрезанные по краям, найденные в интернете) - по
+  перцептивному хэшу dHash (64 бита) и расстоянию Хэмминга;
+- поиск близких хэшей - multi-index hashing: хэш режется на max_distance + 1 частей, и по
+  принципу Дирихле у близкого хэша хотя бы одна часть совпадает точно, поэтому
+  проверяются только кандидаты из нескольких корзин, а не весь индекс.
+Хэш считается вне event loop (в пуле проверки скриншотов, см. verification.py).
+В многопроцессном режиме (shared) индекс перед каждой записью дочитывает из общей
+таблицы строки, добавленные другими воркерами, поэтому повторы ловятся между процессами.
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+
+try:
+    from PIL import Image
+except ImportError:  # Без Pillow остаётся только проверка по file_unique_id
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+HASH_SIZE = 8  # dHash 8x8 -> 64 бита
+
+
+def dhash_image(image: "Image.Image", size: int = HASH_SIZE) -> int:
+    """Разностный хэш (size*size бит): яркость соседних пикселей уменьшенного серого изображения"""
+    pixels = image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR).tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _to_signed(value: int) -> int:
+    # SQLite хранит INTEGER как знаковое 64-битное число
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+class HammingIndex:
+    """Индекс 64-битных хэшей с поиском в пределах max_distance бит"""
+
+    def __init__(self, max_distance: int) -> None:
+        self.max_distance = max_distance
+        parts = max_distance + 1
+        # Ширины частей отличаются не больше чем на бит
+        widths = [HASH_BITS // parts + (1 if i < HASH_BITS % parts else 0) for i in range(parts)]
+        self._slices: list[tuple[int, int]] = []
+        shift = 0
+        for width in widths:
+            self._slices.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables: list[dict[int, list[int]]] = [{} for _ in self._slices]
+        self._hashes: list[int] = []
+        self._keys: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, value: int, key: str) -> None:
+        position = len(self._hashes)
+        self._hashes.append(value)
+        self._keys.append(key)
+        for table, (shift, mask) in zip(self._tables, self._slices):
+            table.setdefault((value >> shift) & mask, []).append(position)
+
+    def search(self, value: int) -> tuple[str, int] | None:
+        """Ближайший сохранённый хэш: (ключ, расстояние) или None"""
+        best: tuple[str, int] | None = None
+        seen: set[int] = set()
+        for table, (shift, mask) in zip(self._tables, self._slices):
+            for position in table.get((value >> shift) & mask, ()):
+                if position in seen:
+                    continue
+                seen.add(position)
+                distance = (self._hashes[position] ^ value).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (self._keys[position], distance)
+                    if distance == 0:
+                        return best
+        return best
+
+
+@dataclass
+class Submission:
+    """Результат проверки скриншота"""
+    file_unique_id: str
+    phash: int | None
+    duplicate_of: str | None = None  # file_unique_id ранее присланного скриншота
+    distance: int | None = None  # 0 - тот же файл или идентичная картинка
+
+    @property
+    def is_duplicate(self) -> bool:
+        return self.duplicate_of is not None
+
+    @property
+    def is_same_file(self) -> bool:
+        """Повтор того же файла, а не похожая картинка"""
+        return self.duplicate_of == self.file_unique_id
+
+
+class ScreenshotIndex:
+    """Скриншоты участников: file_unique_id и перцептивные хэши (в SQLite или только в памяти)
+    shared - таблицу пополняют и другие процессы (воркеры sharding.py)"""
+
+    def __init__(self, path: str | None, max_distance: int = 6, shared: bool = False) -> None:
+        self.path = path
+        self.shared = shared
+        self._hashes = HammingIndex(max_distance)
+        self._files: dict[str, int] = {}  # file_unique_id -> user_id
+        self._conn: sqlite3.Connection | None = None
+        self._last_rowid = 0  # Последняя строка таблицы, попавшая в индекс
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.unhashed = 0
+
+    def load(self) -> None:
+        """Загружает ранее присланные скриншоты в индекс"""
+        if Image is None:
+            logger.warning("⚠️ Pillow не установлен: похожие скриншоты не распознаются, только повтор файла")
+        if not self.path or self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS screenshots (
+                file_unique_id TEXT PRIMARY KEY,
+                phash INTEGER,
+                user_id INTEGER NOT NULL,
+                social TEXT,
+                duplicate_of TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._apply(self._fetch_new())
+        if self._files:
+            logger.info(f"🖼 Загружено скриншотов: {len(self._files)} (хэшей: {len(self._hashes)})")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _remember(self, file_unique_id: str, phash: int | None, user_id: int) -> None:
+        self._files[file_unique_id] = user_id
+        if phash is not None:
+            self._hashes.add(phash, file_unique_id)
+
+    def _fetch_new(self) -> list[tuple]:
+        """Строки таблицы после уже прочитанных (по rowid - без обхода всей таблицы)"""
+        return self._conn.execute(
+            "SELECT rowid, file_unique_id, phash, user_id FROM screenshots WHERE rowid > ? ORDER BY rowid",
+            (self._last_rowid,),
+        ).fetchall()
+
+    def _apply(self, rows: list[tuple]) -> None:
+        for rowid, file_unique_id, phash, user_id in rows:
+            self._last_rowid = max(self._last_rowid, rowid)
+            # Свои строки уже в индексе (record запоминает до записи в базу)
+            if file_unique_id not in self._files:
+                self._remember(file_unique_id, None if phash is None else _to_unsigned(phash), user_id)
+
+    async def sync(self) -> None:
+        """Дочитывает скриншоты, сохранённые другими процессами (только в режиме shared)"""
+        if self.shared and self._conn is not None:
+            self._apply(await asyncio.to_thread(self._fetch_new))
+
+    def check_exact(self, file_unique_id: str) -> Submission | None:
+        """Повтор того же файла (без скачивания; в режиме shared - по уже дочитанной части таблицы,
+        окончательно повтор проверяет record)"""
+        if file_unique_id not in self._files:
+            return None
+        self.exact_duplicates += 1
+        return Submission(file_unique_id, None, duplicate_of=file_unique_id, distance=0)
+
+    async def record(
+        self, file_unique_id: str, phash: int | None, user_id: int, social: str | None
+    ) -> Submission:
+        """Ищет похожий скриншот и запоминает новый (дубликаты тоже, с пометкой duplicate_of)"""
+        await self.sync()
+        # Проверка и запись в индекс идут без переключений event loop
+        exact = self.check_exact(file_unique_id)
+        if exact is not None:
+            return exact
+        submission = Submission(file_unique_id, phash)
+        if phash is None:
+            self.unhashed += 1
+        else:
+            match = self._hashes.search(phash)
+            if match is not None:
+                self.near_duplicates += 1
+                submission.duplicate_of, submission.distance = match
+        self._remember(file_unique_id, phash, user_id)
+        if self._conn is not None:
+            await asyncio.to_thread(self._insert, submission, user_id, social)
+        return submission
+
+    def _insert(self, submission: Submission, user_id: int, social: str | None) -> None:
+        try:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO screenshots "
+                "(file_unique_id, phash, user_id, social, duplicate_of, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    submission.file_unique_id,
+                    None if submission.phash is None else _to_signed(submission.phash),
+                    user_id,
+                    social,
+                    submission.duplicate_of,
+                    time.time(),
+                ),
+            )
+        except sqlite3.Error as exc:
+            logger.error(f"❌ Не удалось сохранить скриншот {submission.file_unique_id}: {exc}")
+
+    def owner(self, file_unique_id: str) -> int | None:
+        """Кто прислал скриншот первым"""
+        return self._files.get(file_unique_id)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "screenshots": len(self._files),
+            "hashed": len(self._hashes),
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "unhashed": self.unhashed,
+        }
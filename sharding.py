@@ -0,0 +1,288 @@
+"""Многопроцессный режим: обновления распределяются по воркерам по user_id
+
+Фронт-процесс (polling или вебхук) получает сырые обновления и по согласованному
+хэшу user_id отправляет их в один из N процессов-воркеров. Все обновления одного
+пользователя попадают в один и тот же воркер, поэтому его горячий набор в хранилище
+участников и состояние диалога живут только там. Команды администратора о другом
+пользователе (ROUTED_COMMANDS) уходят в воркер этого пользователя. Обновления получает только фронт,
+так что воркеры не конфликтуют друг с другом (ошибки Conflict не возникают).
+"""
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import sys
+from http import HTTPStatus
+
+from telegram import Bot, Update
+from telegram.error import Conflict, NetworkError, RetryAfter, TelegramError, TimedOut
+
+from http_server import HttpRequest, HttpResponse, HttpServer
+from logs import current_pipeline
+from webhook import SECRET_HEADER, WebhookConfig, running_application, set_webhook, wait_for_stop_signal
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30  # Секунды long polling во фронт-процессе
+WORKER_CHECK_INTERVAL = 2.0  # Как часто проверяем, живы ли воркеры
+CONFLICT_BACKOFF = 5.0  # Пауза, если обновления получает другой экземпляр бота
+LOG_QUEUE_SIZE = 10000  # Записи лога от воркеров, ждущие вывода в главном процессе
+# Команды администратора, которые меняют или читают данные другого пользователя
+ROUTED_COMMANDS = ("/tickets",)
+
+# Поля обновления, в которых лежит объект с отправителем ("from")
+_UPDATE_FIELDS = (
+    "message",
+    "edited_message",
+    "callback_query",
+    "inline_query",
+    "chosen_inline_result",
+    "shipping_query",
+    "pre_checkout_query",
+    "poll_answer",
+    "chat_join_request",
+    "message_reaction",
+    "channel_post",
+    "edited_channel_post",
+)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach): при изменении числа воркеров переезжает минимум ключей"""
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def command_target(message: dict) -> int | None:
+    """Участник из команды администратора ROUTED_COMMANDS (/tickets [розыгрыш] <user_id> ...)"""
+    text = message.get("text") or ""
+    if not text.startswith("/"):
+        return None
+    command, *args = text.split()
+    if command.split("@")[0] not in ROUTED_COMMANDS:
+        return None
+    for arg in args[:2]:
+        if arg.isdigit():
+            return int(arg)
+    return None
+
+
+def routing_key(update: dict) -> int:
+    """Id пользователя, к которому относится сырое обновление (или id чата)"""
+    # Для событий вступления/выхода важен участник, а не тот, кто его добавил
+    for field in ("chat_member", "my_chat_member"):
+        if field in update:
+            return update[field].get("new_chat_member", {}).get("user", {}).get("id", 0)
+    # Команда о другом пользователе выполняется в его воркере: там его билеты и журнал
+    target = command_target(update.get("message") or {})
+    if target is not None:
+        return target
+    for field in _UPDATE_FIELDS:
+        obj = update.get(field)
+        if obj is None:
+            continue
+        sender = obj.get("from") or obj.get("user")
+        if sender:
+            return sender["id"]
+        chat = obj.get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+def _bot_module():
+    """Модуль бота в процессе воркера
+
+    При запуске `python bot.py` spawn уже выполнил bot.py как __mp_main__,
+    повторный `import bot` создал бы второй набор хранилищ и обработчиков логов.
+    """
+    main_module = sys.modules.get("__mp_main__")
+    if hasattr(main_module, "setup_application"):
+        return main_module
+    import bot
+    return bot
+
+
+def _worker_main(
+    index: int, workers: int, token: str, inbox: multiprocessing.Queue, log_queue: multiprocessing.Queue
+) -> None:
+    """Точка входа процесса-воркера"""
+    bot = _bot_module()
+    # Лог пишет главный процесс: ротация файла из нескольких процессов ломается
+    pipeline = current_pipeline()
+    if pipeline is not None:
+        pipeline.forward(log_queue)
+    application = bot.setup_application(token, shard=index, workers=workers)
+    try:
+        asyncio.run(_worker_loop(application, inbox))
+    except KeyboardInterrupt:
+        pass
+    logger.info(f"Воркер {index + 1}/{workers} остановлен")
+
+
+async def _worker_loop(application, inbox: multiprocessing.Queue) -> None:
+    async with running_application(application):
+        while True:
+            raw = await asyncio.to_thread(inbox.get)
+            if raw is None:
+                return
+            await application.update_queue.put(Update.de_json(raw, application.bot))
+
+
+class Supervisor:
+    """Запускает воркеры, перезапускает упавшие и раздаёт им обновления"""
+
+    def __init__(self, token: str, workers: int) -> None:
+        self.token = token
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue() for _ in range(workers)]
+        self._log_queue = self._context.Queue(maxsize=LOG_QUEUE_SIZE)
+        self._processes: list[multiprocessing.Process | None] = [None] * workers
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.workers, self.token, self._queues[index], self._log_queue),
+            name=f"bot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f"🚀 Воркер {index + 1}/{self.workers} запущен (pid {process.pid})")
+
+    def start(self) -> None:
+        pipeline = current_pipeline()
+        if pipeline is not None:
+            pipeline.listen(self._log_queue)
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def alive(self) -> bool:
+        return all(process is not None and process.is_alive() for process in self._processes)
+
+    async def watch(self) -> None:
+        """Перезапускает упавшие воркеры; очередь воркера сохраняется, обновления не теряются"""
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"❌ Воркер {index + 1} завершился с кодом {process.exitcode}, перезапускаю")
+                    self._spawn(index)
+
+    def dispatch(self, update: dict) -> None:
+        """Отправляет сырое обновление воркеру, отвечающему за пользователя"""
+        self._queues[jump_hash(routing_key(update), self.workers)].put(update)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        for queue in self._queues:
+            queue.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+
+async def _poll_updates(supervisor: Supervisor, token: str) -> None:
+    """Фронт в режиме polling: получает обновления и раздаёт воркерам"""
+    async with Bot(token) as bot:
+        await bot.delete_webhook(drop_pending_updates=True)  # Игнорируем старые обновления при запуске
+        offset = 0
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=POLL_TIMEOUT,
+                    allowed_updates=Update.ALL_TYPES,
+                    read_timeout=POLL_TIMEOUT + 10,
+                )
+            except RetryAfter as exc:
+                await asyncio.sleep(exc.retry_after)
+                continue
+            except (TimedOut, NetworkError) as exc:
+                logger.warning(f"⚠️ Ошибка получения обновлений: {exc}")
+                await asyncio.sleep(1)
+                continue
+            except Conflict:
+                # Как error_handler в однопроцессном режиме: не падаем, а ждём, пока второй экземпляр остановится
+                logger.warning(
+                    "⚠️ Conflict: Другой экземпляр бота получает обновления. "
+                    "Убедись, что локальный бот остановлен. Повтор через %.0f с...", CONFLICT_BACKOFF
+                )
+                await asyncio.sleep(CONFLICT_BACKOFF)
+                continue
+            except TelegramError as exc:
+                logger.error("❌ Ошибка получения обновлений: %s", exc)
+                await asyncio.sleep(CONFLICT_BACKOFF)
+                continue
+            for update in updates:
+                supervisor.dispatch(update.to_dict())
+                offset = update.update_id + 1
+
+
+def _create_front_server(supervisor: Supervisor, config: WebhookConfig) -> HttpServer:
+    """Фронт в режиме вебхука: принимает сырые обновления без разбора в объекты"""
+    server = HttpServer(max_connections=config.max_connections)
+
+    async def receive_update(request: HttpRequest) -> HttpResponse:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), config.secret_token.encode()):
+            return HttpResponse(HTTPStatus.FORBIDDEN)
+        try:
+            update = json.loads(request.body)
+        except ValueError:
+            return HttpResponse(HTTPStatus.BAD_REQUEST)
+        supervisor.dispatch(update)
+        return HttpResponse(HTTPStatus.OK)
+
+    async def health(request: HttpRequest) -> HttpResponse:
+        if supervisor.alive():
+            return HttpResponse(HTTPStatus.OK, b"ok")
+        return HttpResponse(HTTPStatus.SERVICE_UNAVAILABLE, b"worker down")
+
+    server.route("POST", config.path, receive_update)
+    server.route("GET", config.health_path, health)
+    return server
+
+
+async def _serve_front(supervisor: Supervisor, token: str, webhook: WebhookConfig | None) -> None:
+    watcher = asyncio.create_task(supervisor.watch())
+    try:
+        if webhook is None:
+            front = asyncio.create_task(_poll_updates(supervisor, token))
+            stop = asyncio.create_task(wait_for_stop_signal())
+            await asyncio.wait({front, stop}, return_when=asyncio.FIRST_COMPLETED)
+            for task in (front, stop):
+                task.cancel()
+            if front.done() and not front.cancelled() and front.exception():
+                raise front.exception()
+        else:
+            server = _create_front_server(supervisor, webhook)
+            await server.start(webhook.listen, webhook.port)
+            try:
+                async with Bot(token) as bot:
+                    await set_webhook(bot, webhook)
+                await wait_for_stop_signal()
+            finally:
+                await server.stop()
+    finally:
+        watcher.cancel()
+
+
+def run_sharded(token: str, workers: int, webhook: WebhookConfig | None = None) -> None:
+    """Запускает фронт и N воркеров; webhook=None - фронт получает обновления через polling"""
+    supervisor = Supervisor(token, workers)
+    supervisor.start()
+    try:
+        asyncio.run(_serve_front(supervisor, token, webhook))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
@@ -0,0 +1,220 @@
+"""Статистика розыгрыша: воронка, распределение билетов, соцсети
+
+Счётчики обновляются при каждом изменении участника (разница между состоянием до и
+после правки), поэтому /stats отвечает без обхода базы. База читается один раз при
+запуске (load): участники сгруппированы по состоянию, дальше только инкременты.
+
+Шаги воронки:
+- started и subscribed - пользователь нажал /start и прошёл проверку подписки; отметка
+  хранится в user_data (сохраняется между перезапусками), чтобы каждый считался один раз;
+- required_done и boosted - из хранилища участников (обязательное условие и хотя бы
+  один дополнительный репост).
+
+В многопроцессном режиме каждый воркер считает только своих пользователей (их изменения
+приходят только к нему) и публикует свои счётчики в общую таблицу giveaway_stats
+(SharedStats); статистика розыгрыша - сумма строк всех воркеров, без обхода участников.
+"""
+import json
+import logging
+import sqlite3
+import time
+from collections import Counter
+from typing import Iterable, MutableMapping, NamedTuple
+
+from storage import UserRecord
+
+logger = logging.getLogger(__name__)
+
+FUNNEL_STEPS = ("started", "subscribed", "required_done", "boosted")
+FLAG_STEPS = ("started", "subscribed")  # Шаги, отмечаемые в user_data
+FLAG_PREFIX = "funnel_"  # Ключи отметок в user_data: funnel_started, funnel_subscribed
+
+
+def _add(counter: Counter, key, delta: int) -> None:
+    # Нулевые значения не храним, чтобы гистограмма не разрасталась
+    value = counter[key] + delta
+    if value:
+        counter[key] = value
+    else:
+        del counter[key]
+
+
+class ParticipantSummary(NamedTuple):
+    """То, что статистика учитывает в записи участника"""
+    tickets: int = 0
+    required_done: bool = False
+    required_social: str | None = None
+    boost_socials: frozenset[str] = frozenset()
+
+    @classmethod
+    def of(cls, record: UserRecord | None) -> "ParticipantSummary":
+        if record is None:
+            return cls()
+        return cls(record.tickets, record.required_done, record.required_social, frozenset(record.boost_socials))
+
+
+class GiveawayStats:
+    """Счётчики по всем участникам с обновлением за O(1)
+    flag_prefix - начало ключей отметок в user_data (у каждого розыгрыша своё)"""
+
+    def __init__(self, flag_prefix: str = FLAG_PREFIX) -> None:
+        self.flag_prefix = flag_prefix
+        self._reset()
+
+    @property
+    def flag_keys(self) -> tuple[str, ...]:
+        """Ключи отметок шагов FLAG_STEPS в user_data"""
+        return tuple(self.flag_prefix + step for step in FLAG_STEPS)
+
+    def _reset(self) -> None:
+        self.steps: Counter[str] = Counter()
+        self.tickets_histogram: Counter[int] = Counter()  # {билетов: участников}, без нулей
+        self.total_tickets = 0
+        self.required_socials: Counter[str] = Counter()  # Выполнено обязательное условие, по соцсетям
+        self.boost_socials: Counter[str] = Counter()  # Дополнительные репосты по соцсетям
+
+    def _apply(self, summary: ParticipantSummary, count: int) -> None:
+        # count - сколько участников в этом состоянии добавить (отрицательное - убрать)
+        if summary.tickets:
+            _add(self.tickets_histogram, summary.tickets, count)
+            self.total_tickets += count * summary.tickets
+        if summary.required_done:
+            self.steps["required_done"] += count
+            if summary.required_social:
+                _add(self.required_socials, summary.required_social, count)
+        if summary.boost_socials:
+            self.steps["boosted"] += count
+            for social in summary.boost_socials:
+                _add(self.boost_socials, social, count)
+
+    def update(self, before: ParticipantSummary, record: UserRecord) -> None:
+        """Учитывает изменение участника: вычитает прежнее состояние и добавляет новое"""
+        after = ParticipantSummary.of(record)
+        if before == after:
+            return
+        self._apply(before, -1)
+        self._apply(after, 1)
+
+    def mark_step(self, user_data: MutableMapping, step: str) -> bool:
+        """Отмечает шаг воронки пользователя (started, subscribed); True - впервые"""
+        key = self.flag_prefix + step
+        if user_data.get(key):
+            return False
+        user_data[key] = True
+        self.steps[step] += 1
+        return True
+
+    def load(self, state_counts: Iterable[tuple[tuple, int]], flag_counts: dict[str, int]) -> None:
+        """Начальные значения: участники по состояниям (ParticipantStore.iter_state_counts)
+        и число отметок flag_keys в user_data. Не вызывать, пока объект обновляется в event loop:
+        новые счётчики собираются в свежем GiveawayStats и подменяют старые целиком"""
+        self._reset()
+        for state, count in state_counts:
+            self._apply(ParticipantSummary(*state), count)
+        for step in FLAG_STEPS:
+            self.steps[step] += flag_counts.get(self.flag_prefix + step, 0)
+        logger.info(
+            f"📊 Статистика загружена: участников с билетами {self.participants}, билетов {self.total_tickets}"
+        )
+
+    @property
+    def participants(self) -> int:
+        """Участники хотя бы с одним билетом"""
+        return sum(self.tickets_histogram.values())
+
+    def funnel(self) -> list[tuple[str, int, float | None]]:
+        """Шаги воронки: (шаг, пользователей, доля от предыдущего шага)"""
+        result = []
+        previous = None
+        for step in FUNNEL_STEPS:
+            count = self.steps[step]
+            result.append((step, count, count / previous if previous else None))
+            previous = count
+        return result
+
+    def state(self) -> dict:
+        """Счётчики в виде JSON для SharedStats (merged складывает такие состояния)"""
+        return {
+            "steps": dict(self.steps),
+            "tickets_histogram": sorted(self.tickets_histogram.items()),
+            "total_tickets": self.total_tickets,
+            "required_socials": dict(self.required_socials),
+            "boost_socials": dict(self.boost_socials),
+        }
+
+    @classmethod
+    def merged(cls, states: Iterable[dict], flag_prefix: str = FLAG_PREFIX) -> "GiveawayStats":
+        """Сумма счётчиков воркеров (state каждого)"""
+        stats = cls(flag_prefix)
+        for state in states:
+            stats.steps.update(state["steps"])
+            for tickets, users in state["tickets_histogram"]:
+                _add(stats.tickets_histogram, tickets, users)
+            stats.total_tickets += state["total_tickets"]
+            stats.required_socials.update(state["required_socials"])
+            stats.boost_socials.update(state["boost_socials"])
+        return stats
+
+    def snapshot(self) -> dict:
+        return {
+            "funnel": {step: self.steps[step] for step in FUNNEL_STEPS},
+            "participants": self.participants,
+            "total_tickets": self.total_tickets,
+            "tickets_histogram": dict(sorted(self.tickets_histogram.items())),
+            "required_socials": dict(self.required_socials.most_common()),
+            "boost_socials": dict(self.boost_socials.most_common()),
+        }
+
+
+class SharedStats:
+    """Счётчики воркеров в общей SQLite-базе: строка на (розыгрыш, воркер)
+    Методы блокирующие (вызывать в потоке), у каждого вызова своё короткое соединение"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS giveaway_stats (
+                    giveaway TEXT NOT NULL,
+                    shard INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (giveaway, shard)
+                )
+                """
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def publish(self, giveaway: str, shard: int, state: str) -> None:
+        """Сохраняет счётчики воркера (state - JSON из GiveawayStats.state)"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO giveaway_stats (giveaway, shard, state, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(giveaway, shard) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+                """,
+                (giveaway, shard, state, time.time()),
+            )
+        finally:
+            conn.close()
+
+    def read(self, giveaway: str, workers: int) -> list[dict]:
+        """Счётчики воркеров розыгрыша (строки воркеров сверх workers остались от прошлых запусков)"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT state FROM giveaway_stats WHERE giveaway = ? AND shard < ?", (giveaway, workers)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [json.loads(state) for state, in rows]
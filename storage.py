@@ -0,0 +1,372 @@
+"""Хранилище участников розыгрыша (билеты, обязательное условие, соцсети)
+
+Горячий набор пользователей держится в памяти, поэтому чтение идёт со скоростью dict.
+SQLite-бэкенд подгружает пользователя лениво при первом обращении и пишет изменения
+пачками в фоновом потоке (write-behind), чтобы обработчики не ждали fsync.
+Горячий набор SQLite-бэкенда ограничен: давно не читавшиеся сохранённые записи
+вытесняются (LRU), а отсутствие пользователя в базе помнится только HOT_MISSING_TTL секунд.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Iterator
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.5  # Секунды между фоновыми сбросами на диск
+FLUSH_BATCH = 500  # Сбрасываем раньше, если накопилось столько изменённых пользователей
+HOT_MAX_ENTRIES = int(os.getenv("STORE_HOT_SIZE", "100000"))  # Записей в горячем наборе SQLite-хранилища
+HOT_MISSING_TTL = 60.0  # Секунды, которые помним, что пользователя нет в базе
+
+
+@dataclass
+class UserRecord:
+    """Состояние одного участника"""
+    tickets: int = 0
+    required_done: bool = False
+    required_social: str | None = None
+    boost_socials: set[str] = field(default_factory=set)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+
+class ParticipantStore:
+    """Хранилище в памяти (данные теряются при перезапуске)"""
+
+    def __init__(self) -> None:
+        # {user_id: UserRecord}
+        self._hot: dict[int, UserRecord] = {}
+        # Многопроцессный режим: owns(user_id) - пользователь обрабатывается этим процессом.
+        # Записи остальных SQLite-хранилище читает из базы мимо горячего набора: их меняет другой процесс
+        self.owns: Callable[[int], bool] | None = None
+
+    def get(self, user_id: int) -> UserRecord | None:
+        """Возвращает запись пользователя без создания новой"""
+        return self._hot.get(user_id)
+
+    @contextmanager
+    def edit(self, user_id: int) -> Iterator[UserRecord]:
+        """Открывает запись на изменение и помечает её для сохранения"""
+        record = self.get(user_id)
+        if record is None:
+            record = UserRecord()
+            self._remember(user_id, record)
+        yield record
+        record.updated_at = time.time()
+        self._mark_dirty(user_id, record)
+
+    def iter_records(self) -> Iterator[tuple[int, UserRecord]]:
+        """Перебирает всех участников"""
+        yield from list(self._hot.items())
+
+    def ticket_holders(self, after_user_id: int, limit: int) -> list[int]:
+        """Следующие limit участников с билетами (user_id > after_user_id) по возрастанию user_id"""
+        return sorted(
+            user_id for user_id, record in self.iter_records() if record.tickets > 0 and user_id > after_user_id
+        )[:limit]
+
+    def iter_state_counts(self) -> Iterator[tuple[tuple[int, bool, str | None, frozenset[str]], int]]:
+        """Число участников с одинаковым состоянием (билеты, условие, соцсеть, доп. соцсети)"""
+        counts: dict[tuple[int, bool, str | None, frozenset[str]], int] = {}
+        for _, record in self.iter_records():
+            state = (record.tickets, record.required_done, record.required_social, frozenset(record.boost_socials))
+            counts[state] = counts.get(state, 0) + 1
+        yield from counts.items()
+
+    def start(self) -> None:
+        """Запускает фоновые задачи хранилища"""
+
+    def flush(self) -> None:
+        """Принудительно сохраняет накопленные изменения"""
+
+    def close(self) -> None:
+        """Сохраняет изменения и освобождает ресурсы"""
+
+    def _remember(self, user_id: int, record: UserRecord) -> None:
+        self._hot[user_id] = record
+
+    def _mark_dirty(self, user_id: int, record: UserRecord) -> None:
+        pass
+
+
+class SqliteParticipantStore(ParticipantStore):
+    """Хранилище в SQLite (WAL) с пакетной фоновой записью
+    table - таблица участников (у каждого розыгрыша своя, см. participants_table)
+    hot_max_entries - лимит горячего набора: вытесняются только уже сохранённые записи"""
+
+    def __init__(self, path: str, table: str = "participants", hot_max_entries: int = HOT_MAX_ENTRIES) -> None:
+        super().__init__()
+        self.path = path
+        self.table = table
+        self.hot_max_entries = hot_max_entries
+        self._hot: OrderedDict[int, UserRecord] = OrderedDict()
+        # Пользователи, которых нет в базе: не ходим за ними в SQLite на каждое сообщение в группе
+        self._missing = TTLCache(max_entries=hot_max_entries, ttl=HOT_MISSING_TTL)
+        # Несохранённые изменения: {user_id: строка таблицы без user_id}
+        self._dirty: dict[int, tuple] = {}
+        self._writing: dict[int, tuple] = {}  # Пакет, который пишется прямо сейчас
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._flusher: threading.Thread | None = None
+        # Соединение потока обработчиков (ленивая подгрузка и ручной flush)
+        self._reader = self._connect()
+        self._reader_lock = threading.Lock()
+        self._create_schema(self._reader, table)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection, table: str) -> None:
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id INTEGER PRIMARY KEY,
+                tickets INTEGER NOT NULL DEFAULT 0,
+                required_done INTEGER NOT NULL DEFAULT 0,
+                required_social TEXT,
+                boost_socials TEXT NOT NULL DEFAULT '',
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    @staticmethod
+    def _row_to_record(row: tuple) -> UserRecord:
+        tickets, required_done, required_social, boost_socials, created_at, updated_at = row
+        return UserRecord(
+            tickets=tickets,
+            required_done=bool(required_done),
+            required_social=required_social,
+            boost_socials=set(filter(None, boost_socials.split(","))),
+            created_at=created_at,
+            updated_at=updated_at,
+        )
+
+    def get(self, user_id: int) -> UserRecord | None:
+        """Запись из горячего набора или из базы (чужие пользователи - всегда из базы)"""
+        if self.owns is not None and not self.owns(user_id):
+            with self._lock:
+                row = self._dirty.get(user_id) or self._writing.get(user_id)
+            return self._row_to_record(row) if row else self._load(user_id)
+        record = self._hot.get(user_id)
+        if record is not None:
+            self._hot.move_to_end(user_id)
+            return record
+        if self._missing.get(user_id):
+            return None
+        record = self._load(user_id)
+        if record is None:
+            self._missing.set(user_id, True)
+        else:
+            self._remember(user_id, record)
+        return record
+
+    def _remember(self, user_id: int, record: UserRecord) -> None:
+        self._missing.pop(user_id)
+        if self.owns is not None and not self.owns(user_id):
+            return
+        self._hot[user_id] = record
+        if len(self._hot) > self.hot_max_entries:
+            self._evict(keep=user_id)
+
+    def _evict(self, keep: int) -> None:
+        """Вытесняет давние записи, освобождая десятую часть лимита за раз
+        Несохранённые записи (и keep, которую сейчас меняют) остаются: иначе подгрузка
+        из базы вернула бы старое значение"""
+        with self._lock:
+            busy = self._dirty.keys() | self._writing.keys() | {keep}
+        excess = len(self._hot) - self.hot_max_entries + self.hot_max_entries // 10
+        victims = [user_id for user_id in islice(self._hot, excess + len(busy)) if user_id not in busy]
+        for user_id in victims[:excess]:
+            del self._hot[user_id]
+
+    def _load(self, user_id: int) -> UserRecord | None:
+        with self._reader_lock:
+            row = self._reader.execute(
+                "SELECT tickets, required_done, required_social, boost_socials, created_at, updated_at "
+                f"FROM {self.table} WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    @staticmethod
+    def _record_to_row(record: UserRecord) -> tuple:
+        return (
+            record.tickets,
+            int(record.required_done),
+            record.required_social,
+            ",".join(sorted(record.boost_socials)),
+            record.created_at,
+            record.updated_at,
+        )
+
+    def _mark_dirty(self, user_id: int, record: UserRecord) -> None:
+        # Значения снимаются сразу после правки: поток записи не читает запись, которую меняет event loop
+        row = self._record_to_row(record)
+        with self._lock:
+            self._dirty[user_id] = row
+            pending = len(self._dirty)
+        if pending >= FLUSH_BATCH:
+            self._wakeup.set()
+
+    def iter_records(self) -> Iterator[tuple[int, UserRecord]]:
+        """Перебирает всех участников из базы (с учётом ещё не сохранённых изменений)"""
+        self.flush()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "SELECT user_id, tickets, required_done, required_social, boost_socials, created_at, updated_at "
+                f"FROM {self.table} ORDER BY user_id"
+            )
+            for row in cursor:
+                yield row[0], self._row_to_record(row[1:])
+        finally:
+            conn.close()
+
+    def ticket_holders(self, after_user_id: int, limit: int) -> list[int]:
+        """Страница участников с билетами по первичному ключу (вызывать в потоке)"""
+        self.flush()
+        with self._reader_lock:
+            rows = self._reader.execute(
+                f"SELECT user_id FROM {self.table} WHERE user_id > ? AND tickets > 0 ORDER BY user_id LIMIT ?",
+                (after_user_id, limit),
+            ).fetchall()
+        return [user_id for user_id, in rows]
+
+    def iter_state_counts(self) -> Iterator[tuple[tuple[int, bool, str | None, frozenset[str]], int]]:
+        """Группировка в SQLite: различных состояний единицы, поэтому это быстрее обхода записей
+        При заданном owns считаются только участники этого процесса"""
+        self.flush()
+        conn = self._connect()
+        try:
+            where = ""
+            if self.owns is not None:
+                conn.create_function("owns", 1, self.owns, deterministic=True)
+                where = "WHERE owns(user_id) "
+            cursor = conn.execute(
+                f"SELECT tickets, required_done, required_social, boost_socials, COUNT(*) FROM {self.table} "
+                f"{where}GROUP BY tickets, required_done, required_social, boost_socials"
+            )
+            for tickets, required_done, required_social, boost_socials, count in cursor:
+                boost = frozenset(filter(None, boost_socials.split(",")))
+                yield (tickets, bool(required_done), required_social, boost), count
+        finally:
+            conn.close()
+
+    def start(self) -> None:
+        """Запускает фоновый поток записи"""
+        if self._flusher is not None:
+            return
+        self._stopping.clear()
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name=f"{self.table}-flusher", daemon=True
+        )
+        self._flusher.start()
+        logger.info(f"💾 Хранилище участников: {self.path} ({self.table})")
+
+    def _flush_loop(self) -> None:
+        writer = self._connect()
+        try:
+            while not self._stopping.is_set():
+                self._wakeup.wait(FLUSH_INTERVAL)
+                self._wakeup.clear()
+                try:
+                    self._write_pending(writer)
+                except Exception:
+                    # Поток записи не должен умирать: иначе все следующие изменения теряются
+                    logger.exception(f"❌ Сбой фоновой записи участников ({self.table})")
+            self._write_pending(writer)
+        finally:
+            writer.close()
+
+    def _write_pending(self, conn: sqlite3.Connection) -> None:
+        # Пакеты пишутся строго по очереди, чтобы старый снимок не перезаписал новый
+        with self._write_lock:
+            self._write_batch(conn)
+
+    def _write_batch(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            self._writing = batch
+        # Запись, изменённая позже, снова попадёт в _dirty новой строкой
+        rows = [(user_id, *row) for user_id, row in batch.items()]
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                f"""
+                INSERT INTO {self.table}
+                    (user_id, tickets, required_done, required_social, boost_socials, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    tickets = excluded.tickets,
+                    required_done = excluded.required_done,
+                    required_social = excluded.required_social,
+                    boost_socials = excluded.boost_socials,
+                    updated_at = excluded.updated_at
+                """,
+                rows,
+            )
+            conn.execute("COMMIT")
+        except Exception as exc:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error(f"❌ Ошибка записи участников в {self.path} ({self.table}): {exc}")
+            # Возвращаем записи в очередь, если их не успели изменить снова
+            with self._lock:
+                for user_id, row in batch.items():
+                    self._dirty.setdefault(user_id, row)
+        finally:
+            with self._lock:
+                self._writing = {}
+
+    def flush(self) -> None:
+        """Синхронно сохраняет накопленные изменения"""
+        with self._reader_lock:
+            self._write_pending(self._reader)
+
+    def close(self) -> None:
+        """Останавливает фоновый поток и сохраняет остаток"""
+        if self._flusher is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+
+def database_path() -> str | None:
+    """Путь к базе из DB_PATH или None, если STORAGE_BACKEND=memory"""
+    if os.getenv("STORAGE_BACKEND", "sqlite").lower() == "memory":
+        return None
+    return os.getenv("DB_PATH", "giveaway.db")
+
+
+def participants_table(namespace: str | None = None) -> str:
+    """Таблица участников розыгрыша (namespace - ключ розыгрыша, None - основной)"""
+    return f"participants_{namespace}" if namespace else "participants"
+
+
+def create_store(namespace: str | None = None) -> ParticipantStore:
+    """Создаёт хранилище по переменным окружения STORAGE_BACKEND и DB_PATH
+    namespace - билеты отдельного розыгрыша (своя таблица в той же базе)"""
+    path = database_path()
+    if path is None:
+        return ParticipantStore()
+    return SqliteParticipantStore(path, participants_table(namespace))
@@ -0,0 +1,82 @@
+"""Выбор победителей: дерево Фенвика против полного перебора"""
+import random
+
+import pytest
+
+from draw import FenwickTree, _uniform, draw_winners
+
+
+def reference_draw(participants: list[tuple[int, int]], winners: int, seed: str) -> list[int]:
+    """Тот же розыгрыш линейным проходом по оставшимся участникам"""
+    remaining = list(participants)
+    result = []
+    for pick in range(min(winners, len(participants))):
+        total = sum(tickets for _, tickets in remaining)
+        if total <= 0:
+            break
+        target = _uniform(seed, pick, total)
+        for index, (user_id, tickets) in enumerate(remaining):
+            if target < tickets:
+                result.append(user_id)
+                remaining[index] = (user_id, 0)
+                break
+            target -= tickets
+    return result
+
+
+def test_find_matches_prefix_sums():
+    rng = random.Random(1)
+    weights = [rng.choice([0, 0, 1, 2, 5, 40]) for _ in range(257)]
+    tree = FenwickTree(weights)
+    for _ in range(50):
+        index = rng.randrange(len(weights))
+        delta = rng.randint(-weights[index], 7)
+        weights[index] += delta
+        tree.add(index, delta)
+        total = sum(weights)
+        for target in rng.sample(range(total), min(total, 40)):
+            prefix = 0
+            for expected, weight in enumerate(weights):
+                if prefix <= target < prefix + weight:
+                    break
+                prefix += weight
+            assert tree.find(target) == expected
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 8, 100, 1000])
+def test_draw_matches_reference(size):
+    rng = random.Random(size)
+    participants = [(user_id, rng.choice([0, 1, 1, 2, 3, 10])) for user_id in range(1, size + 1)]
+    for seed in ("a", "b", "c"):
+        for winners in (1, 3, size, size + 5):
+            assert draw_winners(participants, winners, seed) == reference_draw(participants, winners, seed)
+
+
+def test_winners_are_distinct_and_have_tickets():
+    participants = [(1, 0), (2, 5), (3, 0), (4, 1), (5, 2)]
+    winners = draw_winners(participants, 10, "seed")
+    assert sorted(winners) == [2, 4, 5]
+
+
+def test_draw_is_reproducible():
+    participants = [(user_id, user_id % 7) for user_id in range(1, 500)]
+    assert draw_winners(participants, 5, "fixed") == draw_winners(participants, 5, "fixed")
+    assert draw_winners(participants, 5, "fixed") != draw_winners(participants, 5, "other")
+
+
+def test_pair_probabilities_without_replacement():
+    # P(первый a, второй b) = w_a / W * w_b / (W - w_a)
+    participants = [(1, 1), (2, 2), (3, 3), (4, 4)]
+    total = sum(tickets for _, tickets in participants)
+    weights = dict(participants)
+    rounds = 20000
+    counts: dict[tuple[int, int], int] = {}
+    for seed in range(rounds):
+        pair = tuple(draw_winners(participants, 2, str(seed)))
+        counts[pair] = counts.get(pair, 0) + 1
+    for a in weights:
+        for b in weights:
+            if a == b:
+                continue
+            expected = weights[a] / total * weights[b] / (total - weights[a])
+            assert abs(counts.get((a, b), 0) / rounds - expected) < 0.015
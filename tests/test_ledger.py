@@ -0,0 +1,124 @@
+"""Журнал билетов: снимок, проигрывание хвоста и восстановление после повреждений"""
+import asyncio
+import os
+
+from ledger import REASON_ADMIN, REASON_BOOST_SOCIAL, TicketLedger
+
+SEED = [(1, 3), (2, 1), (3, 0)]  # Билеты, выданные до появления журнала
+
+
+def open_ledger(path, seed=SEED) -> tuple[TicketLedger, set[int]]:
+    ledger = TicketLedger(str(path))
+    touched = ledger.open(seed=lambda: iter(seed))
+    return ledger, touched
+
+
+def close(ledger: TicketLedger) -> None:
+    asyncio.run(ledger.close())
+
+
+def write_events(ledger: TicketLedger) -> None:
+    ledger.record(1, 1, 4, REASON_BOOST_SOCIAL, social="Telegram")
+    ledger.record(4, 1, 1, REASON_ADMIN, admin_id=99, note="ручное")
+    ledger.record(2, -1, 0, REASON_ADMIN, admin_id=99)
+
+
+def test_new_ledger_starts_from_seed(tmp_path):
+    ledger, touched = open_ledger(tmp_path / "t.jsonl")
+    assert ledger.balances == {1: 3, 2: 1}
+    assert touched == set()
+    close(ledger)
+
+
+def test_snapshot_plus_tail_equals_full_replay(tmp_path):
+    path = tmp_path / "t.jsonl"
+    ledger, _ = open_ledger(path)
+    write_events(ledger)
+    asyncio.run(ledger.snapshot())
+    ledger.record(3, 2, 2, REASON_ADMIN)
+    ledger.record(1, -4, 0, REASON_ADMIN)
+    expected = dict(ledger.balances)
+    ledger._file.close()  # Падение: последнего снимка нет
+
+    reopened, touched = open_ledger(path, seed=[])
+    assert reopened.replayed == 2
+    assert touched == {1, 3}
+    assert {user: tickets for user, tickets in reopened.balances.items() if tickets} == {
+        user: tickets for user, tickets in expected.items() if tickets
+    }
+    assert reopened.seq == 5
+    close(reopened)
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    path = tmp_path / "t.jsonl"
+    ledger, _ = open_ledger(path)
+    write_events(ledger)
+    ledger._file.close()
+    size = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b'{"seq":4,"at":1.0,"user_id":5,"del')
+
+    reopened, _ = open_ledger(path)
+    assert os.path.getsize(path) == size
+    assert reopened.seq == 3 and 5 not in reopened.balances
+    event = reopened.record(5, 1, 1, REASON_ADMIN)
+    close(reopened)
+    assert event.seq == 4
+    with open(path, "r", encoding="utf-8") as f:
+        assert f.read().splitlines()[-1] == event.to_line().strip()
+
+
+def test_corrupt_middle_line_keeps_later_events(tmp_path):
+    path = tmp_path / "t.jsonl"
+    ledger, _ = open_ledger(path)
+    write_events(ledger)
+    close(ledger)
+    os.remove(f"{path}.snapshot")
+    with open(path, "rb") as f:
+        lines = f.readlines()
+    lines[1] = b"\x00garbage\n"
+    with open(path, "wb") as f:
+        f.writelines(lines)
+    size = os.path.getsize(path)
+
+    reopened, _ = open_ledger(path)
+    assert os.path.getsize(path) == size  # Ничего не удалено
+    assert reopened.corrupt_lines == 1
+    assert reopened.balances[1] == 4 and reopened.balances[2] == 0
+    assert reopened.seq == 3
+    close(reopened)
+
+
+def test_corrupt_snapshot_keeps_seeded_balances(tmp_path):
+    path = tmp_path / "t.jsonl"
+    ledger, _ = open_ledger(path)
+    ledger.record(2, 1, 2, REASON_ADMIN)
+    close(ledger)
+    with open(f"{path}.snapshot", "wb") as f:
+        f.write(b"not a snapshot")
+
+    reopened, touched = open_ledger(path, seed=[(1, 3), (2, 1)])
+    # Пользователь 1 не менялся после появления журнала - его билеты из хранилища, 2 - из журнала
+    assert reopened.balances == {1: 3, 2: 2}
+    assert touched == {2}
+    assert os.path.exists(f"{path}.snapshot.corrupt")
+    close(reopened)
+    # Новый снимок записан с верными балансами
+    again, _ = open_ledger(path, seed=[])
+    assert again.balances == {1: 3, 2: 2}
+    close(again)
+
+
+def test_history_skips_corrupt_lines_of_user(tmp_path):
+    path = tmp_path / "t.jsonl"
+    ledger, _ = open_ledger(path)
+    write_events(ledger)
+    close(ledger)
+    with open(path, "a", encoding="utf-8") as f:
+        # Строка с нужным user_id, но не разбирается: обрезанный JSON и лишнее поле
+        f.write('{"seq":9,"at":1.0,"user_id":1,"delta":\n')
+        f.write('{"seq":10,"at":2.0,"user_id":1,"delta":1,"balance":5,"reason":"admin","extra":1}\n')
+
+    history = TicketLedger(str(path)).history(1)
+    assert [(event.seq, event.balance) for event in history] == [(1, 4)]
@@ -0,0 +1,100 @@
+"""Маршрутизация кнопок: точные, префиксные и регулярные маршруты и их приоритет"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from router import CallbackRouter
+
+
+def make_router() -> tuple[CallbackRouter, list[tuple[str, dict]]]:
+    router = CallbackRouter()
+    calls: list[tuple[str, dict]] = []
+
+    def handler(name):
+        async def handle(query, context, **kwargs):
+            calls.append((name, kwargs))
+        return handle
+
+    router.add_exact("menu", handler("exact"), screen="main")
+    router.add_exact("social_vk", handler("exact_social"))
+    router.prefix("social_")(handler("social"))
+    router.prefix("social_boost_")(handler("boost"))
+    router.pattern(r"page_(?P<number>\d+)")(handler("page"))
+    router.pattern(r"(?P<anything>.+)_\d+")(handler("fallback"))
+    return router, calls
+
+
+def dispatch(router: CallbackRouter, data: str) -> bool:
+    return asyncio.run(router.dispatch(SimpleNamespace(data=data), context=None))
+
+
+def test_exact_route_passes_kwargs():
+    router, calls = make_router()
+    assert dispatch(router, "menu")
+    assert calls == [("exact", {"screen": "main"})]
+
+
+def test_exact_wins_over_prefix():
+    router, calls = make_router()
+    dispatch(router, "social_vk")
+    assert calls == [("exact_social", {})]
+
+
+def test_prefix_passes_rest_as_arg():
+    router, calls = make_router()
+    dispatch(router, "social_tiktok")
+    assert calls == [("social", {"arg": "tiktok"})]
+
+
+def test_longest_prefix_wins_regardless_of_order():
+    router, calls = make_router()
+    dispatch(router, "social_boost_Telegram")
+    assert calls == [("boost", {"arg": "Telegram"})]
+
+
+def test_prefix_wins_over_pattern():
+    router, calls = make_router()
+    dispatch(router, "social_1")
+    assert calls == [("social", {"arg": "1"})]
+
+
+def test_pattern_passes_named_groups_in_registration_order():
+    router, calls = make_router()
+    dispatch(router, "page_12")
+    dispatch(router, "other_3")
+    assert calls == [("page", {"number": "12"}), ("fallback", {"anything": "other"})]
+
+
+def test_pattern_must_match_whole_string():
+    router, calls = make_router()
+    assert not dispatch(router, "page_12x")
+    assert calls == []
+
+
+def test_unknown_data_is_not_dispatched():
+    router, calls = make_router()
+    assert not dispatch(router, "nothing")
+    assert router.resolve("nothing") is None
+
+
+def test_duplicate_exact_route_is_rejected():
+    router, _ = make_router()
+    with pytest.raises(ValueError):
+        router.add_exact("menu", lambda *args: None)
+
+
+def test_stats_count_calls_and_errors():
+    router = CallbackRouter()
+    observed = []
+    router.observer = lambda name, seconds, failed: observed.append((name, failed))
+
+    @router.prefix("boom_")
+    async def boom(query, context, arg):
+        raise RuntimeError(arg)
+
+    with pytest.raises(RuntimeError):
+        dispatch(router, "boom_1")
+    assert router.stats()["boom_*"]["calls"] == 1
+    assert router.stats()["boom_*"]["errors"] == 1
+    assert observed == [("boom_*", True)]
@@ -0,0 +1,122 @@
+"""Поиск похожих скриншотов: multi-index hashing против линейного перебора, хэш без афиши"""
+import asyncio
+import io
+import os
+import random
+
+import pytest
+
+from screenshots import HASH_BITS, HammingIndex, ScreenshotIndex
+
+POSTER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "story_image.png")
+
+
+def flip_bits(value: int, bits: int, rng: random.Random) -> int:
+    for bit in rng.sample(range(HASH_BITS), bits):
+        value ^= 1 << bit
+    return value
+
+
+def linear_search(hashes: list[tuple[int, str]], value: int, max_distance: int) -> int | None:
+    distances = [(stored ^ value).bit_count() for stored, _ in hashes]
+    best = min(distances, default=None)
+    return best if best is not None and best <= max_distance else None
+
+
+@pytest.mark.parametrize("max_distance", [0, 1, 3, 6, 10])
+def test_search_matches_linear_scan(max_distance):
+    rng = random.Random(max_distance)
+    hashes = [(rng.getrandbits(HASH_BITS), f"key{i}") for i in range(2000)]
+    index = HammingIndex(max_distance)
+    for value, key in hashes:
+        index.add(value, key)
+    distances = dict((key, value) for value, key in hashes)
+    queries = [flip_bits(rng.choice(hashes)[0], rng.randint(0, max_distance + 2), rng) for _ in range(500)]
+    queries += [rng.getrandbits(HASH_BITS) for _ in range(100)]
+    for query in queries:
+        expected = linear_search(hashes, query, max_distance)
+        found = index.search(query)
+        if expected is None:
+            assert found is None
+        else:
+            key, distance = found
+            assert distance == expected == (distances[key] ^ query).bit_count()
+
+
+def test_finds_every_hash_at_max_distance():
+    rng = random.Random(42)
+    max_distance = 6
+    index = HammingIndex(max_distance)
+    values = [rng.getrandbits(HASH_BITS) for _ in range(300)]
+    for i, value in enumerate(values):
+        index.add(value, str(i))
+    for i, value in enumerate(values):
+        key, distance = index.search(flip_bits(value, max_distance, rng))
+        assert distance <= max_distance
+        assert index.search(value) == (str(i), 0)
+
+
+def test_shared_index_sees_other_process(tmp_path):
+    path = str(tmp_path / "screens.db")
+    first = ScreenshotIndex(path, max_distance=4, shared=True)
+    second = ScreenshotIndex(path, max_distance=4, shared=True)
+    first.load()
+    second.load()
+
+    async def scenario():
+        original = await first.record("file-a", 0b1011 << 40, user_id=1, social="Telegram")
+        assert not original.is_duplicate
+        # Тот же файл и пересжатая копия приходят в другой воркер после его запуска
+        same = await second.record("file-a", 0b1011 << 40, user_id=2, social="Telegram")
+        near = await second.record("file-b", (0b1011 << 40) ^ 0b111, user_id=3, social="Telegram")
+        return same, near
+
+    same, near = asyncio.run(scenario())
+    assert same.is_same_file
+    assert near.duplicate_of == "file-a" and near.distance == 3
+    assert second.owner("file-a") == 1
+    first.close()
+    second.close()
+
+
+def story_screenshot(seed: int, poster_scale: float, quality: int = 95) -> bytes:
+    """Скриншот сторис: случайный фон и афиша по центру"""
+    image_module = pytest.importorskip("PIL.Image")
+    draw_module = pytest.importorskip("PIL.ImageDraw")
+    rng = random.Random(seed)
+    image = image_module.new("RGB", (720, 1440))
+    draw = draw_module.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(720), rng.randrange(1440)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle((x, y, x + rng.randrange(50, 300), y + rng.randrange(50, 300)), fill=color)
+    with image_module.open(POSTER_PATH) as poster:
+        width = round(720 * poster_scale)
+        poster = poster.convert("RGB").resize((width, round(width * poster.height / poster.width)))
+        image.paste(poster, ((720 - poster.width) // 2, (1440 - poster.height) // 2))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def test_poster_is_masked_before_hashing():
+    pytest.importorskip("PIL")
+    from verification import poster_fingerprint, verify_screenshot
+
+    poster = poster_fingerprint(POSTER_PATH)
+    first = verify_screenshot(story_screenshot(0, 0.7), poster)
+    other = verify_screenshot(story_screenshot(1, 0.7), poster)
+    recompressed = verify_screenshot(story_screenshot(0, 0.7, quality=40), poster)
+    assert first.ok and other.ok and recompressed.ok
+    # Разные сторис с одной афишей не считаются повтором, пересжатая копия - считается
+    assert (first.phash ^ other.phash).bit_count() > 6
+    assert (first.phash ^ recompressed.phash).bit_count() <= 6
+
+
+def test_fullscreen_poster_is_not_hashed():
+    pytest.importorskip("PIL")
+    from verification import poster_fingerprint, verify_screenshot
+
+    result = verify_screenshot(story_screenshot(0, 1.0), poster_fingerprint(POSTER_PATH))
+    assert result.ok
+    assert result.phash is None
@@ -0,0 +1,80 @@
+"""Распределение пользователей по воркерам (jump consistent hash) и доли лимитов Bot API"""
+import random
+
+from sharding import jump_hash, routing_key
+
+
+def test_single_bucket():
+    assert {jump_hash(key, 1) for key in range(1000)} == {0}
+
+
+def reference_jump_hash(key: int, buckets: int) -> int:
+    """Построчный перенос C-кода из статьи Lamping & Veach (uint64 и double)"""
+    key %= 2**64
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) % 2**64
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def test_matches_reference():
+    keys = random.Random(7).sample(range(-(10**12), 10**12), 2000)
+    for buckets in (1, 2, 5, 16, 1000):
+        assert [jump_hash(key, buckets) for key in keys] == [reference_jump_hash(key, buckets) for key in keys]
+
+
+def test_stable_values():
+    # Зафиксированные значения: от них зависят файлы воркеров (membership.json.shardN, журналы),
+    # смена алгоритма молча перетасует пользователей между процессами
+    keys = (1, 2, 3, 123456789, 10**12, 2**63)
+    assert [jump_hash(key, 1000) for key in keys] == [549, 338, 961, 294, 149, 453]
+    assert [jump_hash(key, 7) for key in keys] == [6, 6, 3, 0, 4, 5]
+
+
+def test_keys_move_only_to_new_bucket():
+    keys = random.Random(8).sample(range(1, 10**12), 20000)
+    for buckets in range(1, 12):
+        for key in keys:
+            before, after = jump_hash(key, buckets), jump_hash(key, buckets + 1)
+            assert after == before or after == buckets
+
+
+def test_moved_share_is_minimal():
+    keys = random.Random(9).sample(range(1, 10**12), 50000)
+    moved = sum(jump_hash(key, 4) != jump_hash(key, 5) for key in keys)
+    assert abs(moved / len(keys) - 1 / 5) < 0.01
+
+
+def test_balance():
+    keys = random.Random(10).sample(range(1, 10**12), 80000)
+    for buckets in (2, 3, 8):
+        counts = [0] * buckets
+        for key in keys:
+            counts[jump_hash(key, buckets)] += 1
+        expected = len(keys) / buckets
+        assert max(abs(count - expected) for count in counts) < expected * 0.03
+
+
+def test_negative_chat_ids_are_valid_keys():
+    for key in (-1001234567890, -1):
+        assert 0 <= jump_hash(key, 7) < 7
+
+
+def test_routing_key_uses_member_not_actor():
+    update = {"chat_member": {"from": {"id": 1}, "new_chat_member": {"user": {"id": 2}}}}
+    assert routing_key(update) == 2
+    assert routing_key({"message": {"from": {"id": 5}, "chat": {"id": -100}}}) == 5
+    assert routing_key({"channel_post": {"chat": {"id": -100}}}) == -100
+
+
+def test_workers_share_token_limits():
+    from ratelimit import GROUP_RATE, PriorityRateLimiter
+
+    workers = 4
+    limiter = PriorityRateLimiter.shared_by(workers, overall_rate=30)
+    assert limiter._overall.rate * workers == 30
+    assert limiter.group_rate * workers == GROUP_RATE
+    # Даже при большом числе воркеров бакет выдаёт хотя бы один запрос
+    assert PriorityRateLimiter.shared_by(64, overall_rate=30)._overall.capacity >= 1
@@ -0,0 +1,63 @@
+"""Статистика воркеров: счётчики своих пользователей и их сумма через общую таблицу"""
+import json
+
+from stats import GiveawayStats, ParticipantSummary, SharedStats
+from storage import SqliteParticipantStore, UserRecord
+
+WORKERS = 3
+
+
+def owner(user_id: int) -> int:
+    return user_id % WORKERS
+
+
+def fill(store: SqliteParticipantStore) -> None:
+    for user_id in range(1, 31):
+        with store.edit(user_id) as record:
+            record.tickets = user_id % 4
+            record.required_done = user_id % 2 == 0
+            record.required_social = "Telegram" if record.required_done else None
+            if user_id % 5 == 0:
+                record.boost_socials.add("VK")
+    store.flush()
+
+
+def test_worker_counters_sum_to_full_stats(tmp_path):
+    path = str(tmp_path / "giveaway.db")
+    store = SqliteParticipantStore(path)
+    store.start()
+    fill(store)
+
+    full = GiveawayStats()
+    full.load(store.iter_state_counts(), {})
+
+    shared = SharedStats(path)
+    for shard in range(WORKERS):
+        store.owns = lambda user_id, shard=shard: owner(user_id) == shard
+        stats = GiveawayStats()
+        stats.load(store.iter_state_counts(), {"funnel_started": shard + 1})
+        shared.publish("main", shard, json.dumps(stats.state()))
+    # Строка воркера из прошлого запуска с большим числом воркеров не учитывается
+    shared.publish("main", WORKERS, json.dumps(full.state()))
+    store.owns = None
+    store.close()
+
+    merged = GiveawayStats.merged(shared.read("main", WORKERS))
+    expected = full.snapshot()
+    expected["funnel"]["started"] = 1 + 2 + 3
+    assert merged.snapshot() == expected
+
+
+def test_merged_stats_keep_incremental_updates():
+    first, second = GiveawayStats(), GiveawayStats()
+    record = UserRecord(tickets=2, required_done=True, required_social="VK")
+    first.update(ParticipantSummary(), record)
+    second.update(ParticipantSummary(), UserRecord(tickets=2))
+    # Участник потерял билеты: гистограмма у второго воркера становится пустой
+    second.update(ParticipantSummary(tickets=2), UserRecord())
+
+    merged = GiveawayStats.merged(json.loads(json.dumps(stats.state())) for stats in (first, second))
+    assert merged.total_tickets == 2
+    assert merged.participants == 1
+    assert dict(merged.tickets_histogram) == {2: 1}
+    assert merged.required_socials["VK"] == 1
@@ -0,0 +1,287 @@
+"""Проверка скриншотов сторис в пуле процессов
+
+Обработчик фото только ставит скриншот в ограниченную очередь и сразу отвечает.
+Задачи очереди скачивают самую большую копию фото и отдают картинку в пул процессов,
+где проверяются:
+- размер и пропорции (вертикальный скриншот телефона);
+- наличие афиши розыгрыша (у каждого розыгрыша своя, отпечатки считаются один раз):
+  окно с пропорциями афиши скользит по уменьшенному скриншоту в нескольких масштабах,
+  и для каждого положения dHash окна сравнивается с dHash афиши;
+заодно считается перцептивный хэш для поиска повторов (screenshots.py). Найденная афиша
+перед этим закрашивается: она одинакова на всех настоящих сторис, и без маски их хэши почти
+совпадают. Если афиша занимает почти весь скриншот, сравнивать нечего - остаётся только
+проверка по file_unique_id.
+Результат возвращается в event loop через on_done задачи. Если очередь заполнена,
+submit возвращает False и обработчик просит прислать скриншот позже.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from telegram import Bot, PhotoSize
+
+from screenshots import Image, dhash_image
+
+logger = logging.getLogger(__name__)
+
+MIN_WIDTH = 360
+MIN_ASPECT, MAX_ASPECT = 1.5, 2.4  # Высота / ширина: от 3:2 до 19.5:9 с запасом
+POSTER_HASH_SIZE = 16  # dHash 16x16 = 256 бит: устойчивее к наложенным стикерам и тексту
+POSTER_MAX_DISTANCE = 72  # Из 256 бит; у посторонних картинок в среднем около 128
+SEARCH_WIDTH = 180  # Ширина уменьшенного скриншота для поиска афиши
+POSTER_SCALES = (1.0, 0.9, 0.8, 0.7, 0.6, 0.5)  # Ширина афиши относительно ширины скриншота
+WINDOW_STEPS = 12  # Шагов окна по каждой оси для одного масштаба
+MAX_MASKED_SHARE = 0.6  # Афиша больше этой доли скриншота - похожие картинки не ищутся
+MASK_FILL = 128  # Серый цвет, которым закрашивается афиша перед хэшем
+
+
+@dataclass
+class PosterFingerprint:
+    """Что нужно процессам пула об афише"""
+    hash: int
+    aspect: float  # Высота / ширина
+
+
+@dataclass
+class VerificationResult:
+    """Итог проверки одного скриншота"""
+    ok: bool
+    reason: str = ""  # not_image, too_small, aspect, no_poster, download_failed, check_failed
+    width: int = 0
+    height: int = 0
+    poster_distance: int | None = None
+    poster_box: tuple[int, int, int, int] | None = None  # Где найдена афиша (left, top, right, bottom)
+    phash: int | None = None  # dHash 64 бита для поиска повторов (без афиши)
+
+
+def poster_fingerprint(path: str) -> PosterFingerprint:
+    with Image.open(path) as image:
+        return PosterFingerprint(hash=dhash_image(image, POSTER_HASH_SIZE), aspect=image.height / image.width)
+
+
+def find_poster(image: "Image.Image", poster: PosterFingerprint) -> tuple[int, tuple[int, int, int, int] | None]:
+    """Минимальное расстояние между dHash афиши и окнами скриншота и ближайшее окно
+    в координатах исходного скриншота"""
+    small = image.convert("L")
+    small = small.resize((SEARCH_WIDTH, max(1, round(SEARCH_WIDTH * small.height / small.width))))
+    width, height = small.size
+    ratio = image.width / width
+    best = POSTER_HASH_SIZE * POSTER_HASH_SIZE
+    box = None
+    for scale in POSTER_SCALES:
+        window_w = round(width * scale)
+        window_h = round(window_w * poster.aspect)
+        if window_h > height:
+            # Афиша выше скриншота (скриншот шире афиши) - вписываем по высоте
+            window_h = height
+            window_w = round(window_h / poster.aspect)
+        step_x = max(1, (width - window_w) // WINDOW_STEPS)
+        step_y = max(1, (height - window_h) // WINDOW_STEPS)
+        for top in range(0, height - window_h + 1, step_y):
+            for left in range(0, width - window_w + 1, step_x):
+                window = small.crop((left, top, left + window_w, top + window_h))
+                distance = (dhash_image(window, POSTER_HASH_SIZE) ^ poster.hash).bit_count()
+                if distance < best:
+                    best = distance
+                    box = tuple(round(v * ratio) for v in (left, top, left + window_w, top + window_h))
+                    if best <= POSTER_MAX_DISTANCE // 2:
+                        return best, box
+    return best, box
+
+
+def masked_hash(image: "Image.Image", box: tuple[int, int, int, int]) -> int | None:
+    """dHash скриншота с закрашенной афишей (None - кроме афиши почти ничего нет)"""
+    left, top, right, bottom = box
+    if (right - left) * (bottom - top) > MAX_MASKED_SHARE * image.width * image.height:
+        return None
+    masked = image.convert("L")
+    masked.paste(MASK_FILL, box)
+    return dhash_image(masked)
+
+
+def verify_screenshot(data: bytes, poster: PosterFingerprint | None) -> VerificationResult:
+    """Проверка в процессе пула (CPU): размеры, пропорции, афиша и dHash"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            width, height = image.size
+            result = VerificationResult(ok=False, width=width, height=height, phash=dhash_image(image))
+            if width < MIN_WIDTH:
+                result.reason = "too_small"
+                return result
+            if not MIN_ASPECT <= height / width <= MAX_ASPECT:
+                result.reason = "aspect"
+                return result
+            if poster is not None:
+                result.poster_distance, result.poster_box = find_poster(image, poster)
+                if result.poster_distance > POSTER_MAX_DISTANCE:
+                    result.reason = "no_poster"
+                    return result
+                result.phash = masked_hash(image, result.poster_box)
+            result.ok = True
+            return result
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return VerificationResult(ok=False, reason="not_image")
+
+
+@dataclass
+class VerificationJob:
+    """Скриншот в очереди и что сделать с результатом"""
+    photo: PhotoSize
+    on_done: Callable[[VerificationResult], Awaitable[None]]
+    poster_path: str | None = None  # Афиша розыгрыша (None - афиша по умолчанию)
+    queued_at: float = 0.0
+
+
+class ScreenshotVerifier:
+    """Ограниченная очередь скриншотов + пул процессов для проверки"""
+
+    def __init__(
+        self,
+        poster_path: str,
+        workers: int,
+        queue_size: int,
+        observer: Callable[[float], None] | None = None,
+    ) -> None:
+        self.poster_path = poster_path
+        self.workers = workers
+        self.observer = observer  # Получает время от постановки в очередь до результата
+        self._queue: asyncio.Queue[VerificationJob] = asyncio.Queue(maxsize=queue_size)
+        self._pool: ProcessPoolExecutor | None = None
+        # Отпечатки афиш: {путь: отпечаток или None, если файла нет}
+        self._posters: dict[str, PosterFingerprint | None] = {}
+        self._bot: Bot | None = None
+        self._tasks: list[asyncio.Task] = []
+        self.in_progress = 0
+        self.rejected_full = 0
+        self.pool_restarts = 0
+        self.results: dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """Проверка работает (без Pillow или при workers=0 скриншоты принимаются как раньше)"""
+        return self._pool is not None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def start(self, bot: Bot) -> None:
+        """Запускает пул процессов и задачи очереди"""
+        if self.workers <= 0:
+            logger.info("🔎 Проверка скриншотов выключена (VERIFY_WORKERS=0)")
+            return
+        if Image is None:
+            logger.warning("⚠️ Pillow не установлен: скриншоты принимаются без проверки")
+            return
+        self._bot = bot
+        await self._poster(self.poster_path)
+        # spawn: дочерние процессы не наследуют потоки и соединения SQLite родителя
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.workers * 2)]
+        logger.info(f"🔎 Проверка скриншотов: {self.workers} процессов, очередь до {self._queue.maxsize}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _poster(self, path: str) -> PosterFingerprint | None:
+        """Отпечаток афиши (считается при первом скриншоте с этой афишей)"""
+        if path not in self._posters:
+            if os.path.exists(path):
+                self._posters[path] = await asyncio.to_thread(poster_fingerprint, path)
+            else:
+                logger.warning(f"⚠️ Афиша {path} не найдена: скриншоты проверяются только по размеру")
+                self._posters[path] = None
+        return self._posters[path]
+
+    async def join(self) -> None:
+        """Ждёт, пока очередь опустеет и все взятые скриншоты будут проверены"""
+        await self._queue.join()
+
+    def submit(self, job: VerificationJob) -> bool:
+        """Ставит скриншот в очередь; False - очередь заполнена"""
+        job.queued_at = time.perf_counter()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected_full += 1
+            return False
+        return True
+
+    def _restart_pool(self, broken: ProcessPoolExecutor) -> None:
+        """Заменяет пул, в котором умер процесс (OOM, падение Pillow): иначе все следующие проверки
+        получали бы BrokenProcessPool. Не удалось запустить новый - проверка выключается"""
+        if self._pool is not broken:
+            return  # Пул уже заменила другая задача очереди
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.pool_restarts += 1
+        try:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        except OSError as exc:
+            self._pool = None
+            logger.error("❌ Не удалось перезапустить пул проверки скриншотов, проверка выключена: %s", exc)
+            return
+        logger.error("❌ Процесс проверки скриншотов завершился аварийно, пул перезапущен")
+
+    async def _verify(self, job: VerificationJob) -> VerificationResult:
+        loop = asyncio.get_running_loop()
+        try:
+            file = await self._bot.get_file(job.photo.file_id)
+            data = bytes(await file.download_as_bytearray())
+        except Exception as exc:
+            logger.warning("⚠️ Не удалось скачать скриншот: %s", exc)
+            return VerificationResult(ok=False, reason="download_failed")
+        poster = await self._poster(job.poster_path or self.poster_path)
+        pool = self._pool
+        if pool is None:
+            return VerificationResult(ok=False, reason="check_failed")
+        try:
+            return await loop.run_in_executor(pool, verify_screenshot, data, poster)
+        except BrokenProcessPool:
+            self._restart_pool(pool)
+        except Exception:
+            logger.exception("Ошибка проверки скриншота")
+        return VerificationResult(ok=False, reason="check_failed")
+
+    async def _consume(self) -> None:
+        # Половина задач скачивает следующие фото, пока другая ждёт пул
+        while True:
+            job = await self._queue.get()
+            self.in_progress += 1
+            try:
+                # Ответ пользователю отправляется всегда: иначе он ждёт до SCREENSHOT_PENDING_TIMEOUT
+                result = await self._verify(job)
+                outcome = "ok" if result.ok else result.reason
+                self.results[outcome] = self.results.get(outcome, 0) + 1
+                if self.observer is not None:
+                    self.observer(time.perf_counter() - job.queued_at)
+                await job.on_done(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка обработки результата проверки скриншота")
+            finally:
+                self.in_progress -= 1
+                self._queue.task_done()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": self.queue_depth,
+            "in_progress": self.in_progress,
+            "rejected_full": self.rejected_full,
+            "pool_restarts": self.pool_restarts,
+            **self.results,
+        }
@@ -0,0 +1,140 @@
+"""Режим вебхука: Telegram сам присылает обновления на встроенный HTTP сервер"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import AsyncIterator
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from http_server import HttpRequest, HttpResponse, HttpServer
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+@dataclass
+class WebhookConfig:
+    """Настройки режима вебхука"""
+    url: str  # Публичный адрес сервиса, например https://bot.onrender.com
+    secret_token: str
+    listen: str = "0.0.0.0"
+    port: int = 8080
+    path: str = "/webhook"
+    max_connections: int = 40  # Одновременных соединений от Telegram (1-100)
+    health_path: str = "/healthz"
+
+    @classmethod
+    def from_env(cls) -> "WebhookConfig":
+        """Собирает настройки из переменных окружения (на Render адрес и порт задаются автоматически)"""
+        url = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")
+        if not url:
+            raise RuntimeError("Set WEBHOOK_URL env variable with the public https address of the bot")
+        return cls(
+            url=url,
+            # Если секрет не задан, генерируем новый при каждом запуске (вебхук всё равно переустанавливается)
+            secret_token=os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32),
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("PORT", "8080")),
+            path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+        )
+
+
+def create_webhook_server(application: Application, config: WebhookConfig) -> HttpServer:
+    """HTTP сервер, который принимает обновления и отдаёт состояние бота"""
+    server = HttpServer(max_connections=config.max_connections)
+
+    async def receive_update(request: HttpRequest) -> HttpResponse:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), config.secret_token.encode()):
+            logger.warning("⚠️ Вебхук: запрос с неверным секретным токеном отклонён")
+            return HttpResponse(HTTPStatus.FORBIDDEN)
+        try:
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError) as exc:
+            logger.warning(f"⚠️ Вебхук: некорректное обновление: {exc}")
+            return HttpResponse(HTTPStatus.BAD_REQUEST)
+        # Обработка идёт в очереди приложения, Telegram сразу получает ответ
+        await application.update_queue.put(update)
+        return HttpResponse(HTTPStatus.OK)
+
+    async def health(request: HttpRequest) -> HttpResponse:
+        if application.running:
+            return HttpResponse(HTTPStatus.OK, b"ok")
+        return HttpResponse(HTTPStatus.SERVICE_UNAVAILABLE, b"starting")
+
+    server.route("POST", config.path, receive_update)
+    server.route("GET", config.health_path, health)
+    return server
+
+
+async def wait_for_stop_signal() -> None:
+    """Ждёт SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остановка по Ctrl+C через KeyboardInterrupt
+    await stop.wait()
+
+
+@asynccontextmanager
+async def running_application(application: Application) -> AsyncIterator[Application]:
+    """Жизненный цикл приложения без Updater (как в run_polling, включая post_* хуки)"""
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        yield application
+    finally:
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def set_webhook(bot: Bot, config: WebhookConfig) -> None:
+    """Регистрирует адрес вебхука в Telegram"""
+    await bot.set_webhook(
+        url=config.url.rstrip("/") + config.path,
+        secret_token=config.secret_token,
+        max_connections=config.max_connections,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=True,  # Игнорируем старые обновления при запуске
+    )
+    logger.info(f"🔗 Вебхук установлен: {config.url.rstrip('/')}{config.path}")
+
+
+async def serve_webhook(application: Application, config: WebhookConfig) -> None:
+    """Запускает бота в режиме вебхука до сигнала остановки"""
+    server = create_webhook_server(application, config)
+    async with running_application(application):
+        await server.start(config.listen, config.port)
+        try:
+            await set_webhook(application.bot, config)
+            await wait_for_stop_signal()
+        finally:
+            await server.stop()
+
+
+def run_webhook(application: Application, config: WebhookConfig) -> None:
+    """Синхронная обёртка для main()"""
+    try:
+        asyncio.run(serve_webhook(application, config))
+    except KeyboardInterrupt:
+        pass